@@ -0,0 +1,315 @@
+import re
+import io
+import math
+import time
+import ctypes
+import logging
+import multiprocessing
+
+import numpy as N
+from astropy.io import fits as pyfits
+
+log = logging.getLogger(__name__)
+
+# Structural keywords of the tile table, recomputed when the table is assembled.
+_TABLE_KEYWORDS = ('NAXIS1', 'NAXIS2', 'PCOUNT', 'THEAP', 'CHECKSUM', 'DATASUM')
+
+# Variable length array column formats (e.g. 1PB(1234)), without the max length.
+_VLA_RE = re.compile(r'^\d*[PQ]')
+_VLA_MAX_RE = re.compile(r'\(\d*\)$')
+
+# CompImageHDU dither_seed values asking for a seed from the clock or from the
+# first tile.
+_DITHER_SEED_CLOCK = 0
+_DITHER_SEED_CHECKSUM = -1
+
+
+def _dither_seed(data, tile_rows, seed):
+    """
+    Resolve ``seed`` into the ZDITHER0 value (1 to 10000) astropy would use
+    for the full image.
+    """
+    if seed == _DITHER_SEED_CHECKSUM:
+        first_tile = N.ascontiguousarray(data[:tile_rows])
+        return (ctypes.c_ulong(first_tile.view(N.uint8).sum()).value % 10000) + 1
+    if seed == _DITHER_SEED_CLOCK:
+        return (sum(int(x) for x in math.modf(time.time())) % 10000) + 1
+    return seed
+
+
+def _compress_strip(args):
+    """
+    Compress a strip of whole tiles and return the rows of its tile table.
+
+    This runs on the worker processes, so it only takes and returns plain
+    picklable objects: the header of the tile table as a string and, for
+    each column, its name, format and values.
+    """
+    strip, header, compression_type, tile_size, options = args
+
+    if header is not None:
+        header = pyfits.Header.fromstring(header)
+
+    hdu = pyfits.CompImageHDU(data=strip, header=header,
+                              compression_type=compression_type,
+                              tile_size=tile_size, **options)
+    buf = io.BytesIO()
+    pyfits.HDUList([pyfits.PrimaryHDU(), hdu]).writeto(buf)
+    buf.seek(0)
+
+    table = pyfits.open(buf, disable_image_compression=True)[1]
+
+    columns = []
+    for col in table.columns:
+        fmt = str(col.format)
+        values = table.data[col.name]
+        if _VLA_RE.match(fmt):
+            fmt = _VLA_MAX_RE.sub('', fmt)
+            values = [N.array(v) for v in values]
+        else:
+            values = N.array(values)
+        columns.append((col.name, fmt, values))
+
+    return table.header.tostring(), columns
+
+
+class TileCompressor(object):
+    """
+    Tile compress images on a pool of worker processes.
+
+    The image is cut into strips holding a whole number of FITS tiles. Each
+    strip is compressed on its own and the rows of the resulting tile tables
+    are concatenated, in order, into a single tile-compressed BINTABLE, read
+    back by astropy or funpack as usual.
+
+    Tiles are compressed independently, except for the dithering of
+    quantized floats, which is seeded by the tile number. Each strip is
+    given the seed its first tile has in the full image, so the table is the
+    one a serial compression with the same seed produces. Strips whose
+    tables have different columns (e.g. only some of them falling back to
+    GZIP_COMPRESSED_DATA) cannot be joined, the image is then compressed
+    as a whole.
+    """
+
+    def __init__(self, processes=None, rows_per_job=256):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.rows_per_job = rows_per_job
+        self._pool = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def start(self):
+        """
+        Start the worker processes now instead of on the first image.
+        """
+        if self.processes > 1 and self._pool is None:
+            log.debug('Starting compression pool with %i processes' % self.processes)
+            self._pool = multiprocessing.Pool(self.processes)
+
+    def _map(self, jobs):
+        if self.processes <= 1 or len(jobs) <= 1:
+            return map(_compress_strip, jobs)
+
+        self.start()
+        return self._pool.map(_compress_strip, jobs)
+
+    def _jobs(self, data, header, compression_type, tile_rows, rows, options):
+        height, width = data.shape
+        tile_size = [width, tile_rows]
+
+        dither_seed = None
+        if data.dtype.kind == 'f' and not options.get('do_not_scale_image_data'):
+            dither_seed = _dither_seed(data, tile_rows, options.get('dither_seed', _DITHER_SEED_CLOCK))
+
+        jobs = []
+        for start in range(0, height, rows):
+            # Only the first strip carries the full header, the others only
+            # need to produce tiles.
+            strip_header = header.tostring() if start == 0 else None
+            strip_options = options
+            if dither_seed is not None:
+                tile = start // tile_rows
+                strip_options = dict(options, dither_seed=((dither_seed - 1 + tile) % 10000) + 1)
+            jobs.append((N.ascontiguousarray(data[start:start + rows]), strip_header,
+                         compression_type, tile_size, strip_options))
+        return jobs
+
+    def compress(self, data, header, compression_type='RICE_1', tile_rows=1, raw=False, **options):
+        """
+        Compress a 2D image.
+
+        :param data: image array (may be a memmap).
+        :param header: image header.
+        :param compression_type: FITS tile compression algorithm.
+        :param tile_rows: number of image rows per tile.
+        :param raw: ``data`` holds the values as stored, to be scaled by the
+                    BZERO and BSCALE of ``header``. They are compressed as
+                    they are.
+        :param options: extra CompImageHDU arguments (quantize_level,
+                        hcomp_scale, ...).
+        :return: tile-compressed BinTableHDU.
+        """
+        height, width = data.shape
+        if raw:
+            options = dict(options, do_not_scale_image_data=True)
+
+        rows = max(tile_rows, (self.rows_per_job // tile_rows) * tile_rows)
+
+        results = self._map(self._jobs(data, header, compression_type, tile_rows, rows, options))
+
+        names = [name for name, fmt, values in results[0][1]]
+        if any([name for name, fmt, values in result[1]] != names for result in results[1:]):
+            log.debug('Tile tables of the strips differ, compressing the image as a whole')
+            results = map(_compress_strip, self._jobs(data, header, compression_type, tile_rows,
+                                                      height, options))
+
+        table_header = pyfits.Header.fromstring(results[0][0])
+
+        columns = []
+        for i, (name, fmt, values) in enumerate(results[0][1]):
+            parts = [result[1][i][2] for result in results]
+            if _VLA_RE.match(fmt):
+                values = [v for part in parts for v in part]
+            else:
+                values = N.concatenate(parts)
+            columns.append(pyfits.Column(name=name, format=fmt, array=values))
+
+        for key in _TABLE_KEYWORDS:
+            table_header.remove(key, ignore_missing=True)
+        table_header['ZNAXIS2'] = height
+
+        # Given a ZIMAGE header, astropy makes a CompImageHDU out of the
+        # table, which then refuses the table as its data, and BZERO and
+        # BSCALE are dropped from table headers. They are put back once the
+        # table is built.
+        cards = table_header.copy()
+        del table_header['ZIMAGE']
+        table = pyfits.BinTableHDU.from_columns(columns, header=table_header)
+        for card in cards.cards:
+            if card.keyword not in table.header:
+                table.header.append(card)
+        return table
+
+    def writeto(self, fname, data, header, compression_type='RICE_1', tile_rows=1, checksum=True, raw=False,
+                **options):
+        """
+        Compress a 2D image and write it as a .fits.fz file.
+        """
+        table = self.compress(data, header, compression_type, tile_rows, raw, **options)
+        pyfits.HDUList([pyfits.PrimaryHDU(), table]).writeto(fname, checksum=checksum)
+
+
+class Codec(object):
+    """
+    A named way of writing frames to disk.
+
+    :param name: name used in ``imageRequest['compress_format']``.
+    :param compression_type: FITS tile compression algorithm, None writes
+                             plain uncompressed FITS.
+    :param tile_rows: image rows per tile.
+    :param accepts: names of the CompImageHDU options the codec understands.
+    :param options: default values for those options.
+    """
+
+    def __init__(self, name, compression_type=None, tile_rows=1, accepts=(), **options):
+        self.name = name
+        self.compression_type = compression_type
+        self.tile_rows = tile_rows
+        self.accepts = tuple(accepts)
+        self.options = options
+
+    def __repr__(self):
+        return '<Codec %s (%s) %s>' % (self.name, self.compression_type, self.options)
+
+    @property
+    def compressed(self):
+        return self.compression_type is not None
+
+    @property
+    def extension(self):
+        return '.fits.fz' if self.compressed else '.fits'
+
+    def with_options(self, **options):
+        """
+        Return a copy of the codec using the given options. Options the
+        codec does not understand are ignored.
+        """
+        merged = dict(self.options)
+        merged.update((k, v) for k, v in options.items() if k in self.accepts)
+        return Codec(self.name, self.compression_type, self.tile_rows, self.accepts, **merged)
+
+    def writeto(self, compressor, fname, data, header, checksum=True, raw=False):
+        """
+        Write a frame to ``fname``.
+
+        :param raw: ``data`` holds the values as stored, e.g. int16 for a
+                    uint16 image with BZERO = 32768, and is written without
+                    scaling it.
+        """
+        if not self.compressed:
+            hdu = pyfits.PrimaryHDU(data=data, header=header, do_not_scale_image_data=raw)
+            if raw:
+                # Dropped by PrimaryHDU when it is given the data.
+                for key in ('BZERO', 'BSCALE'):
+                    if key in header:
+                        hdu.header[key] = header[key]
+            hdu.writeto(fname, checksum=checksum)
+        else:
+            compressor.writeto(fname, data, header, self.compression_type, self.tile_rows,
+                               checksum=checksum, raw=raw, **self.options)
+
+
+_codecs = {}
+
+
+def register_codec(codec):
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    """
+    Return the codec registered as ``name``, or None if there is none.
+    """
+    return _codecs.get(name)
+
+
+def get_codecs():
+    return dict(_codecs)
+
+
+def parse_options(options):
+    """
+    Parse codec options given as "key=value,key=value".
+    """
+    parsed = {}
+    for item in (options or '').split(','):
+        if not item.strip():
+            continue
+        key, value = item.split('=')
+        value = value.strip()
+        try:
+            value = int(value)
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        parsed[key.strip()] = value
+    return parsed
+
+
+register_codec(Codec('none'))
+register_codec(Codec('fits_rice', 'RICE_1'))
+register_codec(Codec('fits_gzip', 'GZIP_1'))
+register_codec(Codec('fits_gzip2', 'GZIP_2'))
+# HCOMPRESS works on 2D tiles, hcomp_scale > 0 makes it lossy.
+register_codec(Codec('fits_hcompress', 'HCOMPRESS_1', tile_rows=16,
+                     accepts=('hcomp_scale', 'hcomp_smooth', 'quantize_level'),
+                     hcomp_scale=0, hcomp_smooth=False))
+# PLIO_1 is not offered: it is meant for masks, the stored values of unsigned
+# 16-bit frames are negative, and with astropy 2.0 large jumps between
+# neighbouring pixels overflow its output buffer.
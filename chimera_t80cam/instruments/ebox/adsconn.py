@@ -0,0 +1,310 @@
+"""
+One ADS connection per PLC, shared by every FSU driver in the process.
+
+ADSConnection multiplexes requests from any number of threads over a
+single AMS/TCP socket. Each request is sent right away with its own
+invoke id and a reader thread hands every answer to the thread waiting
+for it, so a slow request does not hold up the others. The same reader
+delivers ADS change notifications.
+
+It is a drop-in for adshli's ads_connection: ads_var_single, ads_device
+and FSURegisters only use execute_cmd and the AMS address attributes.
+"""
+
+import time
+import socket
+import struct
+import logging
+import itertools
+import threading
+
+from chimera_t80cam.instruments.ebox import adsproto
+from chimera_t80cam.instruments.ebox.fsuregisters import ADSError
+
+log = logging.getLogger(name=__name__)
+
+_HANDLE = struct.Struct('<I')
+
+
+class ADSConnection(object):
+    """
+    AMS/TCP connection to a PLC, with pipelined requests.
+
+    :param timeout: seconds to wait for each answer.
+    :param cycle: how often the PLC checks notified variables for changes, in seconds.
+    """
+
+    def __init__(self, host, port, target, target_port, source, source_port,
+                 timeout, cycle=0.01):
+        # Names as in adshli's ads_connection, used by its packets.
+        self.ams_netid_target = target
+        self.ams_port_target = target_port
+        self.ams_netid_source = source
+        self.ams_port_source = source_port
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cycle = cycle
+
+        self._target = adsproto.pack_netid(target)
+        self._source = adsproto.pack_netid(source)
+
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.settimeout(None)
+        self._sendLock = threading.Lock()
+        self._invokeIds = itertools.count(1)
+        self._pending = {}
+        self._lastFrame = time.time()
+
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        # Samples for notification handles whose subscribe() has not
+        # returned yet; the PLC sends the current value right away.
+        self._early = {}
+        self._handles = {}
+        # See variable_lock.
+        self._variableLocks = {}
+
+        self.is_open = True
+
+        self._thread = threading.Thread(target=self._read, name='ads-%s:%s' % (host, port))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    # adshli interface
+
+    def execute_cmd(self, ads_cmd):
+        """
+        Send an adshli-style command and decode its answer.
+
+        :return: the decoded answer, or None if it was addressed to another port.
+        """
+        invoke_id = self._invokeIds.next()
+        frame = self._transact(invoke_id, ads_cmd.get_packet(invoke_id, self))
+        header, payload = ads_cmd.decode_header(frame)
+        if header['target_port'] != self.ams_port_source:
+            return None
+        return ads_cmd.decode_response(frame)
+
+    def close(self):
+        """
+        Close the socket. Connections obtained from ``connections`` are
+        closed by release().
+        """
+        self._shutdown()
+
+    # Raw requests
+
+    def request(self, command, data):
+        """
+        Send an ADS request and wait for its answer.
+
+        :return: the command data of the answer.
+        """
+        invoke_id = self._invokeIds.next()
+        frame = self._transact(invoke_id, adsproto.pack_frame(self._target, self.ams_port_target,
+                                                              self._source, self.ams_port_source,
+                                                              command, adsproto.STATE_REQUEST, data,
+                                                              invoke_id=invoke_id))
+        header, data = adsproto.unpack_frame(frame)
+        if header[7]:
+            raise ADSError('PLC returned error 0x%x.' % header[7])
+        return data
+
+    def _transact(self, invoke_id, packet):
+        if not self.is_open:
+            raise socket.error('Connection to the PLC at %s:%s is closed.' % (self.host, self.port))
+        slot = [threading.Event(), None]
+        self._pending[invoke_id] = slot
+        try:
+            with self._sendLock:
+                self._sock.sendall(packet)
+            if not slot[0].wait(self.timeout):
+                # Late answers are dropped by invoke id, but if nothing at
+                # all came back the connection is dead.
+                if time.time() - self._lastFrame > self.timeout:
+                    log.warning('No traffic from the PLC at %s:%s in %.1f s, closing connection.' %
+                                (self.host, self.port, self.timeout))
+                    self._shutdown()
+                raise socket.timeout('No answer from the PLC in %.1f s.' % self.timeout)
+        finally:
+            self._pending.pop(invoke_id, None)
+        if slot[1] is None:
+            raise socket.error('Connection to the PLC closed while waiting for an answer.')
+        return slot[1]
+
+    def variable_lock(self, name):
+        """
+        Lock on PLC variable ``name``, shared by every driver using this
+        connection. Held around read-modify-write sequences on a command
+        word, so those of different wheels do not interleave.
+        """
+        with self._lock:
+            return self._variableLocks.setdefault(name, threading.Lock())
+
+    # Notifications
+
+    def subscribe(self, name, fmt, callback):
+        """
+        Have the PLC send the value of variable ``name`` whenever it changes.
+
+        :param fmt: struct format of the variable, as in ads_var_single.
+        :param callback: called as callback(value, timestamp) from the
+                         reader thread, once with the current value and
+                         then on every change.
+        :return: the notification handle, for unsubscribe().
+        """
+        fmt = '<' + fmt
+        data = self.request(adsproto.ADSCMD_READ_WRITE,
+                            adsproto.READ_WRITE_REQUEST.pack(adsproto.ADSIGRP_SYM_HNDBYNAME, 0,
+                                                             _HANDLE.size, len(name)) + name)
+        result, length = adsproto.READ_RESPONSE.unpack_from(data)
+        if result:
+            raise ADSError('PLC returned error 0x%x getting a handle for %s.' % (result, name))
+        handle = _HANDLE.unpack_from(data, adsproto.READ_RESPONSE.size)[0]
+
+        data = self.request(adsproto.ADSCMD_ADD_DEVICE_NOTIFICATION,
+                            adsproto.ADD_NOTIFICATION_REQUEST.pack(adsproto.ADSIGRP_SYM_VALBYHND, handle,
+                                                                   struct.calcsize(fmt),
+                                                                   adsproto.ADSTRANS_SERVERONCHA, 0,
+                                                                   int(self.cycle * 1e7), '\0' * 16))
+        result = adsproto.WRITE_RESPONSE.unpack_from(data)[0]
+        if not result:
+            result, notification = adsproto.ADD_NOTIFICATION_RESPONSE.unpack_from(data)
+        if result:
+            self._release(handle)
+            raise ADSError('PLC returned error 0x%x subscribing to %s.' % (result, name))
+
+        with self._lock:
+            self._callbacks[notification] = (struct.Struct(fmt), callback)
+            self._handles[notification] = handle
+            early = self._early.pop(notification, None)
+        if early is not None:
+            self._deliver(notification, *early)
+        return notification
+
+    def unsubscribe(self, notification):
+        with self._lock:
+            self._callbacks.pop(notification, None)
+            handle = self._handles.pop(notification, None)
+        if handle is None or not self.is_open:
+            return
+        self.request(adsproto.ADSCMD_DEL_DEVICE_NOTIFICATION,
+                     adsproto.DEL_NOTIFICATION_REQUEST.pack(notification))
+        self._release(handle)
+
+    def _release(self, handle):
+        self.request(adsproto.ADSCMD_WRITE,
+                     adsproto.WRITE_REQUEST.pack(adsproto.ADSIGRP_SYM_RELEASEHND, 0,
+                                                 _HANDLE.size) + _HANDLE.pack(handle))
+
+    # Reader thread
+
+    def _shutdown(self):
+        self.is_open = False
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+
+    def _read(self):
+        try:
+            while True:
+                frame = adsproto.recv_raw_frame(self._sock)
+                self._lastFrame = time.time()
+                header, data = adsproto.unpack_frame(frame)
+                command, invoke_id = header[4], header[8]
+                if command == adsproto.ADSCMD_DEVICE_NOTIFICATION:
+                    self._dispatch(data)
+                    continue
+                slot = self._pending.get(invoke_id)
+                if slot is None:
+                    log.debug('Dropping answer to unknown request %i.' % invoke_id)
+                    continue
+                slot[1] = frame
+                slot[0].set()
+        except (EOFError, socket.error), e:
+            if self.is_open:
+                log.warning('Connection to the PLC at %s:%s lost: %s' % (self.host, self.port, e))
+        finally:
+            self.is_open = False
+            for slot in self._pending.values():
+                slot[0].set()
+
+    def _dispatch(self, data):
+        length, stamps = adsproto.NOTIFICATION_HEADER.unpack_from(data)
+        pos = adsproto.NOTIFICATION_HEADER.size
+        for i in range(stamps):
+            stamp, samples = adsproto.NOTIFICATION_STAMP.unpack_from(data, pos)
+            pos += adsproto.NOTIFICATION_STAMP.size
+            timestamp = adsproto.unpack_filetime(stamp)
+            for j in range(samples):
+                notification, size = adsproto.NOTIFICATION_SAMPLE.unpack_from(data, pos)
+                pos += adsproto.NOTIFICATION_SAMPLE.size
+                sample = data[pos:pos + size]
+                pos += size
+                with self._lock:
+                    if notification not in self._callbacks:
+                        self._early[notification] = (sample, timestamp)
+                        continue
+                self._deliver(notification, sample, timestamp)
+
+    def _deliver(self, notification, sample, timestamp):
+        fmt, callback = self._callbacks[notification]
+        try:
+            callback(fmt.unpack(sample[:fmt.size].ljust(fmt.size, '\0'))[0], timestamp)
+        except Exception:
+            log.exception('Error handling notification %i.' % notification)
+
+
+class ADSConnectionManager(object):
+    """
+    Open connections, one per PLC endpoint, shared by reference count.
+    A connection that dropped is replaced on the next acquire().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    def acquire(self, host, port, target, target_port, source, source_port, timeout):
+        """
+        :return: the ADSConnection to the endpoint, opened if needed.
+        """
+        key = (host, port, target, target_port, source, source_port)
+        with self._lock:
+            entry = self._connections.get(key)
+            if entry is None or not entry[0].is_open:
+                log.debug('Opening ADS connection to %s:%s (%s:%s)' % (host, port, target, target_port))
+                entry = [ADSConnection(host, port, target, target_port, source, source_port, timeout), 0]
+                self._connections[key] = entry
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, conn):
+        """
+        Drop a reference to ``conn``, closing it when no one uses it.
+        """
+        with self._lock:
+            for key, entry in self._connections.items():
+                if entry[0] is conn:
+                    entry[1] -= 1
+                    if entry[1] > 0:
+                        return
+                    del self._connections[key]
+                    break
+        # Last user, or a connection that was already replaced.
+        conn.close()
+
+    def stats(self):
+        """
+        :return: dict of endpoint -> number of users.
+        """
+        with self._lock:
+            return dict((key, entry[1]) for key, entry in self._connections.items())
+
+
+# Shared by all FSU drivers of this process.
+connections = ADSConnectionManager()
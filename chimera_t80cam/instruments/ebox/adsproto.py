@@ -0,0 +1,143 @@
+"""
+Beckhoff ADS/AMS wire format, as spoken over TCP port 48898.
+
+Every frame is a 6 byte AMS/TCP header (reserved, length) followed by a
+32 byte AMS header and the command data. All fields are little-endian.
+"""
+
+import struct
+
+AMS_TCP_PORT = 48898
+
+AMS_TCP_HEADER = struct.Struct('<HI')          # reserved, length of the rest
+AMS_HEADER = struct.Struct('<6sH6sHHHIII')     # target net id, target port,
+                                               # source net id, source port,
+                                               # command id, state flags,
+                                               # data length, error code,
+                                               # invoke id
+FRAME_HEADER_SIZE = AMS_TCP_HEADER.size + AMS_HEADER.size
+
+# Command ids
+ADSCMD_READ_DEVICE_INFO = 1
+ADSCMD_READ = 2
+ADSCMD_WRITE = 3
+ADSCMD_READ_STATE = 4
+ADSCMD_WRITE_CONTROL = 5
+ADSCMD_ADD_DEVICE_NOTIFICATION = 6
+ADSCMD_DEL_DEVICE_NOTIFICATION = 7
+ADSCMD_DEVICE_NOTIFICATION = 8
+ADSCMD_READ_WRITE = 9
+
+# State flags
+STATE_REQUEST = 0x0004
+STATE_RESPONSE = 0x0005
+
+# Index groups
+ADSIGRP_SYM_HNDBYNAME = 0xF003
+ADSIGRP_SYM_VALBYNAME = 0xF004
+ADSIGRP_SYM_VALBYHND = 0xF005
+ADSIGRP_SYM_RELEASEHND = 0xF006
+ADSIGRP_SUMUP_READ = 0xF080
+ADSIGRP_SUMUP_WRITE = 0xF081
+ADSIGRP_SUMUP_READWRITE = 0xF082
+
+# Error codes
+ADSERR_NOERR = 0
+ADSERR_DEVICE_SRVNOTSUPP = 0x701
+ADSERR_DEVICE_INVALIDGRP = 0x702
+ADSERR_DEVICE_INVALIDOFFSET = 0x703
+ADSERR_DEVICE_INVALIDSIZE = 0x705
+ADSERR_DEVICE_SYMBOLNOTFOUND = 0x710
+ADSERR_DEVICE_NOTIFYHNDINVALID = 0x714
+
+ADS_STATE_RUN = 5
+
+# Notification transmission modes
+ADSTRANS_SERVERCYCLE = 3
+ADSTRANS_SERVERONCHA = 4
+
+# Command data layouts
+READ_REQUEST = struct.Struct('<III')           # index group, index offset, length
+WRITE_REQUEST = struct.Struct('<III')          # index group, index offset, length
+READ_WRITE_REQUEST = struct.Struct('<IIII')    # index group, index offset,
+                                               # read length, write length
+READ_RESPONSE = struct.Struct('<II')           # result, length
+WRITE_RESPONSE = struct.Struct('<I')           # result
+READ_STATE_RESPONSE = struct.Struct('<IHH')    # result, ads state, device state
+DEVICE_INFO_RESPONSE = struct.Struct('<IBBH16s')
+ADD_NOTIFICATION_REQUEST = struct.Struct('<IIIIII16s')  # index group, index offset,
+                                                        # length, transmission mode,
+                                                        # max delay, cycle time
+                                                        # (both in 100 ns), reserved
+ADD_NOTIFICATION_RESPONSE = struct.Struct('<II')  # result, notification handle
+DEL_NOTIFICATION_REQUEST = struct.Struct('<I')    # notification handle
+NOTIFICATION_HEADER = struct.Struct('<II')     # length, number of stamps
+NOTIFICATION_STAMP = struct.Struct('<QI')      # FILETIME timestamp, number of samples
+NOTIFICATION_SAMPLE = struct.Struct('<II')     # notification handle, sample size
+
+# Seconds between the FILETIME epoch (1601-01-01) and the Unix epoch.
+FILETIME_EPOCH = 11644473600
+
+
+def pack_netid(netid):
+    """
+    Convert an AMS net id given as "a.b.c.d.e.f" to its 6 byte form.
+    """
+    return struct.pack('6B', *[int(part) for part in netid.split('.')])
+
+
+def unpack_netid(data):
+    return '.'.join(str(part) for part in struct.unpack('6B', data))
+
+
+def pack_frame(target, target_port, source, source_port, command, flags, data,
+               error=0, invoke_id=0):
+    """
+    Build a full AMS/TCP frame. Net ids are given in their 6 byte form.
+    """
+    header = AMS_HEADER.pack(target, target_port, source, source_port,
+                             command, flags, len(data), error, invoke_id)
+    return AMS_TCP_HEADER.pack(0, len(header) + len(data)) + header + data
+
+
+def pack_filetime(t):
+    return int((t + FILETIME_EPOCH) * 1e7)
+
+
+def unpack_filetime(stamp):
+    return stamp / 1e7 - FILETIME_EPOCH
+
+
+def recv_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('Connection closed by peer.')
+        data += chunk
+    return data
+
+
+def recv_raw_frame(sock):
+    """
+    Read one AMS/TCP frame, headers included.
+    """
+    head = recv_exactly(sock, AMS_TCP_HEADER.size)
+    reserved, length = AMS_TCP_HEADER.unpack(head)
+    return head + recv_exactly(sock, length)
+
+
+def unpack_frame(frame):
+    """
+    :return: the unpacked AMS header fields and the command data of a frame.
+    """
+    return AMS_HEADER.unpack_from(frame, AMS_TCP_HEADER.size), frame[FRAME_HEADER_SIZE:]
+
+
+def recv_frame(sock):
+    """
+    Read one AMS/TCP frame.
+
+    :return: the unpacked AMS header fields and the command data.
+    """
+    return unpack_frame(recv_raw_frame(sock))
@@ -1,18 +1,23 @@
 import logging
 
 from adshli.hli import ads_device
-from adshli.connection import ads_connection
+
+from chimera_t80cam.instruments.ebox.adsconn import connections
 
 log = logging.getLogger(name=__name__)
 
 class FSUConn():
     """
     FSU communication common class.
+
+    Drivers talking to the same PLC share one connection, see
+    adsconn.connections.
     """
 
     def __init__(self,connpars):
         self.conn = None
         self.device = None
+        self.watcher = None
 
         self._plc_ams_id = connpars['plc_ams_id']
         self._plc_ams_port = connpars['plc_ams_port']
@@ -26,20 +31,28 @@ class FSUConn():
         self.connect_plc()
 
     def __del__(self):
-        self.conn.close()
+        self.disconnect_plc()
 
     def disconnect_plc(self):
-        self.conn.close()
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        if self.conn is not None:
+            connections.release(self.conn)
+            self.conn = None
 
     def connect_plc(self):
-        self.conn = ads_connection(self._plc_ams_id,
-                                   self._plc_ams_port,
-                                   self._pc_ams_id,
-                                   self._pc_ams_port)
-
-        # Open a connection to the slave PLC controller.
-        self.conn.open(self._plc_ip_adr,
-                       self._plc_ip_port,
-                       self._plc_timeout)
+        if self.conn is not None:
+            connections.release(self.conn)
+
+        # Shared with the other drivers of this PLC; a connection that
+        # dropped is reopened here.
+        self.conn = connections.acquire(self._plc_ip_adr,
+                                        self._plc_ip_port,
+                                        self._plc_ams_id,
+                                        self._plc_ams_port,
+                                        self._pc_ams_id,
+                                        self._pc_ams_port,
+                                        self._plc_timeout)
 
         self.device = ads_device(self.conn)
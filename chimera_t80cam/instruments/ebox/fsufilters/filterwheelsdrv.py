@@ -4,6 +4,7 @@ import time
 from chimera_t80cam.instruments.ebox.fsuconn import FSUConn
 from chimera_t80cam.instruments.ebox.fsufwheels import FSUFWheels
 from chimera_t80cam.instruments.ebox.fsuexceptions import FilterPositionFailure
+from chimera_t80cam.instruments.ebox.fsumove import WheelMove
 
 log = logging.getLogger(name=__name__.replace('chimera_t80cam','chimera'))
 
@@ -28,38 +29,55 @@ class FSUFilterWheel(FSUConn, FSUFWheels):
 
     def move_pos(self, filterpos):
         self.log.debug('Requested filter position {0}'.format(filterpos))
-        self.log.debug('VREAD {0}'.format(self._vread1.read()))
-        # Ensure the motion bit is set to zero
-        if (self._vread1.read() & 1) != 0:
-            self._vread1.write(self._vread1.read() ^ 1)
-        self.log.debug('VREAD {0}'.format(self._vread1.read()))
-
-        # reset the stop movement request bit if set.
-        if (self._vread1.read() & (1 << 5)) != 0:
-            self._vread1.write(self._vread1.read() & ~(1 << 5))
-        # Set the filter position vector
-        self.log.debug('Seeting filter position...')
-        self._vread0.write(filterpos)
-        start_time = time.time()
-        while self.get_req_pos() != filterpos:
-            self.log.debug('Filter position: %s/%s/%s'%(self.get_req_pos(), filterpos,self._vread0.read()))
-            if time.time()-start_time > self.timeout:
+        # The command word is shared with the polarimeter wheels, see
+        # FSUPolDriver.move_element.
+        with self.conn.variable_lock(self._vread1.var_name):
+            regs = self.snapshot([self._vread0, self._vread1])
+            self.log.debug('VREAD {0}'.format(regs[self._vread1]))
+            # Ensure the motion bit is set to zero, reset the stop movement
+            # request bit if set and set the filter position vector, in one write.
+            self.log.debug('Seeting filter position...')
+            regs = regs.edit().clear_bits(self._vread1, 1 | (1 << 5)).set(self._vread0, filterpos).flush()
+            self.log.debug('VREAD {0}'.format(regs[self._vread1]))
+
+            # Wait for the PLC to latch the request.
+            if not self.wait_status(self._wPOS_REQ, lambda req: req == filterpos, self.timeout):
                 raise FilterPositionFailure("Could not set filter position.")
-            time.sleep(0.1)
-        self.log.debug('Filter position: %s/%s/%s'%(self.get_req_pos(), filterpos,self._vread0.read()))
-        # Move it
-        self._vread1.write(self._vread1.read() ^ 1)
-        self.log.debug('VREAD1 {0}'.format(self._vread1.read()))
+            self.log.debug('Filter position: %s/%s' % (self.status(self._wPOS_REQ), filterpos))
+            # Move it. Other drivers may have written the command word while
+            # the request was latched, so toggle on a fresh read of it.
+            regs = self.snapshot([self._vread1]).edit().toggle_bits(self._vread1, 1).flush()
+            self.log.debug('VREAD1 {0}'.format(regs[self._vread1]))
 
         return
 
+    def start_move(self, filterpos, timeout=25, start_timeout=0.5):
+        """
+        Move the wheels to ``filterpos`` in the background.
+
+        :param timeout: seconds for the wheels to arrive once they started.
+        :param start_timeout: seconds given to the PLC to pick up the move.
+        :return: WheelMove, done once both wheels are in position.
+                 Cancelling it stops the wheels.
+        """
+        def run(move):
+            if not move.begin():
+                return
+            self.move_pos(filterpos)
+            self.wait_move_started(start_timeout, move.cancelling)
+            if not self.wait_reached(timeout, move.cancelling) and not move.cancelling.isSet():
+                self.check_hw()
+                raise FilterPositionFailure('Positioning filter timed-out! Check Filter Wheel!')
+
+        return WheelMove.start('filter wheel', run, self.move_stop)
+
     def fwheel_is_moving(self):
         """
         Return status of filter wheel.
         :return: True if moving, False otherwise.
         """
         # vwrite1.2 flags filter wheel pos reached status,
-        return self._vwrite1.read() & (1 << 2) != 0
+        return self.status(self._vwrite1) & (1 << 2) != 0
 
     def awheel_is_moving(self):
         """
@@ -67,7 +85,28 @@ class FSUFilterWheel(FSUConn, FSUFWheels):
         :return: True if moving, False otherwise.
         """
         # vwrite1.3 flags analiser wheel pos reached status.
-        return self._vwrite1.read() & (1 << 3) != 0
+        return self.status(self._vwrite1) & (1 << 3) != 0
+
+    def wait_move_started(self, timeout, abort=None):
+        """
+        Wait for the position reached flags to drop. They are still set
+        right after move_pos, until the PLC picks up the move.
+
+        :return: True if a flag dropped, False on timeout or abort.
+        """
+        reached = (1 << 2) | (1 << 3)
+        return self.wait_status(self._vwrite1, lambda value: value & reached != reached,
+                                timeout, abort)
+
+    def wait_reached(self, timeout, abort=None):
+        """
+        Wait for both wheels to reach their position.
+
+        :return: True once both flags are set, False on timeout or abort.
+        """
+        reached = (1 << 2) | (1 << 3)
+        return self.wait_status(self._vwrite1, lambda value: value & reached == reached,
+                                timeout, abort)
 
     def move_stop(self):
         """
@@ -77,13 +116,13 @@ class FSUFilterWheel(FSUConn, FSUFWheels):
             Aborts any current rotation of all filter wheels.
         """
         print('Stop request received')
+        regs = self.snapshot([self._vwrite1, self._vread1])
         # Check if wheels already stopped
-        if ((self._vwrite1.read() & (1 << 2) != 0) and
-                (self._vwrite1.read() & (1 << 3) != 0)):
+        if regs.bit(self._vwrite1, 2) and regs.bit(self._vwrite1, 3):
             log.warn("Wheels already stopped.")
         else:
             # This is accomplished by flipping bit 5
-            self._vread1.write(self._vread1.read() | (1 << 5))
+            regs.edit().set_bits(self._vread1, 1 << 5).flush()
             log.info('Filter wheels stopped')
             # TODO: integrate the bPOS bit status.
 
@@ -107,45 +146,51 @@ class FSUFilterWheel(FSUConn, FSUFWheels):
 
     def set_home_position_wheel(self, wheel1, wheel2):
 
-        # Check if wheel is on position or homing mode
-        if not self._bFILTER_1_AND_2_HOME_MODE.read():
-            # If bit is set, unset it
-            if (self._vread1.read() & (1<<2)) != 0:
-                self._vread1.write(self._vread1.read() ^ (1 << 2))
-
-            # Request to switch to homing mode
-            self._vread1.write(self._vread1.read() ^ (1 << 2))
-
+        # The command word is shared with the polarimeter wheels, so each
+        # change to it is made on a fresh read, see move_pos.
+        with self.conn.variable_lock(self._vread1.var_name):
+            regs = self.snapshot([self._bFILTER_1_AND_2_HOME_MODE, self._vread1])
+            # Check if wheel is on position or homing mode
+            if not regs[self._bFILTER_1_AND_2_HOME_MODE]:
+                # If bit is set, unset it
+                if regs.bit(self._vread1, 2):
+                    self.snapshot([self._vread1]).edit().clear_bits(self._vread1, 1 << 2).flush()
+
+                # Request to switch to homing mode
+                self.snapshot([self._vread1]).edit().toggle_bits(self._vread1, 1 << 2).flush()
+
+                start_time = time.time()
+                while not self._bFILTER_1_AND_2_HOME_MODE.read():
+                    if time.time()-start_time > self.timeout:
+                        raise FilterPositionFailure("Could not switch to homing mode!")
+                    time.sleep(0.1)
+                    # wait for mode switch
+            # Set home positions and, if bit is set, unset it. Make sure wheels
+            # are floats!
+            self.snapshot([self._vread1]).edit().set(self._rlREAL_READ2, float(wheel1))\
+                .set(self._rlREAL_READ3, float(wheel2)).clear_bits(self._vread1, 1 << 3).flush()
+            # Send command to set position
+            self.snapshot([self._vread1]).edit().toggle_bits(self._vread1, 1 << 3).flush()
+
+            # wait for PLC to acquire values
             start_time = time.time()
-            while not self._bFILTER_1_AND_2_HOME_MODE.read():
+            while True:
+                angles = self.snapshot([self._lrINITIAL_ANGLE_POS_M1, self._lrINITIAL_ANGLE_POS_M2])
+                if not (angles[self._lrINITIAL_ANGLE_POS_M1] != float(wheel1) and
+                        angles[self._lrINITIAL_ANGLE_POS_M2] != float(wheel2)):
+                    break
                 if time.time()-start_time > self.timeout:
-                    raise FilterPositionFailure("Could not switch to homing mode!")
+                    raise FilterPositionFailure("Could not set homing positions! Tried to set "
+                                                "%f/%f PLC values are %f/%f" % (float(wheel1),
+                                                                                float(wheel2),
+                                                                                angles[self._lrINITIAL_ANGLE_POS_M1],
+                                                                                angles[self._lrINITIAL_ANGLE_POS_M2]))
                 time.sleep(0.1)
-                # wait for mode switch
-        # Set home positions
-        self._rlREAL_READ2.write(float(wheel1))  # make sure wheel1 is a float!
-        self._rlREAL_READ3.write(float(wheel2))  # make sure wheel2 is a float!
-        # If bit is set, unset it
-        if (self._vread1.read() & (1 << 3)) != 0:
-            self._vread1.write(self._vread1.read() ^ (1 << 3))
-        self._vread1.write(self._vread1.read() ^ (1 << 3))  # Send command to set position
-
-        # wait for PLC to acquire values
-        start_time = time.time()
-        while self._lrINITIAL_ANGLE_POS_M1.read() != float(wheel1) and \
-                        self._lrINITIAL_ANGLE_POS_M2.read() != float(wheel2):
-            if time.time()-start_time > self.timeout:
-                raise FilterPositionFailure("Could not set homing positions! Tried to set "
-                                            "%f/%f PLC values are %f/%f" % (float(wheel1),
-                                                                            float(wheel2),
-                                                                            self._lrINITIAL_ANGLE_POS_M1.read(),
-                                                                            self._lrINITIAL_ANGLE_POS_M2.read()))
-            time.sleep(0.1)
-
-        self._vread1.write(self._vread1.read() ^ (1 << 3))  # Unset command to set position
-        self._vread1.write(self._vread1.read() ^ (1 << 2))  # Go back to position mode
-
 
+            # Unset command to set position
+            self.snapshot([self._vread1]).edit().toggle_bits(self._vread1, 1 << 3).flush()
+            # Go back to position mode
+            self.snapshot([self._vread1]).edit().toggle_bits(self._vread1, 1 << 2).flush()
 
     def check_hw(self):
         # log.debug('Checking filter wheel!')
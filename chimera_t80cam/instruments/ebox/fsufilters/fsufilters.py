@@ -10,6 +10,7 @@ from chimera_t80cam.instruments.ebox.fsuexceptions import FilterPositionFailure,
 from chimera.instruments.filterwheel import FilterWheelBase
 
 from chimera_t80cam.instruments.ebox.fsufilters.filterwheelsdrv import FSUFilterWheel
+from chimera_t80cam.instruments.ebox.fsumove import WheelMove
 
 log = logging.Logger(__name__)
 
@@ -39,6 +40,8 @@ class FsuFilters(FilterWheelBase):
         # Get me the filter wheel.
         self._abort = threading.Event()
         self.fwhl = None
+        # Last move started, see startFilter.
+        self._move = None
 
     def __start__(self):
         self.open()
@@ -58,7 +61,7 @@ class FsuFilters(FilterWheelBase):
             check = self.fwhl.check_hw()
             for item in check:
                 self.log.error('%s error flag is set' % item['flag'])
-        except socket.timeout:
+        except socket.error:
             self.log.warning('Communication timed-out. Trying to reconnect...')
             self.connectTWC()
             self.set_home_position()
@@ -80,7 +83,9 @@ class FsuFilters(FilterWheelBase):
     def stopWheel(self):
         self.log.debug('Abort requested')
         self._abort.set()
-        self.fwhl.move_stop()
+        move = self._move
+        if move is None or not move.cancel():
+            self.fwhl.move_stop()
 
     @lock
     def setFilter(self, flt):
@@ -92,33 +97,47 @@ class FsuFilters(FilterWheelBase):
             name.
             :param str flt: Name of the filter to use.
         """
-        fwhl = self.fwhl
+        self._setFilter(flt)
+
+    def _setFilter(self, flt):
+        self._startFilter(flt).result()
+
+    @lock
+    def startFilter(self, flt):
+        """
+        Start moving to a filter and return right away.
+
+        .. method:: startFilter(flt)
+            Sets the filter wheel(s) moving to the position defined for
+            the filter name.
+            :param str flt: Name of the filter to use.
+            :return: WheelMove, done once the wheels are in position. It
+                     can be waited for, cancelled or given callbacks.
+        """
+        return self._startFilter(flt)
+
+    def _startFilter(self, flt):
+        position = self._getFilterPosition(flt)
 
         self._abort.clear()
 
         current_filter = self.getFilter()
         if current_filter == flt:
-            return
+            return WheelMove.finished('filter wheel')
 
         self.log.debug("Moving to filter %s." % flt)
 
-        fwhl.move_pos(self._getFilterPosition(flt))
-        # This call returns immediately, hence loop for an abort request.
-        time.sleep(self["waitMoveStart"])
-        timeout = 0
-        start_time = time.time()
-        while not (fwhl.fwheel_is_moving() and
-                       fwhl.awheel_is_moving()):
-            time.sleep(0.1)
-            if self._abort.isSet():
-                self.stopWheel()
-                break
-            if time.time()-start_time > self["move_filter_timeout"]:
-                # Todo: Check wheel for errors
-                fwhl.check_hw()
-                raise FilterPositionFailure('Positioning filter timed-out! Check Filter Wheel!')
-
-        self.filterChange(flt, current_filter)
+        # The PLC notifies when the wheels start and arrive.
+        move = self.fwhl.start_move(position, self["move_filter_timeout"],
+                                    start_timeout=self["waitMoveStart"])
+
+        def changed(move):
+            if move.succeeded():
+                self.filterChange(flt, current_filter)
+
+        move.add_done_callback(changed)
+        self._move = move
+        return move
 
     def getFilter(self):
         """
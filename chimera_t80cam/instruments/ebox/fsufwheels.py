@@ -2,6 +2,9 @@ from adshli.hli import ads_var_single
 
 from chimera.core.exceptions import ChimeraException
 
+from chimera_t80cam.instruments.ebox.fsuregisters import FSURegisters
+from chimera_t80cam.instruments.ebox.fsunotify import StatusWatcher
+
 
 class FSUFWheels():
     """
@@ -112,3 +115,57 @@ class FSUFWheels():
         ## Wheel 2
         self._lrINITIAL_ANGLE_POS_M2 = self._rlREAL_READ0 = ads_var_single(self.conn,'.lrINITIAL_ANGLE_POS_M2','d')
 
+        # Registers fetched together by snapshot(), in a single ADS round trip.
+        self.registers = FSURegisters(self.conn,
+                                      [self._vread0, self._vread1, self._vread2, self._vread3,
+                                       self._vread10, self._vread11, self._vread12,
+                                       self._vread20, self._vread21, self._vread22,
+                                       self._wPOS_REQ,
+                                       self._wPOS_REQU_T80_POL_BOX_FILTER_WHEEL1,
+                                       self._wPOS_REQU_T80_POL_BOX_FILTER_WHEEL2,
+                                       self._wPOS_REQU_T80_POL_BOX_WHEEL,
+                                       self._wPOS_REQU_T80_POL_BOX_FILTER,
+                                       self._vwrite0, self._vwrite1, self._vwrite10,
+                                       self._vwrite12, self._vwrite13,
+                                       self._vwrite20, self._vwrite21, self._vwrite22,
+                                       self._rlREAL_READ1, self._rlREAL_READ2, self._rlREAL_READ3,
+                                       self._rlREAL_READ4, self._rlREAL_READ5,
+                                       self._bFILTER_1_AND_2_HOME_MODE,
+                                       self._lrINITIAL_ANGLE_POS_M1, self._lrINITIAL_ANGLE_POS_M2])
+
+        # Position reached flags and latched position requests, pushed by
+        # the PLC whenever they change, see wait_status().
+        self.watcher = StatusWatcher([self._vwrite1, self._vwrite10, self._vwrite20,
+                                      self._wPOS_REQ,
+                                      self._wPOS_REQU_T80_POL_BOX_FILTER_WHEEL1,
+                                      self._wPOS_REQU_T80_POL_BOX_FILTER_WHEEL2,
+                                      self._wPOS_REQU_T80_POL_BOX_WHEEL,
+                                      self._wPOS_REQU_T80_POL_BOX_FILTER],
+                                     self.conn)
+
+    def snapshot(self, variables=None):
+        """
+        Read the PLC registers at once.
+
+        :param variables: registers to read, all of them by default.
+        :return: RegisterSnapshot, whose edit() gives read-modify-write
+                 changes flushed with a single write.
+        """
+        return self.registers.read(variables)
+
+
+    def status(self, var):
+        """
+        Latest value of a watched register, without a PLC round trip while
+        notifications are active.
+        """
+        return self.watcher.value(var)
+
+    def wait_status(self, var, predicate, timeout, abort=None):
+        """
+        Wait until ``predicate`` holds for the value of register ``var``.
+
+        :param abort: optional threading.Event that ends the wait early.
+        :return: True if the predicate holds, False on timeout or abort.
+        """
+        return self.watcher.wait(var, predicate, timeout, abort)
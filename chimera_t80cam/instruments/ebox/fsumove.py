@@ -0,0 +1,201 @@
+"""
+Handles on wheel moves running in the background.
+
+A move is started with WheelMove.start, which returns right away. The
+caller keeps working and later waits for the handle, cancels it or has a
+callback run when the wheel arrives.
+"""
+
+import logging
+import threading
+
+from chimera_t80cam.instruments.ebox.fsuexceptions import FilterPositionFailure
+
+log = logging.getLogger(name=__name__)
+
+
+class WheelMove(object):
+    """
+    A wheel move in progress.
+
+    :param name: what is moving, for logs and errors.
+    :param stop: called by cancel() once the move was commanded, to stop
+                 the wheel.
+    """
+
+    def __init__(self, name, stop=None):
+        self.name = name
+        self.error = None
+
+        # Set by cancel(); the code driving the move waits on it as its
+        # abort event.
+        self.cancelling = threading.Event()
+
+        self._stop = stop
+        self._running = False
+        self._ended = False
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @classmethod
+    def start(cls, name, run, stop=None):
+        """
+        Call ``run(move)`` on a new thread and return the move right away.
+
+        ``run`` calls move.begin() right before commanding the wheel and
+        returns once it is in position, or once move.cancelling is set. It
+        raises if the move fails.
+        """
+        move = cls(name, stop)
+        thread = threading.Thread(target=move._run, args=(run,), name='move-%s' % name)
+        thread.setDaemon(True)
+        thread.start()
+        return move
+
+    @classmethod
+    def finished(cls, name):
+        """
+        A move with nothing to do, already complete.
+        """
+        move = cls(name)
+        move._finish()
+        return move
+
+    @classmethod
+    def gather(cls, name, moves):
+        """
+        One handle on several moves, complete when all of them are.
+        Cancelling it cancels them all; its error is the first one raised.
+        """
+        moves = list(moves)
+        group = cls(name, lambda: [move.cancel() for move in moves])
+        group._running = True
+        if not moves:
+            group._finish()
+            return group
+
+        remaining = [len(moves)]
+        lock = threading.Lock()
+
+        def finished(move):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+                if move.error is not None and group.error is None:
+                    group.error = move.error
+                if move.cancelled():
+                    group.cancelling.set()
+            if last:
+                group._finish(group.error)
+
+        for move in moves:
+            move.add_done_callback(finished)
+        return group
+
+    def _run(self, run):
+        try:
+            run(self)
+        except Exception, e:
+            log.debug('Move of %s failed: %s' % (self.name, e))
+            self._finish(e)
+        else:
+            self._finish()
+
+    def begin(self):
+        """
+        Called by the code driving the move before commanding the wheel.
+
+        :return: False if the move was cancelled already and must not start.
+        """
+        with self._lock:
+            if self.cancelling.isSet():
+                return False
+            self._running = True
+            return True
+
+    def _finish(self, error=None):
+        # Callbacks run before waiters are woken up, so whoever waits sees
+        # their effects.
+        with self._lock:
+            if self._ended:
+                return
+            self._ended = True
+            self.error = error
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._call(callback)
+        self._done.set()
+
+    def _call(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            log.exception('Error in callback of %s move.' % self.name)
+
+    def done(self):
+        return self._done.isSet()
+
+    def cancelled(self):
+        return self.cancelling.isSet() and self.error is None
+
+    def succeeded(self):
+        return self._ended and not self.cancelling.isSet() and self.error is None
+
+    def wait(self, timeout=None):
+        """
+        Wait for the move to end.
+
+        :return: True if it ended, False on timeout.
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Wait for the move to end, raising its error if it failed.
+
+        :return: True if the wheel is in position, False if it was cancelled.
+        """
+        if not self.wait(timeout):
+            raise FilterPositionFailure('%s still moving after %.1f s.' % (self.name, timeout))
+        if self.error is not None:
+            raise self.error
+        return not self.cancelling.isSet()
+
+    def cancel(self):
+        """
+        Stop the move, sending the wheel stop command if it had started.
+
+        :return: False if the move had already ended.
+        """
+        with self._lock:
+            if self._ended:
+                return False
+            self.cancelling.set()
+            stop = self._stop if self._running else None
+        if stop is not None:
+            stop()
+        return True
+
+    def add_done_callback(self, callback):
+        """
+        Call ``callback(move)`` once the move ended, right away if it did.
+        Callbacks run on the thread that completes the move, before wait()
+        returns.
+        """
+        with self._lock:
+            if not self._ended:
+                self._callbacks.append(callback)
+                return
+        self._call(callback)
+
+    def __repr__(self):
+        if not self._ended:
+            state = 'moving'
+        elif self.error is not None:
+            state = 'failed: %s' % self.error
+        elif self.cancelling.isSet():
+            state = 'cancelled'
+        else:
+            state = 'done'
+        return '<WheelMove %s %s>' % (self.name, state)
@@ -0,0 +1,108 @@
+"""
+ADS device notifications for the FSU PLC status registers.
+
+Instead of re-reading the status words until a flag changes, the drivers
+ask the PLC to push every change of those variables. The notifications
+arrive on the shared ADSConnection and are kept by a StatusWatcher that
+wakes whoever waits on a flag.
+"""
+
+import time
+import logging
+import threading
+
+from chimera_t80cam.instruments.ebox.fsuregisters import ADSError
+
+log = logging.getLogger(name=__name__)
+
+
+class StatusWatcher(object):
+    """
+    Latest values of a set of PLC registers.
+
+    The values are kept up to date by the PLC through ADS notifications,
+    and waiting on them costs no PLC traffic. If the PLC refuses the
+    notifications, or once the connection is lost, values are read from
+    the PLC and waits poll every ``poll`` seconds.
+
+    :param variables: ads_var_single objects to watch.
+    :param conn: ADSConnection to subscribe on, or None to always poll.
+    """
+
+    def __init__(self, variables, conn=None, poll=0.1):
+        self.variables = list(variables)
+        self.conn = conn
+        self.poll = poll
+        self._values = {}
+        self._notifications = []
+        self._cond = threading.Condition()
+
+        if conn is not None:
+            try:
+                for var in self.variables:
+                    self._notifications.append(conn.subscribe(var.var_name, var.var_type,
+                                                              self._updater(var)))
+            except ADSError, e:
+                log.warning('ADS notifications not available (%s), polling PLC status.' % e)
+                self.close()
+
+    @property
+    def notifying(self):
+        return self.conn is not None and self.conn.is_open
+
+    def close(self):
+        """
+        Remove the subscriptions, the connection is left open.
+        """
+        conn, self.conn = self.conn, None
+        notifications, self._notifications = self._notifications, []
+        try:
+            for notification in notifications:
+                conn.unsubscribe(notification)
+        except Exception, e:
+            log.debug('Could not remove notifications: %s' % e)
+        with self._cond:
+            self._values.clear()
+            self._cond.notifyAll()
+
+    def _updater(self, var):
+        def update(value, timestamp):
+            with self._cond:
+                self._values[var] = value
+                self._cond.notifyAll()
+        return update
+
+    def value(self, var):
+        """
+        :return: the latest value of ``var``, read from the PLC if it is not
+                 being notified.
+        """
+        with self._cond:
+            if self.notifying and var in self._values:
+                return self._values[var]
+        return var.read()
+
+    def wait(self, var, predicate, timeout, abort=None):
+        """
+        Wait until ``predicate`` is true for the value of ``var``.
+
+        :param abort: optional threading.Event, checked every ``poll`` seconds.
+        :return: True once the predicate holds, False on timeout or abort.
+        """
+        deadline = time.time() + timeout
+        while True:
+            with self._cond:
+                if self.notifying and var in self._values:
+                    if predicate(self._values[var]):
+                        return True
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or (abort is not None and abort.isSet()):
+                        return False
+                    self._cond.wait(min(remaining, self.poll))
+                    continue
+            if predicate(var.read()):
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0 or (abort is not None and abort.isSet()):
+                return False
+            time.sleep(min(remaining, self.poll))
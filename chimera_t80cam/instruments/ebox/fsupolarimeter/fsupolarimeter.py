@@ -9,6 +9,7 @@ from chimera.core.lock import lock
 from chimera.instruments.filterwheel import FilterWheelBase
 from chimera_t80cam.instruments.ebox.fsuexceptions import FilterPositionFailure, FSUInitializationException
 from chimera_t80cam.instruments.ebox.fsupolarimeter.polarizerdrv import FSUPolDriver
+from chimera_t80cam.instruments.ebox.fsumove import WheelMove
 
 log = logging.Logger(__name__)
 
@@ -36,12 +37,13 @@ class FsuPolarimeter(FilterWheelBase):
         # Get me the filter wheel.
         self._abort = threading.Event()
         self.fwhl = None
+        # Last move started, see startFilter.
+        self._move = None
 
     def __start__(self):
         self.open()
+        # Each wheel opens its own driver, sharing our PLC connection.
         self._wheels = [self.getManager().getProxy(wheel, lazy=True) for wheel in self["device"].split(',')]
-        for wheel in self._wheels:
-            wheel.fwhl = self.fwhl
         filters = [wheel["filters"].split() for wheel in self._wheels]
         self["filters"] = ' '.join([','.join(comb) for comb in itertools.product(*filters)])
 
@@ -53,51 +55,51 @@ class FsuPolarimeter(FilterWheelBase):
     def open(self):
         return self.connectTWC()
 
+    def stopWheel(self):
+        self.log.debug('Abort requested')
+        self._abort.set()
+        if self._move is not None:
+            self._move.cancel()
+
     def setFilter(self, filters):
+        return self.startFilter(filters).result()
+
+    def startFilter(self, filters):
+        """
+        Start moving the wheels to ``filters`` and return right away. The
+        wheels move together, their start commands go out one after
+        another (see FSUPolDriver.move_element).
+
+        :param str filters: comma separated filter of each wheel.
+        :return: WheelMove, done once every wheel is in position. It can be
+                 waited for, cancelled or given callbacks.
+        """
         f = filters.split(',')
         current_filter = self.getFilter().split(',')
 
-        for wheel_num, wheel in enumerate(self._wheels):
-            self._abort.clear()
+        self._abort.clear()
 
+        moves = []
+        for wheel_num, wheel in enumerate(self._wheels):
             if f[wheel_num] == current_filter[wheel_num]:
                 self.log.debug('Already in filter %s' % f[wheel_num])
                 continue
 
             self.log.debug("Moving to filter %s." % f[wheel_num])
 
-            filter_pos = self._wheels[wheel_num].getFilterPosition(f[wheel_num])
-
-            # This call returns immediately. The wait/abort sequence is after setting it all up
-            self.fwhl[int(self._wheels[wheel_num]['id'])](filter_pos)
-
-        timeout = self['plc_timeout']
-        start_time = time.time()
-        complete_mask = np.zeros_like(self._wheels) == 1
-
-        while not np.all(complete_mask):
-            for wheel_num, wheel in enumerate(self._wheels):
-                if complete_mask[wheel_num]:
-                    self.log.debug('Wheel %i in position' % wheel_num)
-                    continue
-                self.log.debug('Checking wheel %i' % (wheel_num))
-                complete_mask[wheel_num] = self.fwhl.position_reached(int(self._wheels[wheel_num]['id']))
-
-            if self._abort.isSet():
-                self.log.warning('Aborting!')
-                break
-            if time.time()-start_time > timeout:
-                self.log.error("Longer than %f s have passed; something is wrong..." % timeout)
-                # Todo: Check wheel for errors
-                # fwhl.check_hw()
-                raise FilterPositionFailure('Positioning filter timed-out (%s)! Check Filter Wheel!' % complete_mask)
-            time.sleep(0.1)
-
-        # Disable wave plate and analyser wheel
-        for wheel_num, wheel in enumerate(self._wheels):
-            self.fwhl.disable_wheel(int(self._wheels[wheel_num]['id']))
+            filter_pos = wheel.getFilterPosition(f[wheel_num])
+            moves.append(self.fwhl.start_move(filter_pos, int(wheel['id']), self['plc_timeout'],
+                                              start_timeout=self['waitMoveStart']))
 
-        return True
+        def disable(move):
+            # Disable wave plate and analyser wheel
+            for wheel in self._wheels:
+                self.fwhl.disable_wheel(int(wheel['id']))
+
+        move = WheelMove.gather('polarimeter', moves)
+        move.add_done_callback(disable)
+        self._move = move
+        return move
 
     def getFilter(self):
         filters = ""
@@ -131,14 +133,51 @@ class FsuPolarimeter(FilterWheelBase):
 class PolarimeterWheelBase(FilterWheelBase):
 
     __config__ = dict(id = 0,
-                      fwhl = None)
+                      fwhl = None,
+                      waitMoveStart=0.5,
+                      move_filter_timeout=25,
+                      plc_ams_id="5.18.26.30.1.1",
+                      plc_ams_port=801,
+                      plc_ip_adr="192.168.100.1",
+                      plc_ip_port=48898,
+                      pc_ams_id="5.18.26.31.1.1",
+                      pc_ams_port=32788,
+                      plc_timeout=5)
 
     def __init__(self):
         FilterWheelBase.__init__(self)
+        self._abort = threading.Event()
         self.fwhl = None
+        self._move = None
+
+    def __start__(self):
+        self.open()
+
+    @lock
+    def open(self):
+        # The PLC connection is shared with the polarimeter and the other
+        # wheels, see adsconn.connections.
+        self.fwhl = FSUPolDriver(self)
+        return True
+
+    def stopWheel(self):
+        self.log.debug('Abort requested')
+        self._abort.set()
+        move = self._move
+        if move is None or not move.cancel():
+            self.fwhl.stop_element(self['id'])
 
     def setFilter(self, flt):
+        self.startFilter(flt).result()
 
+    def startFilter(self, flt):
+        """
+        Start moving to a filter and return right away.
+
+        :param str flt: Name of the filter to use.
+        :return: WheelMove, done once the wheel is in position. It can be
+                 waited for, cancelled or given callbacks.
+        """
         fwhl = self.fwhl
         if fwhl is None:
             raise FSUInitializationException("Polarimeter wheel not properly initialized.")
@@ -146,24 +185,14 @@ class PolarimeterWheelBase(FilterWheelBase):
         self._abort.clear()
 
         if self.getFilter() == flt:
-            return
+            return WheelMove.finished('wheel %i' % self['id'])
 
         self.log.debug("Moving to filter %s." % flt)
 
-        fwhl[self['id']](self._getFilterPosition(flt))
-        # This call returns immediately, hence a loop for an abort request.
-        timeout = 0
-        start_time = time.time()
-        while self.getFilter() != flt:
-            if self._abort.isSet():
-                self.stopWheel()
-                break
-            if time.time()-start_time > 25:
-                self.log.warning("Longer than 25s have passed; something is wrong...")
-                # Todo: Check wheel for errors
-                fwhl.check_hw()
-                raise FilterPositionFailure('Positioning filter timed-out! Check Filter Wheel!')
-            time.sleep(0.1)
+        # The PLC notifies when the wheel starts and arrives.
+        self._move = fwhl.start_move(self._getFilterPosition(flt), self['id'], self['move_filter_timeout'],
+                                     start_timeout=self['waitMoveStart'])
+        return self._move
 
     def getFilterPosition(self, name):
         return self.getFilters().index(name)
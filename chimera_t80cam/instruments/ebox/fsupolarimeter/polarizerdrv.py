@@ -4,6 +4,7 @@ import time
 from chimera_t80cam.instruments.ebox.fsuconn import FSUConn
 from chimera_t80cam.instruments.ebox.fsufwheels import FSUFWheels
 from chimera_t80cam.instruments.ebox.fsuexceptions import FilterPositionFailure
+from chimera_t80cam.instruments.ebox.fsumove import WheelMove
 
 class FSUPolDriver(FSUConn, FSUFWheels):
     """
@@ -84,47 +85,75 @@ class FSUPolDriver(FSUConn, FSUFWheels):
         stop_movement_bit, enable_bit, get_required_pos = self.setup_wheel(wheel)
 
         self.log.debug('Requested filter position {0} on {1} wheel'.format(filterpos, wheel))
-        self.log.debug('VREAD {0}'.format(vread2.read()))
 
-        # Todo: Check wheel for errors
+        # Wheels 0 and 1 share their command word and start bit, their
+        # start sequences must not interleave.
+        with self.conn.variable_lock(vread1.var_name):
+            regs = self.snapshot([vread1, vread2])
+            self.log.debug('VREAD {0}'.format(regs[vread2]))
 
-        # Ensure the motion bit is set to zero
-        if (vread1.read() & start_movement_bit) != 0:
-            vread1.write(vread1.read() ^ start_movement_bit)
-        self.log.debug('VREAD {0}'.format(vread1.read()))
+            # Todo: Check wheel for errors
 
-        # reset the stop movement request bit if set.
-        if (vread1.read() & stop_movement_bit) != 0:
-            vread1.write(vread1.read() & ~stop_movement_bit)
+            # Ensure the motion bit is set to zero and reset the stop movement
+            # request bit if set.
+            edit = regs.edit().clear_bits(vread1, start_movement_bit | stop_movement_bit)
 
-        # check if enable bit is set, if not, make sure wheel is enable
-        if enable_bit is not None and (vread1.read() & enable_bit) == 0:
-            self.log.debug('Enabling wheel')
-            vread1.write(enable_bit)
+            # check if enable bit is set, if not, make sure wheel is enable
+            if enable_bit is not None and (edit[vread1] & enable_bit) == 0:
+                self.log.debug('Enabling wheel')
+                edit.set(vread1, enable_bit)
 
-        self.log.debug('VREAD {0}'.format(vread1.read()))
+            self.log.debug('VREAD {0}'.format(edit[vread1]))
 
-        # Set the filter position vector
-        self.log.debug('Setting filter position...')
+            # Set the filter position vector, along with the above in one write.
+            self.log.debug('Setting filter position...')
 
-        # Todo: Check that position is within limits!
-        vread2.write(filterpos)
-        start_time = time.time()
-        # Waiting for position to be set at the wheel controller
-        while get_required_pos.read() != filterpos:
-            self.log.debug('Filter position on wheel %i: %s/%s' % (wheel, get_required_pos.read(), filterpos))
-            if time.time()-start_time > self.timeout:
+            # Todo: Check that position is within limits!
+            edit.set(vread2, filterpos).flush()
+            # Waiting for position to be set at the wheel controller
+            if not self.wait_status(get_required_pos, lambda required: required == filterpos, self.timeout):
                 raise FilterPositionFailure("Could not set filter position.")
-            # Todo: Check for errors
-            time.sleep(0.5)
-        self.log.debug('Filter position: %s/%s' % (get_required_pos.read(), filterpos))
+            self.log.debug('Filter position: %s/%s' % (self.status(get_required_pos), filterpos))
 
-        # Move it
-        vread1.write(self._vread1.read() ^ start_movement_bit)
-        self.log.debug('VREAD1 {0}'.format(vread1.read()))
+            # Move it. Other drivers may have written the command word while
+            # the request was latched, so toggle on a fresh read of it.
+            regs = self.snapshot([vread1]).edit().toggle_bits(vread1, start_movement_bit).flush()
+            self.log.debug('VREAD1 {0}'.format(regs[vread1]))
 
         # End of function. Will not wait for movement to complete! This just starts the movement!
 
+    def start_move(self, filterpos, wheel=0, timeout=25, start_timeout=0.5):
+        """
+        Move ``wheel`` to ``filterpos`` in the background.
+
+        :param timeout: seconds for the wheel to arrive once it started.
+        :param start_timeout: seconds given to the PLC to pick up the move.
+        :return: WheelMove, done once the wheel is in position. Cancelling
+                 it sets the stop bit of the wheel.
+        """
+        def run(move):
+            if not move.begin():
+                return
+            self.move_element(filterpos, wheel)
+            self.wait_move_started(wheel, start_timeout, move.cancelling)
+            if not self.wait_position_reached(wheel, timeout, move.cancelling) and not move.cancelling.isSet():
+                self.check_hw()
+                raise FilterPositionFailure('Positioning wheel %i timed-out! Check Filter Wheel!' % wheel)
+
+        return WheelMove.start('wheel %i' % wheel, run, lambda: self.stop_element(wheel))
+
+    def stop_element(self, wheel):
+        """
+        Stop the motion of ``wheel``, with a rising edge of its stop bit.
+        """
+        vread1, vread2, start_movement_bit, \
+        stop_movement_bit, enable_bit, get_required_pos = self.setup_wheel(wheel)
+
+        regs = self.snapshot([vread1])
+        if regs[vread1] & stop_movement_bit:  # if stop is already set, unset it
+            regs = regs.edit().clear_bits(vread1, stop_movement_bit).flush()
+        regs.edit().set_bits(vread1, stop_movement_bit).flush()
+
     def get_pos(self, wheel=0):
         """
         Get current filter position.
@@ -186,15 +215,40 @@ class FSUPolDriver(FSUConn, FSUFWheels):
         return self.move_element(filterpos=filterpos,
                                  wheel=3)
 
+    def reached_flag(self, wheel):
+        """
+        :return: status register and bit flagging ``wheel`` in position.
+        """
+        return {0: (self._vwrite1, 1 << 2),
+                1: (self._vwrite1, 1 << 3),
+                2: (self._vwrite10, 1 << 2),
+                3: (self._vwrite20, 1 << 2)}.get(wheel)
+
     def position_reached(self, wheel):
-        if wheel == 0:
-            return (self._vwrite1.read() & (1 << 2)) != 0
-        elif wheel == 1:
-            return (self._vwrite1.read() & (1 << 3)) != 0
-        elif wheel == 2:
-            return (self._vwrite10.read() & (1 << 2)) != 0
-        elif wheel == 3:
-            return (self._vwrite20.read() & (1 << 2)) != 0
+        flag = self.reached_flag(wheel)
+        if flag is None:
+            return None
+        var, bit = flag
+        return (self.status(var) & bit) != 0
+
+    def wait_move_started(self, wheel, timeout, abort=None):
+        """
+        Wait for the position reached flag of ``wheel`` to drop. It is still
+        set right after move_element, until the PLC picks up the move.
+
+        :return: True if the flag dropped, False on timeout or abort.
+        """
+        var, bit = self.reached_flag(wheel)
+        return self.wait_status(var, lambda value: value & bit == 0, timeout, abort)
+
+    def wait_position_reached(self, wheel, timeout, abort=None):
+        """
+        Wait for ``wheel`` to reach its position.
+
+        :return: True once the flag is set, False on timeout or abort.
+        """
+        var, bit = self.reached_flag(wheel)
+        return self.wait_status(var, lambda value: value & bit != 0, timeout, abort)
 
     def disable_wheel(self, wheel):
         vread1, vread2, start_movement_bit, \
@@ -205,10 +259,10 @@ class FSUPolDriver(FSUConn, FSUFWheels):
             vread1.write(vread1.read() ^ enable_bit)
 
     def wp_position_reached(self):
-        return (self._vwrite10.read() & (1 << 2)) == 0
+        return (self.status(self._vwrite10) & (1 << 2)) == 0
 
     def pa_position_reached(self):
-        return self._vwrite20.read() & (1 << 2) != 0
+        return self.status(self._vwrite20) & (1 << 2) != 0
 
     def jog_calpol(self, mode):
         if mode is '+':
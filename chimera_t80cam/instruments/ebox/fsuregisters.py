@@ -0,0 +1,235 @@
+"""
+Read and write many PLC variables in a single ADS round trip.
+
+ADS sum commands (index groups 0xF080/0xF081) carry a list of read or write
+requests by symbol handle. They are sent through the adshli connection the
+drivers already hold, reusing the handles of their ads_var_single objects.
+"""
+
+import struct
+import logging
+
+from chimera_t80cam.instruments.ebox import adsproto
+from chimera_t80cam.instruments.ebox.fsuexceptions import FSUException
+
+log = logging.getLogger(name=__name__)
+
+_SUM_RESULT = struct.Struct('<I')
+
+
+class ADSError(FSUException):
+    pass
+
+
+class _ADSReadWrite(object):
+    """
+    ADS ReadWrite request in the form adshli's ads_connection.execute_cmd
+    expects: it builds its own frame and decodes the answer.
+    """
+
+    def __init__(self, group, offset, read_size, data):
+        self.group = group
+        self.offset = offset
+        self.read_size = read_size
+        self.data = data
+
+    def get_packet(self, invoke_id, conn):
+        data = adsproto.READ_WRITE_REQUEST.pack(self.group, self.offset,
+                                                self.read_size, len(self.data)) + self.data
+        return adsproto.pack_frame(adsproto.pack_netid(conn.ams_netid_target), conn.ams_port_target,
+                                   adsproto.pack_netid(conn.ams_netid_source), conn.ams_port_source,
+                                   adsproto.ADSCMD_READ_WRITE, adsproto.STATE_REQUEST, data,
+                                   invoke_id=invoke_id)
+
+    def decode_header(self, response):
+        reserved, length = adsproto.AMS_TCP_HEADER.unpack_from(response)
+        (target, target_port, source, source_port, command, flags,
+         data_length, error, invoke_id) = adsproto.AMS_HEADER.unpack_from(response, adsproto.AMS_TCP_HEADER.size)
+        header = {'ams_packet_lenght': length,
+                  'target_port': target_port,
+                  'error_code': error,
+                  'invoke_id': invoke_id}
+        return header, response[adsproto.FRAME_HEADER_SIZE:]
+
+    def decode_response(self, response):
+        # Errors are raised by the caller, execute_cmd does not expect them here.
+        header, data = self.decode_header(response)
+        if header['error_code']:
+            return header['error_code'], ''
+        result, length = adsproto.READ_RESPONSE.unpack_from(data)
+        return result, data[adsproto.READ_RESPONSE.size:adsproto.READ_RESPONSE.size + length]
+
+
+class RegisterSnapshot(object):
+    """
+    Values of a set of PLC variables, read at once. Values are looked up by
+    the ads_var_single object of the variable.
+    """
+
+    def __init__(self, registers, values):
+        self._registers = registers
+        self._values = dict(values)
+
+    def __getitem__(self, var):
+        return self._values[var]
+
+    def __contains__(self, var):
+        return var in self._values
+
+    def bit(self, var, bit):
+        """
+        :return: True if ``bit`` is set on ``var``.
+        """
+        return (self._values[var] & (1 << bit)) != 0
+
+    def edit(self):
+        """
+        Start a set of changes against this snapshot, see RegisterEdit.
+        """
+        return RegisterEdit(self._registers, self)
+
+
+class RegisterEdit(object):
+    """
+    Read-modify-write changes computed against a RegisterSnapshot and sent
+    with a single sum write on flush. Only variables whose value changed
+    are written.
+    """
+
+    def __init__(self, registers, snapshot):
+        self._registers = registers
+        self._snapshot = snapshot
+        self._changes = {}
+        self._order = []
+
+    def __getitem__(self, var):
+        if var in self._changes:
+            return self._changes[var]
+        return self._snapshot[var]
+
+    def set(self, var, value):
+        if var not in self._order:
+            self._order.append(var)
+        self._changes[var] = value
+        return self
+
+    def set_bits(self, var, mask):
+        return self.set(var, self[var] | mask)
+
+    def clear_bits(self, var, mask):
+        return self.set(var, self[var] & ~mask)
+
+    def toggle_bits(self, var, mask):
+        return self.set(var, self[var] ^ mask)
+
+    @property
+    def changes(self):
+        return [(var, self._changes[var]) for var in self._order
+                if var not in self._snapshot or self._changes[var] != self._snapshot[var]]
+
+    def flush(self):
+        """
+        Write the changed variables.
+
+        :return: the snapshot with the changes applied, no read is done.
+        """
+        changes = self.changes
+        if changes:
+            self._registers.write(changes)
+        values = dict(self._snapshot._values)
+        values.update(changes)
+        return RegisterSnapshot(self._registers, values)
+
+
+class FSURegisters(object):
+    """
+    Sum read and write of the FSU PLC registers.
+
+    :param conn: adshli ads_connection.
+    :param variables: ads_var_single objects to include in snapshots.
+    """
+
+    def __init__(self, conn, variables):
+        self.conn = conn
+        self.variables = list(variables)
+        self.sum_commands = True
+        self.round_trips = 0
+
+    @staticmethod
+    def _format(var):
+        return '<' + var.var_type
+
+    def read(self, variables=None):
+        """
+        Read ``variables`` (all registers by default) in one round trip.
+
+        :return: RegisterSnapshot
+        """
+        variables = self.variables if variables is None else list(variables)
+        if not self.sum_commands:
+            return self._read_single(variables)
+
+        requests = ''.join(adsproto.READ_REQUEST.pack(adsproto.ADSIGRP_SYM_VALBYHND, var.handle,
+                                                      struct.calcsize(self._format(var)))
+                           for var in variables)
+        read_size = sum(_SUM_RESULT.size + struct.calcsize(self._format(var)) for var in variables)
+        try:
+            data = self._execute(adsproto.ADSIGRP_SUMUP_READ, len(variables), read_size, requests)
+        except ADSError, e:
+            log.warning('Sum read not supported by the PLC (%s), reading registers one by one.' % e)
+            self.sum_commands = False
+            return self._read_single(variables)
+
+        values = {}
+        pos = len(variables) * _SUM_RESULT.size
+        for n, var in enumerate(variables):
+            result = _SUM_RESULT.unpack_from(data, n * _SUM_RESULT.size)[0]
+            if result:
+                raise ADSError('PLC returned error 0x%x reading %s.' % (result, var.var_name))
+            fmt = self._format(var)
+            values[var] = struct.unpack_from(fmt, data, pos)[0]
+            pos += struct.calcsize(fmt)
+        return RegisterSnapshot(self, values)
+
+    def write(self, changes):
+        """
+        Write a list of (variable, value) pairs in one round trip.
+        """
+        if not self.sum_commands:
+            return self._write_single(changes)
+
+        requests = ''.join(adsproto.WRITE_REQUEST.pack(adsproto.ADSIGRP_SYM_VALBYHND, var.handle,
+                                                       struct.calcsize(self._format(var)))
+                           for var, value in changes)
+        values = ''.join(struct.pack(self._format(var), value) for var, value in changes)
+        try:
+            data = self._execute(adsproto.ADSIGRP_SUMUP_WRITE, len(changes),
+                                 len(changes) * _SUM_RESULT.size, requests + values)
+        except ADSError, e:
+            log.warning('Sum write not supported by the PLC (%s), writing registers one by one.' % e)
+            self.sum_commands = False
+            return self._write_single(changes)
+
+        for n, (var, value) in enumerate(changes):
+            result = _SUM_RESULT.unpack_from(data, n * _SUM_RESULT.size)[0]
+            if result:
+                raise ADSError('PLC returned error 0x%x writing %s.' % (result, var.var_name))
+
+    def _execute(self, group, count, read_size, data):
+        self.round_trips += 1
+        response = self.conn.execute_cmd(_ADSReadWrite(group, count, read_size, data))
+        if response is None:
+            raise ADSError('Answer from the PLC addressed to another port.')
+        error, data = response
+        if error:
+            raise ADSError('PLC returned error 0x%x.' % error)
+        return data
+
+    def _read_single(self, variables):
+        self.round_trips += len(variables)
+        return RegisterSnapshot(self, [(var, var.read()) for var in variables])
+
+    def _write_single(self, changes):
+        self.round_trips += len(changes)
+        for var, value in changes:
+            var.write(value)
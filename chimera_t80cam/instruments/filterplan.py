@@ -0,0 +1,281 @@
+"""
+Order a batch of exposures to spend as little time as possible waiting for
+the filter wheels.
+
+A filter move overlaps the readout of the previous exposure (see
+T80Cam.prepareFilter), so only the part of a move longer than a readout is
+dead time. Batches up to MAX_EXACT groups are ordered optimally (Held-Karp),
+larger ones greedily.
+"""
+
+import threading
+
+# Largest number of groups ordered exactly, 2**n * n**2 steps.
+MAX_EXACT = 13
+
+
+class MoveTimeMatrix(object):
+    """
+    Filter wheel move times, in seconds, between wheel positions.
+
+    Measured moves are averaged per (from, to) pair. Pairs never measured
+    are estimated from the number of slots the wheel has to turn.
+
+    :param npositions: number of positions on the wheel.
+    :param overhead: time to start and settle a move.
+    :param per_slot: time to turn the wheel by one position.
+    """
+
+    def __init__(self, npositions, overhead=2., per_slot=1.):
+        self.npositions = npositions
+        self.overhead = overhead
+        self.per_slot = per_slot
+        self._measured = {}
+        self._lock = threading.Lock()
+
+    def distance(self, start, end):
+        """
+        Number of slots between two positions, the wheel turns either way.
+        """
+        steps = abs(end - start) % self.npositions
+        return min(steps, self.npositions - steps)
+
+    def record(self, start, end, elapsed):
+        with self._lock:
+            total, count = self._measured.get((start, end), (0., 0))
+            self._measured[(start, end)] = (total + elapsed, count + 1)
+
+    def estimate(self, start, end):
+        if start == end:
+            return 0.
+        if start is None:
+            # Unknown starting point, assume half a turn.
+            return self.overhead + self.per_slot * self.npositions / 2.
+        with self._lock:
+            measured = self._measured.get((start, end))
+        if measured:
+            return measured[0] / measured[1]
+        return self.overhead + self.per_slot * self.distance(start, end)
+
+    def matrix(self):
+        """
+        Return the full estimated matrix, rows are starting positions.
+        """
+        return [[self.estimate(start, end) for end in range(self.npositions)]
+                for start in range(self.npositions)]
+
+
+class PlanStep(object):
+    """
+    One exposure of an ExposurePlan.
+
+    :param index: position of the request in the batch given to plan_exposures.
+    :param move: estimated filter move before the exposure (s).
+    :param dead: part of the move not hidden by the previous readout (s).
+    """
+
+    def __init__(self, index, request, filter, move=0., dead=0.):
+        self.index = index
+        self.request = request
+        self.filter = filter
+        self.move = move
+        self.dead = dead
+
+    def __repr__(self):
+        return '<PlanStep #%i %s move=%.1fs dead=%.1fs>' % (self.index, self.filter, self.move, self.dead)
+
+
+class ExposurePlan(object):
+    """
+    Exposures in execution order, with the estimated filter wheel cost of
+    the order found and of the order the batch was given in.
+    """
+
+    def __init__(self, steps, given_dead=0., given_move=0.):
+        self.steps = steps
+        self.given_dead = given_dead
+        self.given_move = given_move
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    @property
+    def dead(self):
+        return sum(step.dead for step in self.steps)
+
+    @property
+    def move(self):
+        return sum(step.move for step in self.steps)
+
+    @property
+    def saved(self):
+        return self.given_dead - self.dead
+
+    def __repr__(self):
+        return '<ExposurePlan %i exposures dead=%.1fs move=%.1fs saved=%.1fs>' % (len(self.steps), self.dead,
+                                                                                  self.move, self.saved)
+
+
+class _Group(object):
+    # Requests run back to back, with a single filter move before them.
+
+    def __init__(self, filter, position):
+        self.filter = filter
+        self.position = position
+        self.members = []
+        self.after = set()
+
+
+def _groups(requests, positions):
+    """
+    Split the batch in groups. Free requests (no dependencies either way)
+    are grouped by filter, the others stay on their own so the order they
+    need can be kept.
+    """
+    depended = set()
+    for request in requests:
+        depended.update(request.get('after') or [])
+
+    groups = []
+    by_filter = {}
+    group_of = {}
+    for index, request in enumerate(requests):
+        flt = request['filter']
+        if flt not in positions:
+            raise ValueError('Unknown filter %s on request %i.' % (flt, index))
+
+        free = not request.get('after') and index not in depended
+        if free and flt in by_filter:
+            group = by_filter[flt]
+        else:
+            group = _Group(flt, positions[flt])
+            groups.append(group)
+            if free:
+                by_filter[flt] = group
+        group.members.append(index)
+        group_of[index] = group
+
+    for index, request in enumerate(requests):
+        for before in request.get('after') or []:
+            if not 0 <= before < len(requests) or before == index:
+                raise ValueError('Invalid dependency %s on request %i.' % (before, index))
+            group_of[index].after.add(groups.index(group_of[before]))
+
+    return groups
+
+
+def _cost(moves, start, end, readout):
+    # (dead time, move time) of the move between two groups. The first move
+    # has no readout to hide behind.
+    move = moves.estimate(start, end)
+    if readout is None:
+        return move, move
+    return max(0., move - readout), move
+
+
+def _add(a, b):
+    return a[0] + b[0], a[1] + b[1]
+
+
+def _order_exact(groups, moves, start, readout):
+    n = len(groups)
+    required = [sum(1 << j for j in group.after) for group in groups]
+
+    # best[(mask, last)] = ((dead, move), previous group)
+    best = {}
+    for j in range(n):
+        if not required[j]:
+            best[(1 << j, j)] = (_cost(moves, start, groups[j].position, None), None)
+
+    for mask in xrange(1, 1 << n):
+        for last in range(n):
+            entry = best.get((mask, last))
+            if entry is None:
+                continue
+            for j in range(n):
+                if mask & (1 << j) or required[j] & ~mask:
+                    continue
+                cost = _add(entry[0], _cost(moves, groups[last].position, groups[j].position, readout))
+                key = (mask | (1 << j), j)
+                if key not in best or cost < best[key][0]:
+                    best[key] = (cost, last)
+
+    full = (1 << n) - 1
+    ends = [(best[(full, last)][0], last) for last in range(n) if (full, last) in best]
+    if not ends:
+        raise ValueError('Circular dependencies between requests.')
+
+    order = []
+    mask, last = full, min(ends)[1]
+    while last is not None:
+        order.append(last)
+        previous = best[(mask, last)][1]
+        mask &= ~(1 << last)
+        last = previous
+    return order[::-1]
+
+
+def _order_greedy(groups, moves, start, readout):
+    order = []
+    done = 0
+    position = start
+    while len(order) < len(groups):
+        ready = [j for j, group in enumerate(groups)
+                 if not done & (1 << j) and all(done & (1 << k) for k in group.after)]
+        if not ready:
+            raise ValueError('Circular dependencies between requests.')
+        first = readout if order else None
+        j = min(ready, key=lambda j: (_cost(moves, position, groups[j].position, first), j))
+        order.append(j)
+        done |= 1 << j
+        position = groups[j].position
+    return order
+
+
+def _steps(requests, groups, order, moves, start, readout):
+    steps = []
+    position = start
+    for j in order:
+        group = groups[j]
+        for index in group.members:
+            dead, move = _cost(moves, position, group.position, readout if steps else None)
+            steps.append(PlanStep(index, requests[index], group.filter, move, dead))
+            position = group.position
+    return steps
+
+
+def plan_exposures(requests, positions, moves, start=None, readout=0.):
+    """
+    Order a batch of exposures to minimise filter wheel dead time, then
+    wheel travel.
+
+    :param requests: list of dicts, each with a 'filter' key and optionally
+                     'after', a list of indices of requests that have to
+                     run before it. Other keys are passed on untouched.
+    :param positions: dict mapping filter names to wheel positions.
+    :param moves: MoveTimeMatrix with the wheel move times.
+    :param start: current wheel position, None if unknown.
+    :param readout: readout time each move overlaps with (s).
+    :return: ExposurePlan
+    """
+    if not requests:
+        return ExposurePlan([])
+
+    groups = _groups(requests, positions)
+    if len(groups) <= MAX_EXACT:
+        order = _order_exact(groups, moves, start, readout)
+    else:
+        order = _order_greedy(groups, moves, start, readout)
+
+    # Cost of running the batch as given, for comparison.
+    given = (0., 0.)
+    position = start
+    for n, request in enumerate(requests):
+        given = _add(given, _cost(moves, position, positions[request['filter']], readout if n else None))
+        position = positions[request['filter']]
+
+    return ExposurePlan(_steps(requests, groups, order, moves, start, readout),
+                        given_dead=given[0], given_move=given[1])
@@ -0,0 +1,148 @@
+import os
+import mmap
+import shutil
+import logging
+
+from astropy.io.fits import Header
+
+log = logging.getLogger(__name__)
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+_COPY_CHUNK = 16 * BLOCK_SIZE * 64  # ~2.9 MB
+
+_BLANK_CARD = ' ' * CARD_SIZE
+_END_CARD = 'END'.ljust(CARD_SIZE)
+
+
+def _round_block(nbytes):
+    return ((nbytes + BLOCK_SIZE - 1) // BLOCK_SIZE) * BLOCK_SIZE
+
+
+def _header_block(cards, size):
+    # The END card has to be in the last block of the header, data starts
+    # on the next one. Reserved room goes before it, as blank cards.
+    return cards.ljust(size - CARD_SIZE) + _END_CARD
+
+
+def _is_card(card):
+    for c in card:
+        if not (' ' <= c <= '~'):
+            return False
+    return True
+
+
+def find_header_end(buf):
+    """
+    Return the size in bytes of the primary header (END card plus padding),
+    i.e. the offset of the data unit.
+
+    Files written without an END card are also handled: the header is then
+    assumed to stop at the block holding the first non-ASCII card.
+    """
+    size = len(buf)
+    pos = 0
+    while pos + CARD_SIZE <= size:
+        card = buf[pos:pos + CARD_SIZE]
+        if card[:8] == 'END     ':
+            return _round_block(pos + CARD_SIZE)
+        if not _is_card(card):
+            return (pos // BLOCK_SIZE) * BLOCK_SIZE
+        pos += CARD_SIZE
+    return _round_block(pos)
+
+
+class FitsHeaderEditor(object):
+    """
+    Edit the primary header of a FITS file without touching its data unit.
+
+    The header is parsed from a memory map of the file and exposed as an
+    astropy :class:`Header` in ``header``. :meth:`save` writes it back in
+    place as long as it fits in the space originally used by the header. If
+    it does not, the file is rewritten once, reserving room for
+    ``reserve_cards`` more cards so later edits can be done in place again.
+
+    Typical use::
+
+        editor = FitsHeaderEditor('tmp.fits')
+        editor.header.set('OBSERVER', 'me')
+        editor.save('final.fits', reserve_cards=36)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fp = open(filename, 'r+b')
+        self._mm = mmap.mmap(self._fp.fileno(), 0)
+
+        self.header_size = find_header_end(self._mm)
+        self.header = Header.fromstring(self._mm[:self.header_size])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def fits_in_place(self):
+        return len(self._cards()) + CARD_SIZE <= self.header_size
+
+    def save(self, dest=None, reserve_cards=0):
+        """
+        Write the header back and close the editor.
+
+        :param dest: optional new path for the file. The file is renamed
+                     (not copied) there when the header fits in place.
+        :param reserve_cards: number of blank cards to reserve if the header
+                              has to be grown.
+        :return: path of the written file.
+        """
+        cards = self._cards()
+        dest = dest or self.filename
+
+        if len(cards) + CARD_SIZE <= self.header_size:
+            self._mm[:self.header_size] = _header_block(cards, self.header_size)
+            self._mm.flush()
+            self.close()
+            if dest != self.filename:
+                # A plain rename unless dest is on another file system.
+                shutil.move(self.filename, dest)
+            return dest
+
+        log.debug('Header of %s does not fit in %i bytes, rewriting file.' % (self.filename,
+                                                                             self.header_size))
+        new_size = _round_block(len(cards) + (reserve_cards + 1) * CARD_SIZE)
+        part = dest + '.part'
+        with open(part, 'wb') as out:
+            out.write(_header_block(cards, new_size))
+            size = len(self._mm)
+            nbytes = size - self.header_size
+            for start in range(self.header_size, size, _COPY_CHUNK):
+                out.write(self._mm[start:min(start + _COPY_CHUNK, size)])
+            padding = _round_block(nbytes) - nbytes
+            if padding:
+                out.write('\0' * padding)
+        self.close()
+
+        os.rename(part, dest)
+        if dest != self.filename:
+            os.remove(self.filename)
+
+        self.header_size = new_size
+        self.filename = dest
+        return dest
+
+    def _cards(self):
+        # Trailing blank cards are free room, reserved by an earlier save.
+        cards = self.header.tostring(sep='', endcard=False, padding=False)
+        while cards.endswith(_BLANK_CARD):
+            cards = cards[:-CARD_SIZE]
+        return cards
@@ -0,0 +1,109 @@
+import time
+import logging
+import threading
+
+import numpy as N
+
+from chimera.core.exceptions import ChimeraException
+
+from chimera_t80cam.instruments import siprotocol
+
+log = logging.getLogger(__name__)
+
+
+class FramePoolExhausted(ChimeraException):
+    pass
+
+
+class FramePool(object):
+    """
+    Bounded pool of full-frame pixel buffers.
+
+    Buffers are allocated lazily, up to ``slots`` of them, and then recycled.
+    A frame is checked out for readout with :meth:`acquire` and must be given
+    back with :meth:`release` once its FITS file is written. When every slot
+    is in use, :meth:`acquire` blocks until one is returned or the timeout
+    expires, so memory use never grows beyond ``slots`` frames.
+    """
+
+    def __init__(self, slots, width, height, dtype=siprotocol.FRAME_DTYPE):
+        self.slots = int(slots)
+        self.width = int(width)
+        self.height = int(height)
+        self.dtype = N.dtype(dtype)
+
+        self._cond = threading.Condition()
+        self._free = []
+        self._busy = {}
+        self._allocated = 0
+
+    def __len__(self):
+        return self._allocated
+
+    @property
+    def frame_size(self):
+        return self.width * self.height
+
+    @property
+    def in_use(self):
+        with self._cond:
+            return len(self._busy)
+
+    def fits(self, width, height):
+        return self.width == int(width) and self.height == int(height)
+
+    def acquire(self, width=None, height=None, timeout=None):
+        """
+        Check out a frame buffer.
+
+        :param width: image width, defaults to the full frame.
+        :param height: image height, defaults to the full frame.
+        :param timeout: seconds to wait for a free slot, None waits forever.
+        :return: flat numpy array with room for width x height pixels.
+        """
+        width = self.width if width is None else int(width)
+        height = self.height if height is None else int(height)
+
+        if width * height > self.frame_size:
+            raise FramePoolExhausted("Requested frame (%i x %i) is larger than the pool frame size (%i x %i)." %
+                                     (width, height, self.width, self.height))
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        with self._cond:
+            while not self._free and self._allocated >= self.slots:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise FramePoolExhausted("All %i frame buffers still in use after %.1f s. "
+                                             "Frames are not being written fast enough." %
+                                             (self.slots, timeout))
+                self._cond.wait(remaining)
+
+            if self._free:
+                base = self._free.pop()
+            else:
+                log.debug('Allocating frame buffer %i/%i (%i x %i)' % (self._allocated + 1, self.slots,
+                                                                      self.width, self.height))
+                base = N.empty(self.frame_size, dtype=self.dtype)
+                self._allocated += 1
+
+            frame = base[:width * height]
+            self._busy[id(frame)] = (frame, base)
+
+        return frame
+
+    def release(self, frame):
+        """
+        Return a frame buffer obtained from :meth:`acquire` to the pool.
+        """
+        with self._cond:
+            try:
+                frame, base = self._busy.pop(id(frame))
+            except KeyError:
+                log.warning('Trying to release a frame that does not belong to the pool.')
+                return
+            self._free.append(base)
+            self._cond.notify()
@@ -1,21 +1,25 @@
 
 import os
-import re
 import logging
 import threading
-import gc
 import Queue
 
 import numpy as N
 from astropy.io.fits import Header
 from astropy.io import fits as pyfits
 
-import select
-
 from si.client import SIClient, AckException
 from si.commands.camera import *
-from si.packet import Packet
-from si.packets.ack import Ack
+
+from chimera_t80cam.instruments import siprotocol
+from chimera_t80cam.instruments.sichannel import SIChannel
+from chimera_t80cam.instruments.siparams import ParameterTable, parse_value
+from chimera_t80cam.instruments.framepool import FramePool
+from chimera_t80cam.instruments.fitsheader import FitsHeaderEditor
+from chimera_t80cam.instruments.compression import TileCompressor, get_codec, parse_options
+from chimera_t80cam.instruments.workerpool import WorkerPool, WorkerPoolFull
+from chimera_t80cam.instruments.timing import PhaseTimer, RollingHistogram, TimedLock, locked, monotonic
+from chimera_t80cam.instruments.telemetry import TelemetrySampler
 
 from chimera.interfaces.camera import (CCD, CameraFeature, ReadoutMode,
                                        InvalidReadoutMode, CameraStatus,
@@ -24,8 +28,6 @@ from chimera.interfaces.camera import (CCD, CameraFeature, ReadoutMode,
 from chimera.util.image import Image, ImageUtil
 from chimera.instruments.camera import CameraBase
 from chimera.util.enum import Enum
-from chimera.core.lock import lock
-from chimera.core.rwlock import ReadWriteLock
 from chimera.core.exceptions import ChimeraException
 from chimera.core.version import _chimera_name_, _chimera_long_description_
 from chimera.controllers.imageserver.util import getImageServer
@@ -63,15 +65,41 @@ class SIBase(CameraBase):
                   'camera_host': '127.0.0.1',
                   'camera_port': 2055,
                   'localhost': False,
-                  "local_filename" : 'tmp.fits',
+                  "command_timeout": 30., # Longest wait for the camera server to answer a command (s)
+                  "acquisition_timeout": 300., # Time allowed per frame, beyond the exposure time, for its data (s)
+                  "local_filename" : 'tmp.fits', # Spooled frames are named after it, e.g. tmp-<pid>-000001.fits
                   "local_path" : '/tmp/',
+                  "spool_dir" : 'spool', # Directory within local_path the frames being finished are kept on
+                  "raw_frames" : True, # Write remote mode frames as raw 16-bit FITS, finished like localhost ones
                   "fast_mode" : True, # May return image with unfinished header
+                  "header_reserve_cards": 36, # Spare header cards kept when a header has to be grown
+                  "compress_processes": 0, # Worker processes for tile compression, 0 uses all cores
+                  "compress_rows_per_job": 256, # Image rows handed to a compression worker at a time
+                  "compress_options": "", # Codec options, e.g. "hcomp_scale=2.5,quantize_level=16"
+                  "finish_workers": 2, # Threads finishing frames in the background on fast mode
+                  "finish_max_pending": 4, # Frames allowed to wait for them before readout blocks
+                  "finish_timeout": 600., # Longest a readout waits for room in the queue before compressing itself (s)
+                  "timing_headers": False, # Write exposure phase timings to the frame header
+                  "timing_history": 500, # Frames kept in the phase timing histograms
+                  "binnings": "1x1,2x2,3x3,4x4", # Binnings advertised as readout modes, others are added on request
+                  "exposure_poll_min": 0.05, # Shortest interval between exposure progress polls (s)
+                  "exposure_poll_max": 10., # Longest interval between exposure progress polls (s)
+                  "abort_latency": 0.2, # Longest an abort request waits to be noticed while exposing (s)
+                  "burst_mode": False, # Acquire multi-frame requests in a single camera acquisition
+                  "burst_acquisition_mode": 1, # SI acquisition mode used for bursts (see get_acq_modes)
+                  "telemetry_interval": 5., # Camera status sampling interval (s), 0 samples from control() instead
+                  "telemetry_samples": 4096, # Status samples kept, see getTelemetry
 
                   # WCS information
                   "parity_y" : 1., # Up is North
                   "parity_x" : 1., # Left is East
                   "max_files": 10,
 
+                  # Frame buffers for remote readout. Acquisition waits up to
+                  # frame_pool_timeout seconds for a free buffer.
+                  "frame_pool_slots": 2,
+                  "frame_pool_timeout": 60.,
+
                   "bad_cards" : "NAXIS3,DATE-OBS,PG0_1,PG1_1,PG1_2,PG0_10,PG0_15,PG0_54,PG0_55,PG0_56",
                   "ccdtemp" : 'PG0_56',
                   "instrumentTemperature" : 'PG0_55',
@@ -140,8 +168,13 @@ class SIBase(CameraBase):
 
         self.abort.clear()
         self.client = None
-        self.pars = list()
-        self.stats = list()
+        # Multiplexed access to the client connection, see getClient.
+        self._channel = None
+        self._acquisition = None
+        # Camera parameters and status, see get_config and get_status.
+        self.pars = ParameterTable()
+        self.stats = ParameterTable()
+        self._geometry = self._computeGeometry(self.pars)
         self.sgl2 = list()
 
         self.ccd = 0
@@ -170,8 +203,8 @@ class SIBase(CameraBase):
 
         self._adcs = {"12 bits": 0}  # Check
 
-        self._temperature = None
-        self._pressure = None
+        # Camera status history, sampled on a thread of its own. See get_status.
+        self._telemetry = TelemetrySampler(self._sampleStatus, name='si-telemetry')
 
         countBinns = count(0)
         self._binnings = defaultdict(countBinns.next)
@@ -188,11 +221,43 @@ class SIBase(CameraBase):
 
         self.imghdr = Header()
 
-        self._threadList = []
-
-        self._cleanQueueLock = threading.Lock()
-        self._WriteCompressedFile = threading.Lock()
-        self._updateInfos = ReadWriteLock()
+        # Pool of reusable frame buffers for remote readout. Pixels are
+        # received straight into them, see siprotocol.ImageReceiver.
+        self._framePool = None
+
+        self._finishPool = None
+
+        # Multi-frame acquisition in progress, see _expose.
+        self._burst = None
+
+        # Exposure progress polls and end detection latency, see getPollStats.
+        self._pollCounts = RollingHistogram()
+        self._endLatency = RollingHistogram()
+
+        # Last value sent to the camera for each setting, see _setCameraSetting.
+        self._cameraSettings = {}
+        self._settingsLock = threading.Lock()
+        self._settingsSent = 0
+        self._settingsSkipped = 0
+        self._settingsTime = 0.
+
+        # Exposure phase timings, see getTimingStats.
+        self._timer = PhaseTimer()
+        self._frameTiming = None
+
+        # Locks are per resource, so that a readout in progress only holds
+        # back what it uses. Read-only getters take none. See getLockStats.
+        #   channel: connection to the camera server and cooler commands.
+        #   parameters: camera parameters, readout modes and settings read
+        #     from the camera.
+        #   pipeline: getting the frame off the camera, up to it being
+        #     received (remote mode) or spooled (localhost mode).
+        self._channelLock = TimedLock('channel')
+        self._paramsLock = TimedLock('parameters')
+        self._cleanQueueLock = TimedLock('pipeline')
+        # Numbers the frames spooled in localhost mode, see _spoolFrame.
+        self._spoolSequence = count(1)
+        self._compressor = None
         self._tmpFilesProxyQueue = Queue.Queue()
         self._finalFilesProxyQueue = Queue.Queue()
 
@@ -202,6 +267,7 @@ class SIBase(CameraBase):
         self.get_status()
         self.get_config()
         self.get_camera_settings()
+        self.startTelemetry()
         self.setHz(0.1)
         #self.setHz(1.0 / 30.0)
 
@@ -214,17 +280,25 @@ class SIBase(CameraBase):
         except SIException:
             pass
 
+        self._telemetry.stop()
+
+        if self._finishPool is not None:
+            self._finishPool.stop()
+
+        if self._compressor is not None:
+            self._compressor.close()
+
     def control(self):
         return self._si_control()
 
     def _si_control(self):
 
-        for i in range(len(self._threadList)-1,-1,-1):
-            if not self._threadList[i].isAlive():
-                self._threadList.pop(i)
-
-        # self.log.debug("[control] Updating camera status.")
-        self.get_status()
+        if self["telemetry_interval"] <= 0:
+            # self.log.debug("[control] Updating camera status.")
+            self.get_status()
+        elif not self._telemetry.running:
+            # Not started yet by subclasses with a start-up of their own, e.g. T80Pol.
+            self.startTelemetry()
 
         # self.log.debug("[control] Proxy queue sizes: %i %i" % (self._tmpFilesProxyQueue.qsize(),
         #                                                        self._finalFilesProxyQueue.qsize()))
@@ -273,7 +347,7 @@ class SIBase(CameraBase):
         #
         return True
 
-    @lock
+    @locked('_channelLock')
     def open(self):
         """
         Open connection with SI Camera server.
@@ -284,19 +358,24 @@ class SIBase(CameraBase):
 
         return self.connectSIClient()
 
+    @locked('_channelLock')
     def connectSIClient(self):
         self.log.debug("Connecting to SI Camera Server @ %s:%s" % (
             self["camera_host"], self["camera_port"]))
 
+        self._invalidateSettings()
         self.client = SIClient(self['camera_host'], self['camera_port'])
         try:
             self.client.connect()
         except SIException as e:
             self.log.critical("Connection error: {}".format(e))
             return False
+
+        self._channel = SIChannel(self.client, timeout=self["command_timeout"])
+        self._channel.start()
         return True
 
-    @lock
+    @locked('_channelLock')
     def close(self):
         while not self._tmpFilesProxyQueue.empty():
             try:
@@ -305,12 +384,31 @@ class SIBase(CameraBase):
             except Exception, e:
                 self.log.exception(e)
 
+        self._invalidateSettings()
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
         self.client.disconnect()
 
     def getClient(self):
-        return self.client
+        """
+        Return the channel commands to the camera server go through. A channel
+        that lost step with the server is replaced by a new connection.
+        """
+        if self._channel is not None and self._channel.broken:
+            with self._channelLock:
+                # Someone else may have reconnected while we waited.
+                if self._channel is not None and self._channel.broken:
+                    self.log.warning('Camera server connection lost. Reconnecting...')
+                    self._channel.close()
+                    try:
+                        self.client.disconnect()
+                    except Exception, e:
+                        self.log.debug('Error closing old connection: %s' % e)
+                    self.connectSIClient()
+        return self._channel
 
-    @lock
+    @locked('_paramsLock')
     def get_config(self):
         """
         Get the camera configuration parameters.
@@ -318,88 +416,174 @@ class SIBase(CameraBase):
         .. method:: configure()
 
         """
-        self.pars = []
         client = self.getClient() #self.client
-        lines = client.executeCommand(
-            GetCameraParameters()).parameterlist.splitlines()
-        for i in range(len(lines)):
-            self.pars += [re.split(',(.+),', lines[i])]
-        for i in range(len(self.pars) - 1):
-            if "Installed CCDs" in self.pars[i][1]:
-                self._nCCDs = int(self.pars[i][2])
-                # if "Serial Binning" in cam.pars[i][1]:
-                #     self.sbin = cam.pars[i][2]
-                # if "Parallel Binning" in cam.pars[i][1]:
-                #     self.pbin = cam.pars[i][2]
+        pars = ParameterTable.from_parameters(
+            client.executeCommand(GetCameraParameters()).parameterlist)
+        # Derived values are worked out once here, getters just return them.
+        self._geometry = self._computeGeometry(pars)
+        self.pars = pars
 
+        self._nCCDs = pars.get("Installed CCDs", 0)
         if self._nCCDs == 0:
             self._nCCDs = 1
 
         for i in range(self._nCCDs):
             self._ccds[i] = i
 
-        self._binnings = {"1x1": 0}
-        self._binning_factors = {"1x1": 1}
-
         # ToDo: Read gain from camera parameters
         self._gain = [0, 1]
 
         # ToDo: Read read-out-speed from camera parameters
         self._ros = ['101MHz', '500kHz', '250kHz', '100kHz']
 
-        # This readoutMode stores only geometrical information.
+        # One readout mode per binning. They store only geometrical information.
+        self._binnings = {}
+        self._binning_factors = {}
+        self._readoutModes = {}
+        binnings = [b.strip() for b in self["binnings"].split(',') if b.strip()]
+        if "1x1" not in binnings:
+            binnings.insert(0, "1x1")
+        for binning in binnings:
+            self._addBinning(binning)
+
+        self._setupFramePool()
+
+    def _computeGeometry(self, pars):
+        """
+        Return the values derived from the camera parameters that are used
+        on every frame.
+        """
+        setpoint = pars.get("Temperature Setpoint")
+        if setpoint is not None:
+            # Stored in K*10.
+            setpoint = setpoint / 10. - 273.15
+
+        return {'physical': (pars.get("Serial Active Pix.", 0),
+                             pars.get("Parallel Active Pix.", 0)),
+                # Fixme: Properly read this from "Image Area Size X/Y"
+                'pixel': (9., 9.),
+                'overscan': (pars.get("Serial Pre-Masked", 0),
+                             pars.get("Parallel Pre-Masked", 0)),
+                'setpoint': setpoint}
+
+    def _parseBinning(self, binning):
+        """
+        Return the (serial, parallel) factors of a binning given as "SxP".
+        """
+        try:
+            srl_bin, prl_bin = [int(b) for b in binning.lower().split('x')]
+        except (AttributeError, ValueError):
+            raise InvalidReadoutMode("Invalid binning %s, use SERIALxPARALLEL (e.g. 2x2)." % binning)
+
+        if srl_bin < 1 or prl_bin < 1:
+            raise InvalidReadoutMode("Invalid binning %s." % binning)
+
+        return srl_bin, prl_bin
+
+    @locked('_paramsLock')
+    def _addBinning(self, binning):
+        """
+        Register a binning and its readout mode on every CCD.
+        """
+        srl_bin, prl_bin = self._parseBinning(binning)
+        full_width, full_height = self.getPhysicalSize()
+        pix_w, pix_h = self.getPixelSize()
+
+        binId = len(self._binnings)
+        self._binnings[binning] = binId
+        self._binning_factors[binning] = srl_bin
+
         for ccd in self._ccds.keys():
-            romode = {}
-            mode = 0
-            for g in self._gain:
-                readoutMode = ReadoutMode()
-                readoutMode.mode = mode
-                readoutMode.gain = g
-                readoutMode.width, readoutMode.height = self.getPhysicalSize()
-                readoutMode.pixelWidth, readoutMode.pixelHeight = \
-                    self.getPixelSize()
-                romode[mode] = readoutMode
-            self._readoutModes[ccd] = romode
-
-    @lock
+            readoutMode = ReadoutMode()
+            readoutMode.mode = binId
+            readoutMode.gain = self._gain[0]
+            readoutMode.width, readoutMode.height = full_width // srl_bin, full_height // prl_bin
+            readoutMode.pixelWidth, readoutMode.pixelHeight = pix_w * srl_bin, pix_h * prl_bin
+            self._readoutModes.setdefault(ccd, {})[binId] = readoutMode
+
     def get_status(self):
         """
-        Return camera status table.
-            Generates an instance list of lists containing group,name.value
-             strings.
-        .. method:: get_status()
-            Generates an instance list of lists containing name,value,unit
-             strings.
+        Update the camera status table, self.stats, and store a telemetry
+        sample. This is done in the background every telemetry_interval
+        seconds, see startTelemetry.
         """
+        # The buffer is sized on the first sample, which may come before
+        # startTelemetry.
+        self._telemetry.size = self["telemetry_samples"]
         try:
-            self._updateInfos.acquireWrite()
-
-            client = self.getClient()
-            lines = client.executeCommand(
-                GetStatusFromCamera()).statuslist.splitlines()
-            self.stats = []
-            for i in range(len(lines)):
-                self.stats += [re.split(',(.+),', lines[i])]
-
-            ttpl = list()
-            for i in range(len(self.stats)):
-                if "CCD Temp." in self.stats[i][0]:
-                    ttpl.append(self.stats[i][1].replace(',', '.'))
-            self._temperature = float(ttpl[self.getCurrentCCD()])
-
-            ttpl = list()
-
-            for i in range(len(self.stats)):
-                # self.log.debug('%s = %s' %(self.stats[i][0],self.stats[i][1]) )
-                if "Chamber Pressure" in self.stats[i][0]:
-                    ttpl.append(self.stats[i][1].replace(',', '.'))
-            self._pressure = float(ttpl[self.getCurrentCCD()])
+            self._telemetry.sampleNow()
         except:
             self.log.warning('Could not update camera status.')
-        finally:
-            self._updateInfos.release()
 
-    @lock
+    def _sampleStatus(self):
+        """
+        Read the camera status. Return its numeric entries by name, with
+        "#n" appended for repeated ones, e.g. "CCD Temp.#1" for the second
+        CCD.
+        """
+        client = self.getClient()
+        stats = ParameterTable.from_status(
+            client.executeCommand(GetStatusFromCamera()).statuslist)
+        self.stats = stats
+
+        values = {}
+        for entry in stats:
+            if not isinstance(entry.value, (int, float)):
+                continue
+            name = entry.name
+            n = 1
+            while name in values:
+                name = '%s#%i' % (entry.name, n)
+                n += 1
+            values[name] = entry.value
+        return values
+
+    def startTelemetry(self):
+        """
+        Start sampling the camera status every telemetry_interval seconds.
+        """
+        self._telemetry.interval = self["telemetry_interval"]
+        self._telemetry.size = self["telemetry_samples"]
+        if self._telemetry.interval > 0:
+            self._telemetry.start()
+
+    def _statusField(self, name):
+        ccd = self.getCurrentCCD()
+        return '%s#%i' % (name, ccd) if ccd else name
+
+    def _telemetryValue(self, name, timestamp=None, default=None):
+        """
+        Return the status entry ``name`` of the current CCD, as last sampled
+        or interpolated at ``timestamp``. No command is sent to the camera.
+        """
+        buf = self._telemetry.buffer
+        name = self._statusField(self.stats.match(name) or name)
+        if buf is None or name not in buf.fields:
+            return default
+        if timestamp is None:
+            return buf.latest(name, default)
+        return buf.at(name, timestamp, default)
+
+    def getTelemetry(self, since=None):
+        """
+        Return the camera status samples kept, as a dict of lists: the
+        sample times (seconds since the epoch) on 'time' and one list per
+        status entry.
+
+        :param since: only return samples taken after this time.
+        """
+        buf = self._telemetry.buffer
+        if buf is None:
+            return {'time': []}
+        samples = buf.snapshot()
+        if since is not None:
+            samples = samples[samples[:, 0] > since]
+        telemetry = {'time': samples[:, 0].tolist()}
+        for i, name in enumerate(buf.fields):
+            telemetry[name] = samples[:, i + 1].tolist()
+        return telemetry
+
+    @locked('_paramsLock')
     def get_camera_settings(self):
         """
         Return the SGLII settings.
@@ -408,7 +592,7 @@ class SIBase(CameraBase):
         client = self.getClient()
         self.sgl2 = client.executeCommand(GetSIImageSGLIISettings())
 
-    @lock
+    @locked('_paramsLock')
     def get_acq_modes(self):
         """
 
@@ -418,7 +602,6 @@ class SIBase(CameraBase):
         self.acqmodes = client.executeCommand(
             GetAcquisitionModes()).menuinfolist.splitlines()
 
-    @lock
     def get_xml_files(self, thefile):
         # Get the main files list
         client = self.getClient()
@@ -435,7 +618,7 @@ class SIBase(CameraBase):
         # for f in flist:
         #     pass
 
-    @lock
+    @locked('_channelLock')
     def startCooling(self, tempC):
         # TODO: works, doesn't return
         # send command
@@ -447,7 +630,7 @@ class SIBase(CameraBase):
         else:
             return True
 
-    @lock
+    @locked('_channelLock')
     def stopCooling(self):
         # send command
         client = self.getClient()
@@ -458,7 +641,6 @@ class SIBase(CameraBase):
         else:
             return True
 
-    @lock
     def isCooling(self):
         NotImplementedError()
 
@@ -466,26 +648,11 @@ class SIBase(CameraBase):
         return False
 
     def getTemperature(self):
-        try:
-            self._updateInfos.acquireRead()
-            rval = self._temperature
-            return rval
-        except:
-            return -999.
-        finally:
-            self._updateInfos.release()
+        return self._telemetryValue("CCD Temp.", default=-999.)
 
     def getPressure(self):
-        try:
-            self._updateInfos.acquireRead()
-            rval = self._pressure
-            return rval
-        except:
-            return -999.
-        finally:
-            self._updateInfos.release()
+        return self._telemetryValue("Chamber Pressure", default=-999.)
 
-    @lock
     def getSetPoint(self):
         """
         Return the CCD(s) temperature set point.
@@ -493,10 +660,7 @@ class SIBase(CameraBase):
 
         :return: temperature in C.
         """
-        for i in range(len(self.pars)):
-            if "Temperature Setpoint" in self.pars[i][1]:
-                temp = (int(self.pars[i][2]) / 10.) - 273.15
-        return temp
+        return self._geometry['setpoint']
 
     def getCCDs(self):
         return self._ccds
@@ -522,38 +686,14 @@ class SIBase(CameraBase):
         return self._adcs
 
     def getPhysicalSize(self):
-        length, heigth = 0, 0
-        for i in range(len(self.pars)):
-            if "Serial Active Pix." in self.pars[i]:
-                length = int(self.pars[i][2])
-            elif "Parallel Active Pix." in self.pars[i]:
-                heigth = int(self.pars[i][2])
-
-        return length, heigth
+        return self._geometry['physical']
 
     def getPixelSize(self):
-        xsize, ysize = self.getPhysicalSize()
-
-        length, heigth = 0, 0
-        for i in range(len(self.pars)):
-            if "Image Area Size X" in self.pars[i]:
-                length = float(self.pars[i][2])  # /xsize
-            elif "Image Area Size Y" in self.pars[i]:
-                heigth = float(self.pars[i][2])  # /ysize
-        # Fixme: Properly read this from the configuration
-
-        return 9., 9. #length, heigth
+        return self._geometry['pixel']
 
     def getOverscanSize(self, ccd=None):
         # ToDo: Select CCD
-        length, heigth = 0, 0
-        for i in range(len(self.pars)):
-            if "Serial Pre-Masked" in self.pars[i]:
-                length = int(self.pars[i][2])
-            elif "Parallel Pre-Masked" in self.pars[i]:
-                heigth = int(self.pars[i][2])
-
-        return (length, heigth)
+        return self._geometry['overscan']
 
     def getReadoutModes(self):
         return self._readoutModes
@@ -566,102 +706,248 @@ class SIBase(CameraBase):
         shutterRequest = imageRequest['shutter']
         client = self.getClient()
 
+        if self._timer.size != self["timing_history"]:
+            self._timer = PhaseTimer(self["timing_history"])
+        timing = self._frameTiming = self._timer.frame()
+
+        burst = self._burst
+        if burst is not None and burst['request'] is imageRequest and burst['next'] < burst['frames']:
+            return self._exposeBurstFrame(imageRequest, burst, timing)
+        self._burst = None
+
         if shutterRequest == Shutter.OPEN:
-            shutter = client.executeCommand(SetAcquisitionType(0))  # Light
+            self._setCameraSetting('acquisition_type', 0, SetAcquisitionType(0))  # Light
         elif shutterRequest == Shutter.CLOSE:
-            shutter = client.executeCommand(SetAcquisitionType(1))  # Dark
+            self._setCameraSetting('acquisition_type', 1, SetAcquisitionType(1))  # Dark
         elif shutterRequest == Shutter.LEAVE_AS_IS:  # As it was
             pass
         else:
             self.log.warning("Incorrect shutter option (%s). Leaving shutter intact" % shutterRequest)
 
-        if not imageRequest['binning']:
-            srl_bin, prl_bin = 1, 1
+        (mode, binning, top, left,
+         width, height) = self._getReadoutModeInfo(imageRequest["binning"],
+                                                   imageRequest["window"])
+        srl_bin, prl_bin = self._parseBinning(binning)
+
+        frames = int(imageRequest['frames'] or 1)
+        if self["burst_mode"] and frames > 1:
+            # All frames come from one acquisition, _readout streams them out as they arrive.
+            mode = self["burst_acquisition_mode"]
+            self._setCameraSetting('acquisition_mode', mode, SetAcquisitionMode(mode))
+            self._setCameraSetting('frames', frames, SetNumberOfFrames(frames))
+            self._burst = {'request': imageRequest, 'frames': frames, 'next': 1}
         else:
-            try:
-                srl_bin, prl_bin = imageRequest['binning'].split('x')
-            except:
-                self.log.error('Could not determine binning. Using 1x1')
-                srl_bin, prl_bin = 1, 1
-                pass
-
-                #  (mode, binning, top, left, width, height) =
-                #  self._getReadoutModeInfo(imageRequest["binning"],
-                # imageRequest["window"])
-
-        client.executeCommand(SetAcquisitionMode(0))  # Chimera will always execute SINGLE FRAMES
-        client.executeCommand(SetExposureTime(imageRequest["exptime"]))
-        # self.client.executeCommand(SetNumberOfFrames(self["frames"]))
-        # self.client.executeCommand(
-        # SetCCDFormatParameters(0, 4096, srl_bin, 0, 4096, prl_bin))
+            self._setCameraSetting('acquisition_mode', 0, SetAcquisitionMode(0))  # Single frame
+        exptime = imageRequest["exptime"]
+        self._setCameraSetting('exptime', exptime, SetExposureTime(exptime))
+        # Origins and lengths are given in unbinned pixels, the window in binned ones.
+        ccd_format = (left * srl_bin, width * srl_bin, srl_bin, top * prl_bin, height * prl_bin, prl_bin)
+        self._setCameraSetting('format', ccd_format, SetCCDFormatParameters(*ccd_format))
+        timing.lap('setup')
 
         cmd = Acquire()
-        cmd_to_send = cmd.command()
         # save time exposure started
         self.__lastFrameStart = dt.datetime.utcnow()
-        self.lastFrameTemp = -999. # self.getTemperature()
+        self.__lastFrameStartTime = time.time()
+        self.lastFrameTemp = self._telemetryValue("CCD Temp.", self.__lastFrameStartTime, -999.)
 
         status = CameraStatus.OK
 
         # ok, start it
         self.exposeBegin(imageRequest)
 
-        # send Acquire command
-        bytes_sent = client.sk.send(cmd_to_send.toStruct())
+        # send Acquire command. Its data packets, one per frame, arrive as
+        # frames are read out and are picked up on _readout.
+        packets = self._burst['frames'] if self._burst is not None else 1
+        self._acquisition = client.submit(cmd, deferred=True, packets=packets,
+                                          timeout=packets * (float(imageRequest["exptime"]) +
+                                                             self["acquisition_timeout"]))
 
         # check acknowledge
-        ret = select.select([client.sk], [], [])
-        if not ret[0]:
-            raise SIException('No answer from camera')
+        try:
+            if not self._acquisition.wait_ack(self["command_timeout"]):
+                raise SIException('No answer from camera')
+        except:
+            self._invalidateSettings()
+            raise
 
-        if ret[0][0] == client.sk:
+        timing.lap('acquire_ack')
 
-            header = Packet()
-            header_data = client.recv(len(header))
-            header.fromStruct(header_data)
+        self.abort.clear()
 
-            if header.id == 129:
-                ack = Ack()
-                ack.fromStruct(header_data + client.recv(header.length - len(header)))
+        # Exposure progress is not polled on bursts, frames are waited for
+        # (and aborts handled) on _readout.
+        if self._burst is None:
+            status = self._waitExposure(client, float(imageRequest["exptime"]))
 
-                if not ack.accept:
-                    raise AckException("Camera did not accepted command...")
-            else:
-                raise AckException("No acknowledge received from camera...")
+        timing.lap('exposing')
 
-        self.abort.clear()
+        return self._endExposure(imageRequest, status)
 
-        while self._isExposing():
+    def _waitExposure(self, client, exptime):
+        """
+        Wait for the camera to finish exposing.
+
+        Progress is polled on a schedule that backs off with the time left:
+        the wait before each poll is half the remaining exposure, between
+        exposure_poll_min and exposure_poll_max. The time left is counted
+        from the time elapsed since the exposure began, kept within 1% of
+        the exp_done_percent the camera reports, which is too coarse to
+        time the end of long exposures by itself. Abort requests are checked
+        at least every abort_latency seconds in between polls.
+
+        :return: CameraStatus.OK, or CameraStatus.ABORTED.
+        """
+        poll_min = self["exposure_poll_min"]
+        poll_max = max(poll_min, self["exposure_poll_max"])
+        abort_latency = self["abort_latency"]
+
+        start = monotonic()
+        polls = 0
+        last_running = start
+        next_poll = start + min(max(exptime / 2., poll_min), poll_max)
+
+        while True:
             # [ABORT POINT]
-            if self.abort.isSet():
-                # self.abortExposure()
-                client.executeCommand(TerminateAcquisition(),noAck=True)
-                while True:
+            now = monotonic()
+            while now < next_poll:
+                if self.abort.wait(min(next_poll - now, abort_latency)) or self.abort.isSet():
+                    self._terminateAcquisition(client)
+                    return CameraStatus.ABORTED
+                now = monotonic()
+
+            status = client.executeCommand(InquireAcquisitionStatus())
+            polls += 1
+            now = monotonic()
+
+            if status.exp_done_percent >= 100:
+                break
 
-                    ret = select.select([client.sk], [], [])
+            last_running = now
+            done = status.exp_done_percent
+            remaining = min(max(exptime - (now - start), exptime * (99 - done) / 100.),
+                            exptime * (101 - done) / 100.)
+            next_poll = now + min(max(remaining / 2., poll_min), poll_max)
 
-                    if not ret[0]:
-                        break
+        # The exposure ended between the last poll that saw it running (or its
+        # nominal end, if later) and this one.
+        end_latency = max(0., now - max(last_running, start + exptime))
+        self._pollCounts.add(polls)
+        self._endLatency.add(end_latency)
+        self.log.debug('Exposure end detected after %i polls, %.3f s late' % (polls, end_latency))
 
-                    if ret[0][0] == client.sk:
+        return CameraStatus.OK
 
-                        header = Packet()
-                        header_data = client.recv(len(header))
-                        header.fromStruct(header_data)
+    def getPollStats(self):
+        """
+        Return rolling statistics (count, p50, p95, max and last) of the
+        number of progress polls per exposure and of the latency, in
+        seconds, with which the end of each exposure was detected.
+        """
+        return {'polls': self._pollCounts.summary(),
+                'end_latency': self._endLatency.summary()}
 
-                        if header.id == 131:  # incoming data pkt
-                            data = cmd.result()  # data structure as defined in data.py
-                            data.fromStruct(
-                                header_data + client.recv(header.length - len(header)))
-                            #data.fromStruct (header_data + self.recv (header.length))
-                            # logging.debug(data)
-                            self.log.debug("data type is {}".format(data.data_type))
-                            break
+    def _exposeBurstFrame(self, imageRequest, burst, timing):
+        """
+        Begin the next frame of a burst. The camera is already acquiring it,
+        so nothing is sent to it.
+        """
+        burst['next'] += 1
+        # The camera starts the next exposure as soon as the previous frame is read out.
+        self.__lastFrameStart = burst['last_data']
+        self.__lastFrameStartTime = burst['last_data_time']
+        self.lastFrameTemp = self._telemetryValue("CCD Temp.", self.__lastFrameStartTime, -999.)
+        self.exposeBegin(imageRequest)
+        timing.lap('setup')
+        return self._endExposure(imageRequest, CameraStatus.OK)
 
-                status = CameraStatus.ABORTED
-                break
+    def _waitAcquireData(self, client, timeout=None, frame=1):
+        """
+        Wait for the data packet the camera sends once a frame is read out.
 
-        return self._endExposure(imageRequest, status)
+        :param timeout: seconds to wait, None waits until the acquisition
+                        deadline.
+        :param frame: frame of the acquisition to wait for, starting at 1.
+        :return: True if the packet arrived, False on timeout.
+        """
+        acquisition = self._acquisition
+        if acquisition is None:
+            return True
+
+        if not acquisition.wait_results(frame, timeout):
+            return False
+
+        self.log.debug("data type is {}".format(acquisition.results[frame - 1].data_type))
+        return True
+
+    def _terminateAcquisition(self, client):
+        client.executeCommand(TerminateAcquisition(), noAck=True)
+
+        # The camera answers with a last data packet for the acquisition.
+        acquisition, self._acquisition = self._acquisition, None
+        if acquisition is not None:
+            try:
+                acquisition.wait_results(len(acquisition.results) + 1, self["command_timeout"])
+            finally:
+                client.discard(acquisition)
+        burst, self._burst = self._burst, None
+        if burst is not None:
+            self._burstEnded(burst['request'], aborted=True)
+
+    def _burstEnded(self, imageRequest, aborted=False):
+        """
+        Called once the data packet of the last frame of a burst arrived, or
+        the burst was terminated. The camera stopped exposing. Frames of a
+        burst go through _endExposure as they begin, not as they end.
+        """
+        pass
+
+    def _setCameraSetting(self, name, value, command):
+        """
+        Send a setting command to the camera, unless the camera already has
+        ``value`` for setting ``name``.
+
+        A shadow copy of the settings is kept for that. It is dropped on
+        reconnection and on any error, so the next exposure sends everything
+        again.
+        """
+        with self._settingsLock:
+            if name in self._cameraSettings and self._cameraSettings[name] == value:
+                self._settingsSkipped += 1
+                return False
+            # Forget it while the command is in flight, in case it fails.
+            self._cameraSettings.pop(name, None)
+
+        start = monotonic()
+        try:
+            self.getClient().executeCommand(command)
+        except:
+            self._invalidateSettings()
+            raise
+
+        with self._settingsLock:
+            self._cameraSettings[name] = value
+            self._settingsSent += 1
+            self._settingsTime += monotonic() - start
+        return True
+
+    def _invalidateSettings(self):
+        with self._settingsLock:
+            self._cameraSettings.clear()
+
+    def getSettingsStats(self):
+        """
+        Return how many setting commands were sent to the camera and how many
+        were skipped because the camera already had that value, with the
+        mean round-trip of the ones sent and the time saved by the skipped
+        ones (estimated from that mean), in seconds.
+        """
+        with self._settingsLock:
+            mean = self._settingsTime / self._settingsSent if self._settingsSent else 0.
+            return {'sent': self._settingsSent,
+                    'skipped': self._settingsSkipped,
+                    'mean_roundtrip': mean,
+                    'saved': mean * self._settingsSkipped}
 
     def _endExposure(self, request, status):
         self.exposeComplete(request, status)
@@ -690,7 +976,10 @@ class SIBase(CameraBase):
 
         status = CameraStatus.OK
         client = self.getClient()
+        timing = self._frameTiming or self._timer.frame()
         if self.abort.isSet():
+            if self._burst is not None:
+                self._terminateAcquisition(client)
             self.readoutComplete(None, CameraStatus.ABORTED)
             self._cleanQueueLock.release()
             return None
@@ -707,205 +996,359 @@ class SIBase(CameraBase):
         #         break
 
         # Get orphan packet from Acquire command issue in _expose
-        cmd = Acquire()
-
-        while True:
-
-            ret = select.select([client.sk], [], [])
-
-            if not ret[0]:
-                break
+        burst = self._burst
+        try:
+            if burst is None:
+                self._waitAcquireData(client)
+            else:
+                # Each frame of a burst sends its own data packet. Keep an eye on
+                # abort requests while waiting for it.
+                while not self._waitAcquireData(client, timeout=self["abort_latency"], frame=burst['next']):
+                    if self.abort.isSet():
+                        self._terminateAcquisition(client)
+                        self.readoutComplete(None, CameraStatus.ABORTED)
+                        self._cleanQueueLock.release()
+                        return None
+        except:
+            if self._burst is not None:
+                self._burst = None
+                self._burstEnded(imageRequest, aborted=True)
+            self._cleanQueueLock.release()
+            raise
 
-            if ret[0][0] == client.sk:
+        if burst is not None:
+            burst['last_data'] = dt.datetime.utcnow()
+            burst['last_data_time'] = time.time()
+            imageRequest.headers = [card for card in imageRequest.headers
+                                    if not card[0].startswith('HIERARCH T80S DET BURST')]
+            imageRequest.headers += [('HIERARCH T80S DET BURST FRAME', burst['next'], 'Frame number within the burst'),
+                                     ('HIERARCH T80S DET BURST NFRAMES', burst['frames'], 'Frames in the burst')]
+            if burst['next'] >= burst['frames']:
+                self._burst = None
+                self._burstEnded(imageRequest)
 
-                header = Packet()
-                header_data = client.recv(len(header))
-                header.fromStruct(header_data)
+        timing.lap('wait_data')
 
-                if header.id == 131:  # incoming data pkt
-                    data = cmd.result()  # data structure as defined in data.py
-                    data.fromStruct(
-                        header_data + client.recv(header.length - len(header)))
-                    #data.fromStruct (header_data + self.recv (header.length))
-                    # logging.debug(data)
-                    self.log.debug("data type is {}".format(data.data_type))
-                    break
+        imageRequest.headers = [card for card in imageRequest.headers
+                                if card[0] not in self._telemetryCardNames]
+        imageRequest.headers += self._telemetryCards(float(imageRequest["exptime"]))
 
         (mode, binning, top, left, width, height) = self._getReadoutModeInfo(imageRequest["binning"], imageRequest["window"])
 
        # LAST ABORT POINT
         if self.abort.isSet():
+            if self._burst is not None:
+                self._terminateAcquisition(client)
             self.readoutComplete(None, CameraStatus.ABORTED)
             self._cleanQueueLock.release()
             return None
 
         if not self["localhost"]:
             self.log.debug('Remote mode')
+            raw = self["raw_frames"]
 
-            serial_length, parallel_length, img_buffer = client.executeCommand(RetrieveImage(0))
+            try:
+                frame = self._framePool.acquire(width, height, timeout=self["frame_pool_timeout"])
+            except:
+                self._cleanQueueLock.release()
+                raise
 
-            pix = N.array(img_buffer, dtype=N.uint16)
+            try:
+                try:
+                    serial_length, parallel_length = client.retrieve_image(RetrieveImage(0), frame)
+                finally:
+                    self._cleanQueueLock.release()
 
-            if len(pix) != width * height:
-                self._cleanQueueLock.release()
-                raise SIException("Wrong image size. Expected %i x %i (%i), got %i" % (width,
-                                                                                     height,
-                                                                                     width *
-                                                                                     height,
-                                                                                     len(pix)))
+                timing.lap('retrieve')
 
-            pix = pix.reshape(width, height)
-            pix.byteswap(True)
+                if serial_length * parallel_length != width * height:
+                    raise SIException("Wrong image size. Expected %i x %i (%i), got %i" % (width,
+                                                                                         height,
+                                                                                         width *
+                                                                                         height,
+                                                                                         serial_length *
+                                                                                         parallel_length))
 
-            header = client.executeCommand(GetImageHeader(1))
+                pix = frame.reshape(parallel_length, serial_length)
 
-            headers = self._processHeader(header)
+                header = client.executeCommand(GetImageHeader(1))
 
-            headers["frame_start_time"] = self.__lastFrameStart
-            # headers["frame_temperature"] = self.getTemperature()
-            # headers["binning_factor"] = self._binning_factors[binning]
+                headers = self._processHeader(header)
 
-            proxy = self._saveImage(imageRequest, pix, headers)
+                headers["frame_start_time"] = self.__lastFrameStart
+                headers["frame_temperature"] = self.lastFrameTemp
+                # headers["binning_factor"] = self._binning_factors[binning]
+
+                if raw:
+                    # Finished like a localhost frame, see _storeFrame.
+                    src = self._spoolPixels(pix, headers)
+                else:
+                    if self["timing_headers"]:
+                        imageRequest.headers = [card for card in imageRequest.headers
+                                                if not card[0].startswith('HIERARCH T80S DET TIME')]
+                        imageRequest.headers += timing.cards()
+
+                    proxy = self._saveImage(imageRequest, pix, headers)
+                timing.lap('save')
+            finally:
+                self._framePool.release(frame)
+
+            if raw:
+                proxy = self._storeFrame(imageRequest, src, timing)
 
         else:
-            self.log.debug('Local mode. Saving file to %s' % (os.path.join(self["local_path"], self["local_filename"])))
+            self.log.debug('Local mode. Spooling file to %s' % self._getSpoolDir())
             # Save the image to the local disk and read them instead. Should be much faster.
-            # Todo: Get rid of "local_path" and "local_filename" and use temporary files
+            try:
+                src = self._spoolFrame()
+            finally:
+                # The spooled file is ours, the camera may save the next frame
+                # while this one is finished.
+                self._cleanQueueLock.release()
+            timing.lap('retrieve')
+
+            proxy = self._storeFrame(imageRequest, src, timing)
+
+        self.readoutComplete(proxy, CameraStatus.OK)
+        return proxy
+
+        # return
+
+    def _storeFrame(self, imageRequest, src, timing):
+        """
+        Finish the header of a spooled frame, move it to its final place
+        and register it on the image server. Compressed frames are written
+        afterwards, on the background on fast mode.
+
+        :return: the image proxy.
+        """
+        try:
             filename = ''
 
             if imageRequest:
                 if not "filename" in imageRequest.keys():
-                    self._cleanQueueLock.release()
                     raise TypeError("Invalid filename, you must pass filename=something or a valid ImageRequest object")
                 else:
                     filename = imageRequest["filename"]
 
             path, filename = os.path.split(ImageUtil.makeFilename(filename))
+            name = os.path.splitext(filename)[0]
 
-            self.client.executeCommand(SetSaveToFolderPath(self['local_path']))
-            self.client.executeCommand(SaveImage(self['local_filename'], 'I16'))
-            # self.releaseExposure()
-            # self.unlockExposure()
-
-            def cleanHeader(scale_back):
-                hdu = pyfits.open(os.path.join(self['local_path'], self['local_filename']),
-                                  ignore_missing_end = True) #,
-                                  # scale_back=scale_back)
-
-                extraHeaders = {'ccdtemp': hdu[0].header[self["ccdtemp"]],
-                           'itemp': hdu[0].header[self["instrumentTemperature"]],
-                           'exptime': float(hdu[0].header[self['exptime']]),
-                           }
-                self.log.debug('Excluding bad cards...')
-                badcards = self["bad_cards"].split(',')
-
-                for card in badcards:
-                    self.log.debug('Removing card "%s" from header' % card)
-                    hdu[0].header.remove(card)
-
-                chimeraCards = [('DATE-OBS', ImageUtil.formatDate(self.__lastFrameStart), 'Date exposure started'),
-
-                                ('CCD-TEMP', extraHeaders["ccdtemp"], 'CCD Temperature at Exposure Start [deg. C]'),
-                                ("EXPTIME", float(imageRequest['exptime']) or 0., "exposure time in seconds"),
-                                ('IMAGETYP', imageRequest['type'].strip(), 'Image type'),
-                                ('SHUTTER', str(imageRequest['shutter']), 'Requested shutter state'),
-                                ('INSTRUME', str(self['camera_model']), 'Name of instrument'),
-                                ('CCD', str(self['ccd_model']), 'CCD Model'),
-                                ('CCD_DIMX', self.getPhysicalSize()[0], 'CCD X Dimension Size'),
-                                ('CCD_DIMY', self.getPhysicalSize()[1], 'CCD Y Dimension Size'),
-                                ('CCDPXSZX', self.getPixelSize()[0], 'CCD X Pixel Size [micrometer]'),
-                                ('CCDPXSZY', self.getPixelSize()[1], 'CCD Y Pixel Size [micrometer]')]
-
-                for card in chimeraCards:
-                    hdu[0].header.set(*card)
-
-                if imageRequest:
-                    for header in imageRequest.headers:
-                        try:
-                            hdu[0].header.set(*header)
-                        except Exception, e:
-                            log.warning("Couldn't add %s: %s" % (str(header), str(e)))
-
-                # Save temporary image to local_path/night
-                # Create dir if necessary
-                # tmpdir = os.path.join(self['local_path'], os.path.split(path)[-1])
-                # if not os.path.exists(tmpdir):
-                #     os.mkdir(tmpdir)
-                #
-                # # Save temporary image
-                # hdu.writeto(os.path.join(tmpdir, filename))
-                self.log.debug('Writting file to local disk: %s' % filename)
-                hdu.writeto(os.path.join(self['local_path'], filename))
-                hdu.close()
-                del hdu
-                gc.collect()
-                return extraHeaders
+            codec = self._getCodec(imageRequest)
+            compress = codec.compressed
+            if compress:
+                # Uncompressed frame is kept as a temporary file until the compressed one is written.
+                dest = os.path.join(self['local_path'], filename)
+            else:
+                dest = os.path.join(path, name + '.fits')
 
-            try:
-                extraHeaders = cleanHeader(True)
-            except MemoryError, e:
-                self.log.exception(e)
-                raise
-            finally:
-                self._cleanQueueLock.release()
+            self._cleanHeader(imageRequest, src, dest, filename, timing)
+        except:
+            if os.path.exists(src):
+                self.log.error('Could not finish frame, left at %s' % src)
+            raise
+        timing.lap('clean_header')
 
-            # From now on camera is ready to take new exposures, will return and finish header on a different thread
-            self.log.debug('Registering image and creating proxy. PP')
-            # register image on ImageServer
-            server = getImageServer(self.getManager())
-            # img = Image.fromFile(os.path.join(self['local_path'], filename))
-            img = Image.fromFile(os.path.join(self['local_path'], filename))
+        # From now on camera is ready to take new exposures.
+        self.log.debug('Registering image and creating proxy. PP')
+        # register image on ImageServer
+        server = getImageServer(self.getManager())
+        img = Image.fromFile(dest)
+        proxy = server.register(img)
+        timing.lap('register')
 
-            proxy = server.register(img)
-            self._tmpFilesProxyQueue.put(proxy.filename())
-            # proxy = self._finishHeader(imageRequest,self.__lastFrameStart,filename,path,extraHeaders)
+        if compress:
+            # Compression is done on a different thread on fast mode.
+            args = (proxy.filename(), imageRequest, dest, path, name, codec, timing)
             if self["fast_mode"]:
-                p = threading.Thread(target=self._finishHeader, args=(imageRequest, self.__lastFrameStart, filename,
-                                                                      path, extraHeaders))
-                self._threadList.append(p)
-                p.start()
-                # self._tmpFilesProxyQueue.put(proxy)
+                try:
+                    # Blocks while too many frames are pending, so the next exposure waits.
+                    self._getFinishPool().submit(self._finishFrame, *args, timeout=self["finish_timeout"])
+                except WorkerPoolFull, e:
+                    self.log.warning('%s Compressing %s on this thread.' % (e, dest))
+                    self._finishFrame(*args)
             else:
-                proxy = self._finishHeader(imageRequest, self.__lastFrameStart, filename, path, extraHeaders)
+                self._finishFrame(*args)
+        else:
+            self._finalFilesProxyQueue.put([proxy, proxy.filename()])
 
-        self.readoutComplete(proxy, CameraStatus.OK)
         return proxy
 
-        # return
+    def _getSpoolDir(self):
+        """
+        Return the directory frames saved by the camera are handed over to
+        the header pipeline through, creating it if needed.
+        """
+        spool = os.path.join(self['local_path'], self['spool_dir'])
+        if not os.path.isdir(spool):
+            os.makedirs(spool)
+        return spool
 
-    def _finishHeader(self, imageRequest, frameStart, filename, path, extraHeaders):
-
-        # try:
-        #     if self._tmpFilesProxyQueue.qsize() > self["max_files"]:
-        #         for i in range(self["max_files"]):
-        #             proxy = self._tmpFilesProxyQueue.get()
-        #             self.log.debug("[control] Closing temporary file %s ..." % proxy[0].filename())
-        #             # self.log.debug("[control] Closing temporary file %s ..." % proxy[1])
-        #             proxy[0].close()
-        # except:
-        #     self.log.error("Error trying to empty image queue.")
-        #
-        # try:
-        #     if self._finalFilesProxyQueue.qsize() > self["max_files"]:
-        #         for i in range(self["max_files"]):
-        #             proxy = self._finalFilesProxyQueue.get()
-        #             self.log.debug("[control] Closing final file %s ..." % proxy[0].filename())
-        #             # self.log.debug("[control] Closing final file %s ..." % proxy[1])
-        #             proxy[0].close()
-        # except:
-        #     self.log.error("Error trying to empty image queue.")
-
-        hdu = pyfits.open(os.path.join(self['local_path'], filename)) #, scale_back=True)
+    def _spoolName(self):
+        stem, ext = os.path.splitext(self['local_filename'])
+        return '%s-%i-%06i%s' % (stem, os.getpid(), self._spoolSequence.next(), ext or '.fits')
 
-        hdu[0].header.remove('CHM_ID')
-        # self.log.debug('Excluding bad cards...')
-        # badcards = self["bad_cards"].split(',')
-        #
-        # for card in badcards:
-        #     self.log.debug('Removing card "%s" from header' % card)
-        #     hdu[0].header.remove(card)
+    def _spoolFrame(self):
+        """
+        Have the camera server save the last frame under a name of its own,
+        then move it into the spool directory. Once there it belongs to the
+        header pipeline, and the next frame can be saved.
+
+        :return: path of the spooled frame.
+        """
+        filename = self._spoolName()
+
+        self._setCameraSetting('save_path', self['local_path'], SetSaveToFolderPath(self['local_path']))
+        self.getClient().executeCommand(SaveImage(filename, 'I16'))
+
+        spooled = os.path.join(self._getSpoolDir(), filename)
+        os.rename(os.path.join(self['local_path'], filename), spooled)
+        return spooled
+
+    def _spoolPixels(self, pix, cameraHeaders):
+        """
+        Write a frame received from the camera to the spool directory as a
+        16-bit FITS file with BZERO = 32768, holding the cards of the camera
+        header.
+
+        The stored values (pixel - 32768) are the pixels with the sign bit
+        flipped, which is done in place on ``pix``: the frame buffer is
+        written as it is, without any copy. ``pix`` no longer holds the
+        pixels afterwards.
+
+        :return: path of the spooled frame.
+        """
+        height, width = pix.shape
+        header = Header([('SIMPLE', True), ('BITPIX', 16), ('NAXIS', 2),
+                         ('NAXIS1', width), ('NAXIS2', height)])
+        for key, (value, comment) in cameraHeaders.items():
+            if key and key not in header and key != 'END':
+                header.set(key, self._cardValue(value), comment)
+        header['BZERO'] = 32768
+        header['BSCALE'] = 1
+
+        pix ^= 0x8000
+
+        spooled = os.path.join(self._getSpoolDir(), self._spoolName())
+        part = spooled + '.part'
+        with open(part, 'wb') as fp:
+            fp.write(header.tostring())
+            # FRAME_DTYPE is big endian, as FITS.
+            pix.view(N.dtype('>i2')).tofile(fp)
+            fp.write('\0' * (-pix.nbytes % 2880))
+        os.rename(part, spooled)
+        return spooled
+
+    @staticmethod
+    def _cardValue(value):
+        """
+        Return the value of a camera header card, as given by _processHeader,
+        with its FITS type.
+        """
+        if value.startswith("'"):
+            return value.strip("'").rstrip()
+        if value in ('T', 'F'):
+            return value == 'T'
+        return parse_value(value)
+
+    _telemetryCardNames = ('HIERARCH T80S DET TEMP START', 'HIERARCH T80S DET TEMP END',
+                           'HIERARCH T80S DET PRES START', 'HIERARCH T80S DET PRES END')
+
+    def _telemetryCards(self, exptime):
+        """
+        Header cards with the CCD temperature and chamber pressure at the
+        start and end of the last exposure, interpolated from the status
+        samples.
+        """
+        start = self.__lastFrameStartTime
+        end = start + exptime
+        cards = []
+        for key, name, what in (('TEMP', "CCD Temp.", 'CCD temperature'),
+                                ('PRES', "Chamber Pressure", 'Chamber pressure')):
+            entry = self.stats.entry(name)
+            unit = ' (%s)' % entry.unit if entry is not None and entry.unit else ''
+            for when, timestamp in (('START', start), ('END', end)):
+                value = self._telemetryValue(name, timestamp)
+                if value is not None:
+                    cards.append(('HIERARCH T80S DET %s %s' % (key, when), value,
+                                  '%s at exposure %s%s' % (what, when.lower(), unit)))
+        return cards
+
+    def _setupFramePool(self):
+        """
+        Create the frame buffer pool for the current full frame geometry. An
+        existing pool is kept if the geometry did not change.
+        """
+        width, height = self.getPhysicalSize()
+
+        if self._framePool is not None and self._framePool.fits(width, height):
+            return
+
+        self.log.debug('Setting up frame pool with %i slots of %i x %i' % (self["frame_pool_slots"],
+                                                                          width, height))
+        self._framePool = FramePool(self["frame_pool_slots"], width, height)
+
+    def _cleanHeader(self, imageRequest, src, dest, filename, timing=None):
+        """
+        Finalise the header of the frame saved by the SI server in a single
+        pass and move it to ``dest``.
+
+        Only the header blocks are rewritten. The pixel data is left where the
+        SI server wrote it, unless the new header does not fit or ``dest`` is
+        on another file system, in which case it is copied once.
+        """
+        editor = FitsHeaderEditor(src)
+        try:
+            header = editor.header
 
+            extraHeaders = {'ccdtemp': header[self["ccdtemp"]],
+                            'itemp': header[self["instrumentTemperature"]],
+                            'exptime': float(header[self['exptime']]),
+                            }
+            self.log.debug('Excluding bad cards...')
+            badcards = self["bad_cards"].split(',')
 
+            for card in badcards:
+                self.log.debug('Removing card "%s" from header' % card)
+                header.remove(card, ignore_missing=True)
+
+            full_width, full_height = self.getPhysicalSize()
+            pix_w, pix_h = self.getPixelSize()
+            chimeraCards = [('DATE-OBS', ImageUtil.formatDate(self.__lastFrameStart), 'Date exposure started'),
+
+                            ('CCD-TEMP', extraHeaders["ccdtemp"], 'CCD Temperature at Exposure Start [deg. C]'),
+                            ("EXPTIME", float(imageRequest['exptime']) or 0., "exposure time in seconds"),
+                            ('IMAGETYP', imageRequest['type'].strip(), 'Image type'),
+                            ('SHUTTER', str(imageRequest['shutter']), 'Requested shutter state'),
+                            ('INSTRUME', str(self['camera_model']), 'Name of instrument'),
+                            ('CCD', str(self['ccd_model']), 'CCD Model'),
+                            ('CCD_DIMX', full_width, 'CCD X Dimension Size'),
+                            ('CCD_DIMY', full_height, 'CCD Y Dimension Size'),
+                            ('CCDPXSZX', pix_w, 'CCD X Pixel Size [micrometer]'),
+                            ('CCDPXSZY', pix_h, 'CCD Y Pixel Size [micrometer]')]
+
+            for card in chimeraCards:
+                header.set(*card)
+
+            self._finalizeHeader(imageRequest, header, filename, extraHeaders)
+
+            if timing is not None and self["timing_headers"]:
+                # Only the phases up to the SI server saving the frame are known at this point.
+                for card in timing.cards():
+                    header.set(*card)
+
+            self.log.debug('Writting file to local disk: %s' % dest)
+            # Leave room for the cards added when registering the image.
+            editor.save(dest, reserve_cards=self["header_reserve_cards"])
+        finally:
+            editor.close()
+
+        return extraHeaders
+
+    def _finalizeHeader(self, imageRequest, header, filename, extraHeaders):
+        """
+        Add request, Chimera and T80S specific cards to a frame header.
+        """
         self.log.debug('Adding header information')
 
         ccdtemp = extraHeaders["ccdtemp"]
@@ -913,11 +1356,11 @@ class SIBase(CameraBase):
         exptime = extraHeaders['exptime']
 
         if imageRequest:
-            for header in imageRequest.headers:
+            for card in imageRequest.headers:
                 try:
-                    hdu[0].header.set(*header)
+                    header.set(*card)
                 except Exception, e:
-                    log.warning("Couldn't add %s: %s" % (str(header), str(e)))
+                    log.warning("Couldn't add %s: %s" % (str(card), str(e)))
 
         md = [('FILENAME', os.path.basename(filename)),
               ("DATE", ImageUtil.formatDate(dt.datetime.utcnow()), "date of file creation"),
@@ -940,18 +1383,26 @@ class SIBase(CameraBase):
         (mode, binning, top, left,
         width, height) = self._getReadoutModeInfo(imageRequest["binning"],
                                                   imageRequest["window"])
-        binFactor = self._binning_factors[binning]
+        srl_bin, prl_bin = self._parseBinning(binning)
         pix_w, pix_h = self.getPixelSize() # hdu[0].header[self['ccdsize_x']] / hdu[0].header[self['']]
+        full_width, full_height = self.getPhysicalSize()
+
+        md += [('CCDSUM', '%i %i' % (srl_bin, prl_bin), 'On-chip binning (serial parallel)'),
+               ('DETSEC', '[%i:%i,%i:%i]' % (left * srl_bin + 1, (left + width) * srl_bin,
+                                             top * prl_bin + 1, (top + height) * prl_bin),
+                'Detector region read out (unbinned)'),
+               ('HIERARCH T80S DET BINX', srl_bin, 'Binning factor along X'),
+               ('HIERARCH T80S DET BINY', prl_bin, 'Binning factor along Y')]
 
         if self["telescope_focal_length"] is not None:  # If there is no telescope_focal_length defined, don't store WCS
             focal_length = self["telescope_focal_length"]
 
-            scale_x = binFactor * (((180 / N.pi) / focal_length) * (pix_w * 0.001))
-            scale_y = binFactor * (((180 / N.pi) / focal_length) * (pix_h * 0.001))
+            scale_x = srl_bin * (((180 / N.pi) / focal_length) * (pix_w * 0.001))
+            scale_y = prl_bin * (((180 / N.pi) / focal_length) * (pix_h * 0.001))
 
-            full_width, full_height = self.getPhysicalSize()
-            CRPIX1 = ((int(full_width / 2.0)) - left) - 1
-            CRPIX2 = ((int(full_height / 2.0)) - top) - 1
+            # Reference pixel at the centre of the chip, in binned pixels of the window.
+            CRPIX1 = (int(full_width / 2.0 / srl_bin) - left) - 1
+            CRPIX2 = (int(full_height / 2.0 / prl_bin) - top) - 1
             # Todo: Check telescope pier side
             parity_y = self["parity_y"]
             parity_x = self["parity_x"]
@@ -981,8 +1432,8 @@ class SIBase(CameraBase):
                 ('HIERARCH T80S DET NAME', self["detectorname"], 'Name of detector system '),
                 # ('HIERARCH T80S DET CCDS', ' 1 ', ' Number of CCDs in the mosaic'),        #TODO:
                 # ('HIERARCH T80S DET CHIPID', ' 0 ', ' Detector CCD identification'),        #TODO:
-                ('HIERARCH T80S DET NX', hdu[0].header['NAXIS1'], ' Number of pixels along X '),
-                ('HIERARCH T80S DET NY', hdu[0].header['NAXIS2'], ' Number of pixels along Y'),
+                ('HIERARCH T80S DET NX', header['NAXIS1'], ' Number of pixels along X '),
+                ('HIERARCH T80S DET NY', header['NAXIS2'], ' Number of pixels along Y'),
                 ('HIERARCH T80S DET PSZX', pix_w, ' Size of pixel in X (mu) '),
                 ('HIERARCH T80S DET PSZY', pix_h, ' Size of pixel in Y (mu) '),
                 # ('HIERARCH T80S DET EXP TYPE', 'LIGHT', ' Type of exp as known to the CCD SW '),        #TODO:
@@ -1018,7 +1469,7 @@ class SIBase(CameraBase):
             # ]
 
             # for card in wcs:
-            #     hdu[0].header.set(*card)
+            #     header.set(*card)
 
         # chimeraCards = [('DATE-OBS', ImageUtil.formatDate(frameStart), 'Date exposure started'),
         #
@@ -1042,78 +1493,105 @@ class SIBase(CameraBase):
         #         ]
 
         # for card in chimeraCards:
-        #     hdu[0].header.set(*card)
+        #     header.set(*card)
 
         for card in md:
-            hdu[0].header.set(*card)
-
-        self.log.debug('Writting new fits to disk')
-        # hdu.writeto(os.path.join(path,
-        #                          filename.replace('.FIT','.fits')),
-        #             output_verify='silentfix+warn',
-        #             checksum=True)
-        # fname = None
-        # if self["fast_mode"]:
-        #     try:
-        #         primhdu = pyfits.PrimaryHDU()
-        #         compHDU = pyfits.CompImageHDU(data=hdu[0].data,
-        #                                       header=hdu[0].header)
-        #         hdulist = pyfits.HDUList([primhdu,
-        #                                   compHDU])
-        #         fname = os.path.join(path,
-        #                                  filename).rsplit('.')[0]
-        #         fname += '.fits.fz'
-        #         self.log.debug('Writing %s ...' % fname)
-        #         hdulist.writeto(fname)
-        #     except Exception, e:
-        #         self.log.exception(e)
-        #         fname = os.path.join(path,
-        #                                  filename.replace('.FIT','.fits'))
-        #         self.log.debug('Writing %s ...' % fname)
-        #         hdu.writeto(fname)
-        #     hdu.close()
-        #     return None
-        # else:
-        filename, ext = os.path.splitext(filename)
+            header.set(*card)
+
+    def _finishFrame(self, tmpfile, imageRequest, src, path, name, codec, timing=None):
+        """
+        Write the compressed version of a frame and only then hand the
+        uncompressed one over to control() for deletion. If compression
+        fails the uncompressed frame is kept.
+        """
+        try:
+            self._finishHeader(imageRequest, src, path, name, codec, timing)
+        except:
+            self.log.error('Could not compress frame, uncompressed one kept at %s' % src)
+            raise
+        self._tmpFilesProxyQueue.put(tmpfile)
+
+    def _finishHeader(self, imageRequest, src, path, name, codec, timing=None):
+        """
+        Write the compressed version of a frame whose header was already
+        finalised by _cleanHeader.
+        """
+        timing = timing or self._timer.frame()
+        start = monotonic()
+
+        # Pixels are kept as stored, 16-bit integers to be offset by BZERO,
+        # instead of being scaled to a wider type and back.
+        hdu = pyfits.open(src, memmap=True, do_not_scale_image_data=True)
+
+        hdu[0].header.remove('CHM_ID')
+
+        self.log.debug('%s compression requested...' % codec.compression_type)
+        filename = name + codec.extension
         fname = os.path.join(path,
-                             filename+'.fits')
-
-        if imageRequest['compress_format'] == 'fits_rice':
-            self.log.debug('FITS_RICE compression requested...')
-            filename += '.fits.fz'
-            fname = os.path.join(path,
-                                 filename)
-
-            # fname = fname + ".fz"
-            phdu = pyfits.PrimaryHDU(data=hdu[0].data)
-            dhdu = pyfits.CompImageHDU(data=hdu[0].data, header=hdu[0].header, compression_type='RICE_1')
-            dhdu.header['FILENAME'] = filename
-            dhdu.header['SIBASEV'] = __sibase_version__
-            phdu.data = []
-            phdu.header['NAXIS'] = 0
-            hdulist = pyfits.HDUList([phdu, dhdu])
-            self.log.debug('Writing %s ...' % fname)
-            self._WriteCompressedFile.acquire()
-            hdulist.writeto(fname, checksum=True)
-            self._WriteCompressedFile.release()
-            # del hdu
-            gc.collect()
-            return None
-        else:
-            self.log.debug('Writing %s ...' % fname)
-            hdu.writeto(fname)
+                             filename)
+
+        header = hdu[0].header
+        header['FILENAME'] = filename
+        header['SIBASEV'] = __sibase_version__
+        self.log.debug('Writing %s ...' % fname)
+        with timing.phase('compress'):
+            codec.writeto(self._getCompressor(), fname, hdu[0].data, header, raw=True)
         hdu.close()
 
-        # self.log.debug('Header complete')
-        #
-        # self.log.debug('Registering image and creating proxy')
-        # register image on ImageServer
-        server = getImageServer(self.getManager())
-        img = Image.fromFile(fname)
-        # server.register(img)
-        proxy = server.register(img)
-        self._finalFilesProxyQueue.put([proxy,proxy.filename()])
-        return proxy
+        timing.add('finish_header', monotonic() - start)
+        return None
+
+    def _getCodec(self, imageRequest):
+        """
+        Return the codec for the requested compress_format. Unknown formats
+        are written uncompressed.
+        """
+        codec = get_codec(imageRequest['compress_format'])
+        if codec is None:
+            if imageRequest['compress_format']:
+                self.log.warning('Unknown compression format %s. Writing uncompressed file.' %
+                                 imageRequest['compress_format'])
+            codec = get_codec('none')
+
+        return codec.with_options(**parse_options(self["compress_options"]))
+
+    def _getFinishPool(self):
+        if self._finishPool is None:
+            self._finishPool = WorkerPool(workers=self["finish_workers"],
+                                          max_pending=self["finish_max_pending"],
+                                          name='finish')
+        return self._finishPool
+
+    def getTimingStats(self):
+        """
+        Return rolling statistics (count, p50, p95, max and last, in
+        seconds) for each exposure phase: setup, acquire_ack, exposing,
+        wait_data, retrieve, save/clean_header, register, compress and
+        finish_header.
+        """
+        return self._timer.summary()
+
+    def getLockStats(self):
+        """
+        Return, for each lock (channel, parameters and pipeline), how many
+        times it was taken, how many of them had to wait, and rolling
+        statistics of wait and hold times, in seconds.
+        """
+        return dict((lck.name, lck.summary())
+                    for lck in (self._channelLock, self._paramsLock, self._cleanQueueLock))
+
+    def getFinishStats(self):
+        """
+        Return queue depth, job latency and failure counts of the
+        background frame finishing pool.
+        """
+        return self._getFinishPool().getStats()
+
+    def _getCompressor(self):
+        if self._compressor is None:
+            self._compressor = TileCompressor(processes=self["compress_processes"],
+                                              rows_per_job=self["compress_rows_per_job"])
+        return self._compressor
 
     def _processHeader(self, header):
 
@@ -1142,75 +1620,19 @@ class SIBase(CameraBase):
 
         return headers
 
-    # def _getReadoutModeInfo(self, binning, window):
-    #     """
-    #     Check if the given binning and window could be used on the given CCD.
-    #     Returns a tuple (modeId, binning, top, left, width, height)
-    #     """
-    #     # We need to override this method in order to handle the unrestricted
-    #     # binnings of this camera.
-    #     mode = None
-    #
-    #     if binning not in self._binnings:
-    #         self._binnings.setdefault(binning,
-    #                                   max(self._binnings.values()) + 1)
-    #         self._binning_factors.setdefault(binning, max(
-    #             self._binning_factors.values()) + 1)
-    #
-    #     mode = self.getReadoutModes()[self.getCurrentCCD()][binId]
-    #
-    #     left = 0
-    #     top = 0
-    #     width, height = mode.getSize()
-    #
-    #     if window is not None:
-    #         try:
-    #             xx, yy = window.split(",")
-    #             xx = xx.strip()
-    #             yy = yy.strip()
-    #             x1, x2 = xx.split(":")
-    #             y1, y2 = yy.split(":")
-    #
-    #             x1 = int(x1)
-    #             x2 = int(x2)
-    #             y1 = int(y1)
-    #             y2 = int(y2)
-    #
-    #             left = min(x1, x2) - 1
-    #             top = min(y1, y2) - 1
-    #             width = (max(x1, x2) - min(x1, x2)) + 1
-    #             height = (max(y1, y2) - min(y1, y2)) + 1
-    #
-    #             if left < 0 or left >= mode.width:
-    #                 raise InvalidReadoutMode(
-    #                     "Invalid subframe: left=%d, ccd width (in this "
-    #                     "binning)=%d" % (left, mode.width))
-    #
-    #             if top < 0 or top >= mode.height:
-    #                 raise InvalidReadoutMode(
-    #                     "Invalid subframe: top=%d, ccd height (in this "
-    #                     "binning)=%d" % (top, mode.height))
-    #
-    #             if width > mode.width:
-    #                 raise InvalidReadoutMode(
-    #                     "Invalid subframe: width=%d, ccd width (int this "
-    #                     "binning)=%d" % (width, mode.width))
-    #
-    #             if height > mode.height:
-    #                 raise InvalidReadoutMode(
-    #                     "Invalid subframe: height=%d, ccd height (int this "
-    #                     "binning)=%d" % (height, mode.height))
-    #
-    #         except ValueError:
-    #             left = 0
-    #             top = 0
-    #             width, height = mode.getSize()
-    #
-    #     if not binning:
-    #         binning = self.getBinnings().keys().pop(
-    #             self.getBinnings().keys().index("1x1"))
-    #
-    #     return (mode, binning, top, left, width, height)
+    def _getReadoutModeInfo(self, binning, window):
+        """
+        Check if the given binning and window could be used on the given CCD.
+        Returns a tuple (modeId, binning, top, left, width, height)
+
+        Binnings are not restricted to the ones advertised on get_config, any
+        SERIALxPARALLEL binning gets its readout mode when first requested.
+        The window is given in binned pixels.
+        """
+        if binning and binning not in self._binnings:
+            self._addBinning(binning)
+
+        return CameraBase._getReadoutModeInfo(self, binning, window)
 
 
 def getMetadata(self, request):
@@ -0,0 +1,374 @@
+import select
+import logging
+import threading
+
+from collections import defaultdict
+
+from si.packets.ack import Ack
+from si.client import AckException
+
+from chimera_t80cam.instruments import siprotocol
+from chimera_t80cam.instruments.siprotocol import SIProtocolException
+from chimera_t80cam.instruments.timing import monotonic
+
+log = logging.getLogger(__name__)
+
+
+class SICommandFuture(object):
+    """
+    Outcome of a command sent through a :class:`SIChannel`.
+
+    Acknowledge and data packets are filled in by the channel reader thread
+    as they arrive. Most commands get an acknowledge and one data packet,
+    an acquisition gets one data packet per frame.
+    """
+
+    def __init__(self, cmd, noAck=False, deferred=False, consumer=None, packets=1, deadline=None):
+        self.cmd = cmd
+        self.name = cmd.__class__.__name__
+        self.noAck = noAck
+        self.deferred = deferred
+        self.consumer = consumer
+        self.packets = packets
+        self.deadline = deadline
+
+        self.expects_data = not noAck and (consumer is not None or cmd.result() is not None)
+        self.data_type = siprotocol.answer_data_type(cmd) if consumer is None else None
+
+        self.ack = None
+        self.results = []
+        self.error = None
+        self._cond = threading.Condition()
+
+    @property
+    def acked(self):
+        return self.noAck or self.ack is not None
+
+    @property
+    def done(self):
+        if self.error is not None:
+            return True
+        if not self.acked:
+            return False
+        return not self.expects_data or len(self.results) >= self.packets
+
+    def _set_ack(self, ack):
+        with self._cond:
+            self.ack = ack
+            if not ack.accept:
+                self.error = AckException("Camera did not accepted %s..." % self.name)
+            self._cond.notifyAll()
+
+    def _add_result(self, result):
+        with self._cond:
+            self.results.append(result)
+            self._cond.notifyAll()
+
+    def _fail(self, error):
+        with self._cond:
+            if not self.done:
+                self.error = error
+            self._cond.notifyAll()
+
+    def _wait(self, predicate, timeout):
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while not predicate() and self.error is None:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            if self.error is not None and not predicate():
+                raise self.error
+        return True
+
+    def wait_ack(self, timeout=None):
+        """
+        Wait for the camera to acknowledge the command.
+
+        :return: False on timeout.
+        """
+        if not self._wait(lambda: self.acked, timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def wait_results(self, count, timeout=None):
+        """
+        Wait until ``count`` data packets arrived.
+
+        :return: False on timeout.
+        """
+        return self._wait(lambda: len(self.results) >= count, timeout)
+
+    def result(self, timeout=None):
+        """
+        Wait for the command to complete and return its last data packet (or
+        its acknowledge, for commands without data).
+        """
+        if not self._wait(lambda: self.done, timeout):
+            raise SIProtocolException('Timed out waiting for %s.' % self.name)
+        if self.results:
+            return self.results[-1]
+        return self.ack
+
+
+class SIChannel(object):
+    """
+    Framed, multiplexed access to an SI camera server connection.
+
+    A reader thread owns the socket's receive side and dispatches every
+    packet to the command waiting for it: acknowledges go to the oldest
+    unacknowledged command, image packets to the pending image retrieval,
+    other data packets to the oldest acknowledged command waiting for data
+    of that type, as given by the result class of each command. Deferred
+    commands (an acquisition, whose data packets only arrive once frames are
+    read out) give way to regular ones. So status polls, aborts and
+    retrievals run on the same connection while an acquisition is in
+    progress, and no thread has to sit on the socket.
+
+    Every command has a deadline. A regular command not answered in time
+    means the stream can no longer be trusted: all pending commands fail
+    and the channel has to be reopened.
+    """
+
+    def __init__(self, client, timeout=30., poll_interval=0.5):
+        self.client = client
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+        self._sock = client.sk
+        self._lock = threading.Lock()
+        self._sendLock = threading.Lock()
+        self._pending = []
+        self._error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._sent = defaultdict(int)
+        self._unexpected = 0
+        self._timeouts = 0
+
+    @property
+    def sk(self):
+        return self._sock
+
+    @property
+    def broken(self):
+        return self._error is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='si-channel')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.currentThread():
+            self._thread.join()
+        self._thread = None
+        self._fail_all(SIProtocolException('Channel closed.'))
+
+    def submit(self, cmd, noAck=False, timeout=None, deferred=False, consumer=None, packets=1):
+        """
+        Send a command and return its future without waiting for the answer.
+
+        :param noAck: the camera does not answer this command at all.
+        :param timeout: seconds for the command to complete, defaults to the
+                        channel timeout.
+        :param deferred: the data packets arrive later, out of order with
+                         other commands (acquisitions).
+        :param consumer: object whose ``feed(sock, prefix)`` reads image
+                         packets straight from the socket, see
+                         siprotocol.ImageReceiver.
+        :param packets: number of data packets the command gets.
+        """
+        if self._error is not None:
+            raise SIProtocolException('Camera server channel is closed (%s).' % self._error)
+
+        timeout = self.timeout if timeout is None else timeout
+        future = SICommandFuture(cmd, noAck, deferred, consumer, packets,
+                                 deadline=monotonic() + timeout if timeout else None)
+        data = cmd.command().toStruct()
+
+        with self._sendLock:
+            if not noAck:
+                with self._lock:
+                    self._pending.append(future)
+            try:
+                self._sock.sendall(data)
+            except Exception, e:
+                self._fail_all(e)
+                raise
+
+        with self._lock:
+            self._sent[future.name] += 1
+
+        return future
+
+    def discard(self, future):
+        """
+        Stop waiting for the answers still expected by ``future``, e.g. for
+        the remaining frames of a terminated acquisition.
+        """
+        with self._lock:
+            if future in self._pending:
+                self._pending.remove(future)
+        future._fail(SIProtocolException('%s discarded.' % future.name))
+
+    def executeCommand(self, cmd, noAck=False, timeout=None):
+        """
+        Send a command and wait for its answer, as SIClient.executeCommand.
+        """
+        future = self.submit(cmd, noAck=noAck, timeout=timeout)
+        if noAck:
+            return None
+        return future.result()
+
+    def retrieve_image(self, cmd, frame, timeout=None):
+        """
+        Retrieve an image straight into ``frame``.
+
+        :return: (serial_length, parallel_length) of the received image.
+        """
+        future = self.submit(cmd, timeout=timeout, consumer=siprotocol.ImageReceiver(frame))
+        return future.result()
+
+    def getStats(self):
+        with self._lock:
+            return {'sent': dict(self._sent),
+                    'pending': len(self._pending),
+                    'unexpected_packets': self._unexpected,
+                    'timeouts': self._timeouts,
+                    'broken': self._error is not None}
+
+    # Reader thread
+
+    def _run(self):
+        try:
+            while not self._stop.isSet():
+                ready = select.select([self._sock], [], [], self.poll_interval)[0]
+                if ready:
+                    self._read_packet()
+                self._check_deadlines()
+        except Exception, e:
+            if not self._stop.isSet():
+                log.exception(e)
+                self._fail_all(e)
+
+    def _recv(self, size):
+        data = ''
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise SIProtocolException('Connection closed by camera server.')
+            data += chunk
+        return data
+
+    def _read_packet(self):
+        header_data = self._recv(siprotocol.PACKET_HEADER.size)
+        length, packet_id, cam_id = siprotocol.PACKET_HEADER.unpack(header_data)
+        remaining = length - len(header_data)
+
+        if packet_id == siprotocol.PACKET_ACK:
+            data = header_data + self._recv(remaining)
+            future = self._find(lambda f: not f.acked)
+            if future is None:
+                return self._unexpected_packet(packet_id)
+            ack = Ack()
+            ack.fromStruct(data)
+            future._set_ack(ack)
+
+        elif packet_id == siprotocol.PACKET_DATA:
+            prefix = self._recv(siprotocol.DATA_PREFIX.size)
+            error, data_type = siprotocol.DATA_PREFIX.unpack(prefix)
+            remaining -= len(prefix)
+
+            if data_type == siprotocol.DATA_TYPE_IMAGE:
+                future = self._find(lambda f: f.acked and f.consumer is not None and not f.done)
+                if future is None:
+                    self._recv(remaining)
+                    return self._unexpected_packet(packet_id)
+                if future.consumer.feed(self._sock, prefix):
+                    future._add_result(future.consumer.size)
+            else:
+                data = header_data + prefix + self._recv(remaining)
+                future = self._route_data(data_type)
+                if future is None:
+                    return self._unexpected_packet(packet_id)
+                result = future.cmd.result()
+                result.fromStruct(data)
+                future._add_result(result)
+
+        else:
+            self._recv(remaining)
+            return self._unexpected_packet(packet_id)
+
+        self._prune()
+
+    def _find(self, predicate):
+        with self._lock:
+            for future in self._pending:
+                if predicate(future):
+                    return future
+        return None
+
+    def _route_data(self, data_type):
+        with self._lock:
+            waiting = [f for f in self._pending
+                       if f.acked and f.expects_data and f.consumer is None and not f.done]
+        regular = [f for f in waiting if not f.deferred]
+        deferred = [f for f in waiting if f.deferred]
+
+        for futures in (regular, deferred):
+            for future in futures:
+                if future.data_type == data_type:
+                    return future
+
+        # Commands whose result class does not tell their data type take
+        # whatever comes, in order.
+        for futures in (regular, deferred):
+            for future in futures:
+                if future.data_type is None:
+                    return future
+        return None
+
+    def _unexpected_packet(self, packet_id):
+        log.warning('Unexpected packet %i from camera server, discarded.' % packet_id)
+        with self._lock:
+            self._unexpected += 1
+
+    def _prune(self):
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done]
+
+    def _check_deadlines(self):
+        now = monotonic()
+        with self._lock:
+            expired = [f for f in self._pending if f.deadline is not None and now > f.deadline]
+        if not expired:
+            return
+
+        with self._lock:
+            self._timeouts += len(expired)
+
+        for future in expired:
+            if not (future.deferred and future.acked):
+                raise SIProtocolException('Camera server did not answer %s in time.' % future.name)
+            # A late acquisition does not put the stream out of step.
+            future._fail(SIProtocolException('%s timed out.' % future.name))
+        self._prune()
+
+    def _fail_all(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future._fail(error)
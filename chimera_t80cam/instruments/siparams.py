@@ -0,0 +1,144 @@
+import re
+
+from collections import namedtuple
+
+# Lines come as "first,middle,last". The middle field may itself contain
+# commas, the outer ones may not.
+_FIELDS = re.compile(',(.+),')
+
+Parameter = namedtuple('Parameter', 'group name value unit text')
+
+
+def parse_value(text):
+    """
+    Return ``text`` as an int or a float if it is a number, or stripped
+    otherwise. The camera may use a comma as decimal separator.
+    """
+    text = text.strip()
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text.replace(',', '.'))
+    except ValueError:
+        return text
+
+
+def _split(line):
+    fields = _FIELDS.split(line.strip(), 1)
+    if len(fields) != 3:
+        return None
+    return [f.strip() for f in fields]
+
+
+class ParameterTable(object):
+    """
+    Camera parameters or status, indexed by (group, name).
+
+    A name may repeat within a group, once per CCD, so each key holds the
+    entries in the order the camera sent them. Lookups by name alone are
+    also indexed, for tables whose group does not matter.
+
+    Names not found as given are looked up as part of a longer name, the
+    first one sent that contains them, e.g. "CCD Temp." finds "CCD Temp. (C)".
+    """
+
+    def __init__(self, entries=()):
+        self._entries = []
+        self._index = {}
+        self._names = {}
+        for entry in entries:
+            self._entries.append(entry)
+            self._index.setdefault((entry.group, entry.name), []).append(entry)
+            self._names.setdefault(entry.name, []).append(entry)
+
+    @classmethod
+    def from_parameters(cls, text):
+        """
+        Table from GetCameraParameters lines, "group,name,value".
+        """
+        entries = []
+        for line in text.splitlines():
+            fields = _split(line)
+            if fields is None:
+                continue
+            group, name, value = fields
+            entries.append(Parameter(group, name, parse_value(value), None, value))
+        return cls(entries)
+
+    @classmethod
+    def from_status(cls, text):
+        """
+        Table from GetStatusFromCamera lines, "name,value,unit". Status
+        entries have no group.
+        """
+        entries = []
+        for line in text.splitlines():
+            fields = _split(line)
+            if fields is None:
+                continue
+            name, value, unit = fields
+            entries.append(Parameter(None, name, parse_value(value), unit, value))
+        return cls(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __contains__(self, key):
+        if isinstance(key, tuple):
+            return self.match(key[1], key[0]) is not None
+        return self.match(key) is not None
+
+    def keys(self):
+        return self._index.keys()
+
+    def match(self, name, group=None):
+        """
+        Return the full name of the entries ``name`` refers to (in
+        ``group``, if given), or None if there are none.
+        """
+        if group is None and name in self._names:
+            return name
+        if group is not None and (group, name) in self._index:
+            return name
+        for entry in self._entries:
+            if name in entry.name and (group is None or entry.group == group):
+                return entry.name
+        return None
+
+    def _lookup(self, name, group):
+        name = self.match(name, group)
+        if name is None:
+            return []
+        if group is None:
+            return self._names[name]
+        return self._index[(group, name)]
+
+    def entry(self, name, group=None, index=0):
+        """
+        Return the ``index``-th entry called ``name`` (in ``group``, if
+        given), or None if there is no such entry.
+        """
+        entries = self._lookup(name, group)
+        if index >= len(entries):
+            return None
+        return entries[index]
+
+    def get(self, name, default=None, group=None, index=0):
+        """
+        Return the value of an entry, see entry().
+        """
+        entry = self.entry(name, group, index)
+        if entry is None:
+            return default
+        return entry.value
+
+    def values(self, name, group=None):
+        """
+        Return the values of every entry called ``name``, e.g. one per CCD.
+        """
+        return [entry.value for entry in self._lookup(name, group)]
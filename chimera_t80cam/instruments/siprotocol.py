@@ -0,0 +1,143 @@
+import struct
+import logging
+
+import numpy as N
+
+from chimera.core.exceptions import ChimeraException
+
+log = logging.getLogger(__name__)
+
+# Packet identifiers on the SI camera server wire protocol
+PACKET_COMMAND = 128
+PACKET_ACK = 129
+PACKET_DATA = 131
+
+# Common packet header (length, id, camera id), as read by si.packet.Packet.
+# Command packets follow it with the function number, acknowledges with the
+# accept flag.
+PACKET_HEADER = struct.Struct('>IBB')
+COMMAND_HEADER = struct.Struct('>IBBH')
+ACK_PACKET = struct.Struct('>IBBH')
+
+# Every data packet starts, after the common header, with an error code and
+# the data type, which tells what the packet answers.
+DATA_PREFIX = struct.Struct('>HH')
+
+# Image data packets carry, after the common data packet header (length, id,
+# camera id, error code, data type), the image description below followed by
+# the pixels themselves as big-endian unsigned shorts.
+DATA_TYPE_IMAGE = 2001
+IMAGE_HEADER = struct.Struct('>HHHHHHHHII')  # error, data type, image id, image type,
+                                             # serial length, parallel length,
+                                             # total packets, packet number,
+                                             # byte offset, bytes in packet
+
+# Pixels as they come from the camera. Byte order is handled by the dtype, so
+# no byteswap pass is needed on little-endian hosts.
+FRAME_DTYPE = N.dtype('>u2')
+
+
+class SIProtocolException(ChimeraException):
+    pass
+
+
+def recv_exactly_into(sock, view):
+    """
+    Fill a writable buffer straight from the socket.
+
+    :param sock: connected socket.
+    :param view: memoryview over the destination bytes.
+    """
+    received = 0
+    size = len(view)
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise SIProtocolException('Connection closed by camera server.')
+        received += n
+    return received
+
+
+# Data type of the packets answering each command class, see answer_data_type.
+_answer_data_types = {}
+
+
+def answer_data_type(cmd):
+    """
+    Return the data type of the packets answering ``cmd``, as set by the
+    result class of the si client for its command class, or None if the
+    command gets no data or its result class does not tell.
+    """
+    cls = cmd.__class__
+    if cls not in _answer_data_types:
+        result = cmd.result()
+        _answer_data_types[cls] = getattr(result, 'data_type', None) or None
+    return _answer_data_types[cls]
+
+
+class ImageReceiver(object):
+    """
+    Receive the pixel stream of an image directly into a frame buffer,
+    without intermediate copies.
+
+    :param frame: flat numpy array with FRAME_DTYPE, large enough to hold
+                  the image.
+    """
+
+    def __init__(self, frame):
+        self._buf = memoryview(frame.view(N.uint8))
+        self._capacity = len(self._buf)
+        self._header = bytearray(IMAGE_HEADER.size)
+        self._header_view = memoryview(self._header)
+
+        self.received = 0
+        self.total_bytes = None
+        self.size = (0, 0)
+
+    @property
+    def done(self):
+        return self.total_bytes is not None and self.received >= self.total_bytes
+
+    def feed(self, sock, prefix=''):
+        """
+        Read the rest of an image data packet whose common header (and
+        ``prefix`` bytes of the image header) were already read.
+
+        :return: True once the whole image was received.
+        """
+        self._header[:len(prefix)] = prefix
+        recv_exactly_into(sock, self._header_view[len(prefix):])
+
+        (error, data_type, image_id, image_type,
+         serial_length, parallel_length,
+         total_packets, packet_number,
+         offset, nbytes) = IMAGE_HEADER.unpack_from(self._header)
+
+        if error != 0:
+            raise SIProtocolException('Camera reported error %i while retrieving image.' % error)
+
+        if data_type != DATA_TYPE_IMAGE:
+            raise SIProtocolException('Unexpected data type %i while retrieving image.' % data_type)
+
+        if self.total_bytes is None:
+            self.size = (serial_length, parallel_length)
+            self.total_bytes = serial_length * parallel_length * FRAME_DTYPE.itemsize
+            if self.total_bytes > self._capacity:
+                raise SIProtocolException("Wrong image size. Frame buffer holds %i bytes, "
+                                          "image is %i x %i (%i bytes)" % (self._capacity,
+                                                                          serial_length,
+                                                                          parallel_length,
+                                                                          self.total_bytes))
+
+        if offset + nbytes > self.total_bytes:
+            raise SIProtocolException('Image packet %i/%i overflows frame (%i+%i > %i).' % (packet_number,
+                                                                                              total_packets,
+                                                                                              offset,
+                                                                                              nbytes,
+                                                                                              self.total_bytes))
+
+        recv_exactly_into(sock, self._buf[offset:offset + nbytes])
+        self.received += nbytes
+
+        return self.done
+
@@ -1,18 +1,51 @@
 
+import threading
+
+from itertools import count
+
 from chimera.core.lock import lock
 
 from chimera_t80cam.instruments.sibase import SIBase
+from chimera_t80cam.instruments.filterplan import MoveTimeMatrix, plan_exposures
+from chimera_t80cam.instruments.timing import monotonic
 from chimera_t80cam.instruments.ebox.fsufilters.fsufilters import FsuFilters
+from chimera_t80cam.instruments.ebox.fsumove import WheelMove
+from chimera_t80cam.instruments.ebox.fsuexceptions import FilterPositionFailure
 
 class T80Cam(SIBase,FsuFilters):
 
-    __config__ = {'device': 'ethernet'}
+    __config__ = {'device': 'ethernet',
+                  'filter_move_overhead': 2., # Time to start and settle a filter move, until measured (s)
+                  'filter_move_per_slot': 1., # Time to turn a wheel by one position, until measured (s)
+                  }
+
+    # Phases of an exposure a filter move overlaps with, see planExposures.
+    _OVERLAPPED_PHASES = ('wait_data', 'retrieve', 'save', 'clean_header', 'register')
 
     def __init__(self):
 
         SIBase.__init__(self)
         FsuFilters.__init__(self)
 
+        # Filter moves run on their own thread, overlapping readout. They
+        # never start while the shutter is open.
+        self._filterCond = threading.Condition()
+        self._shutterOpen = False
+        self._nextFilter = None
+        # Filter requests are numbered, _filterDone is the last one the
+        # move thread went through, see startFilter.
+        self._filterRequests = count(1)
+        self._nextRequest = 0
+        self._filterDone = 0
+        self._filterMove = None
+        self._filterMoveError = None
+        # Filter for the exposure after the current one, see runPlan. The
+        # wheels move once the last frame of the current request ends.
+        self._filterAfter = None
+        # Request being exposed and how many of its frames ended.
+        self._requestFrames = (None, 0)
+        self._moveTimes = None
+
     def __start__(self):
         # super(FsuFilters, self).__start__()
         #super(SIBase, self).__start__()
@@ -24,6 +57,7 @@ class T80Cam(SIBase,FsuFilters):
         self.get_status()
         self.get_config()
         self.get_camera_settings()
+        self.startTelemetry()
 
         # start FSU
         self.connectTWC()
@@ -53,7 +87,238 @@ class T80Cam(SIBase,FsuFilters):
         #     return False
 
 
+    def prepareFilter(self, flt):
+        """
+        Put ``flt`` in place for the next exposure. The wheels start moving
+        right away if the shutter is closed, or as soon as the current
+        exposure ends otherwise, while the CCD is read out. The next
+        exposure only opens the shutter once the move completed.
+
+        :param str flt: Name of the filter to use.
+        :return: number of the request.
+        """
+        self._getFilterPosition(flt)  # reject unknown filters now, not on the move thread
+
+        with self._filterCond:
+            request = self._queueFilter(flt)
+            if not self._shutterOpen:
+                self._startFilterMove()
+        return request
+
+    def _queueFilter(self, flt):
+        # Must be called with _filterCond held.
+        self._nextFilter = flt
+        self._nextRequest = self._filterRequests.next()
+        return self._nextRequest
+
+    @lock
+    def setFilter(self, flt):
+        self.prepareFilter(flt)
+        self._waitFilterMove()
+
+    def startFilter(self, flt):
+        """
+        Non-blocking setFilter. The move waits for the shutter to close,
+        see prepareFilter.
+
+        :return: WheelMove, done once the wheels are in place, or once a
+                 later request replaced this one and was applied.
+                 Cancelling it before the move started withdraws it.
+        """
+        request = self.prepareFilter(flt)
+
+        def run(move):
+            if not move.begin():
+                return
+            with self._filterCond:
+                while self._filterDone < request and not move.cancelling.isSet():
+                    if self._nextFilter is None and self._filterMove is None:
+                        raise FilterPositionFailure('Move to %s was withdrawn.' % flt)
+                    self._filterCond.wait(0.1)
+                if move.cancelling.isSet():
+                    return
+                error, self._filterMoveError = self._filterMoveError, None
+            if error is not None:
+                raise error
+
+        def stop():
+            with self._filterCond:
+                if self._nextRequest == request and self._nextFilter is not None:
+                    # Not picked up by the move thread yet.
+                    self._nextFilter = None
+                    self._filterCond.notifyAll()
+                    return
+            self.stopWheel()
+
+        return WheelMove.start('filter wheel', run, stop)
+
+    def _startFilterMove(self):
+        # Must be called with _filterCond held.
+        if self._nextFilter is None or self._filterMove is not None:
+            return
+        self._filterMove = threading.Thread(target=self._moveFilters, name='filter-move')
+        self._filterMove.setDaemon(True)
+        self._filterMove.start()
+
+    def _moveFilters(self):
+        while True:
+            with self._filterCond:
+                if self._nextFilter is None or self._shutterOpen:
+                    self._filterMove = None
+                    self._filterCond.notifyAll()
+                    return
+                flt, self._nextFilter = self._nextFilter, None
+                request = self._nextRequest
+
+            try:
+                start, start_time = self.fwhl.get_pos(), monotonic()
+                self._setFilter(flt)
+                end = self._getFilterPosition(flt)
+                if start != end:
+                    self._getMoveTimes().record(start, end, monotonic() - start_time)
+            except Exception, e:
+                self.log.exception(e)
+                with self._filterCond:
+                    self._filterMoveError = e
+            with self._filterCond:
+                self._filterDone = request
+                self._filterCond.notifyAll()
+
+    def _waitFilterMove(self, opening=False):
+        """
+        Wait for the filter wheels to be in place, starting the pending move
+        if the shutter is closed. Raises the error of a failed move.
+
+        :param opening: the shutter is about to open, no move may start
+                        until it closes again.
+        """
+        with self._filterCond:
+            if opening:
+                # Nothing exposes now, even if an aborted burst did not say so.
+                self._shutterOpen = False
+            if not self._shutterOpen:
+                self._startFilterMove()
+            while self._filterMove is not None:
+                self._filterCond.wait(0.1)
+            error, self._filterMoveError = self._filterMoveError, None
+            if opening and error is None:
+                self._shutterOpen = True
+
+        if error is not None:
+            raise error
+
+    def _expose(self, imageRequest):
+        burst = self._burst
+        if burst is not None and burst['request'] is imageRequest and burst['next'] < burst['frames']:
+            # Next frame of a running burst, the shutter never closed.
+            return SIBase._expose(self, imageRequest)
+
+        # The wheels have to be in place before the shutter opens.
+        self._waitFilterMove(opening=True)
+        try:
+            return SIBase._expose(self, imageRequest)
+        except:
+            self._shutterClosed()
+            raise
+
+    def _endExposure(self, request, status):
+        # Burst frames end while the next one is already exposing, the
+        # shutter only closes once the whole burst is read, see _burstEnded.
+        if self._burst is None:
+            with self._filterCond:
+                if self._lastFrameEnded(request):
+                    self._handOffFilter()
+            self._shutterClosed()
+        return SIBase._endExposure(self, request, status)
+
+    def _burstEnded(self, imageRequest, aborted=False):
+        if not aborted:
+            with self._filterCond:
+                self._handOffFilter()
+        self._shutterClosed()
+
+    def _handOffFilter(self):
+        # Must be called with _filterCond held.
+        if self._filterAfter is not None:
+            # Moves as soon as the shutter closes.
+            self._queueFilter(self._filterAfter)
+            self._filterAfter = None
+
+    def _lastFrameEnded(self, request):
+        # Must be called with _filterCond held. Without burst mode every
+        # frame of a request is exposed on its own.
+        current, ended = self._requestFrames
+        ended = ended + 1 if current is request else 1
+        self._requestFrames = (request, ended)
+        return ended >= int(request['frames'] or 1)
+
+    def _shutterClosed(self):
+        with self._filterCond:
+            self._shutterOpen = False
+            self._startFilterMove()
+
+    def _getMoveTimes(self):
+        if self._moveTimes is None:
+            self._moveTimes = MoveTimeMatrix(len(self.getFilters()),
+                                             self["filter_move_overhead"],
+                                             self["filter_move_per_slot"])
+        return self._moveTimes
+
+    def getMoveTimes(self):
+        """
+        Return the filter wheel move time matrix, in seconds, rows are the
+        starting positions. Measured moves replace the configured estimate.
+        """
+        return self._getMoveTimes().matrix()
+
+    def planExposures(self, requests):
+        """
+        Order a batch of exposures to minimise the time spent waiting for
+        filter moves, then wheel travel.
+
+        :param requests: list of dicts with the ImageRequest parameters of
+                         each exposure plus its 'filter' and, optionally,
+                         'after', the indices of the requests that have to
+                         run before it.
+        :return: ExposurePlan, to be given to runPlan.
+        """
+        positions = dict((flt, self._getFilterPosition(flt)) for flt in self.getFilters())
+        timing = self._timer.summary()
+        readout = sum(timing[name]['p50'] for name in self._OVERLAPPED_PHASES if name in timing)
+
+        plan = plan_exposures(requests, positions, self._getMoveTimes(),
+                              start=self.fwhl.get_pos(), readout=readout)
+        self.log.debug('Exposure plan: %r' % plan)
+        return plan
+
+    def runPlan(self, plan):
+        """
+        Take the exposures of an ExposurePlan in order. Each filter move
+        starts as soon as the shutter of the exposure before it closes.
+
+        :return: list with the images of each exposure.
+        """
+        steps = list(plan)
+        images = []
+        for n, step in enumerate(steps):
+            self.prepareFilter(step.filter)
+            with self._filterCond:
+                self._filterAfter = steps[n + 1].filter if n + 1 < len(steps) else None
+
+            request = dict((key, value) for key, value in step.request.items()
+                           if key not in ('filter', 'after'))
+            try:
+                images.append(self.expose(**request))
+            finally:
+                with self._filterCond:
+                    self._filterAfter = None
+        return images
+
     def getMetadata(self, request):
+        # Headers are collected as the exposure begins, let the wheels settle
+        # first so FILTER reports where they end up.
+        self._waitFilterMove()
+
         cameraHDR = super(SIBase,self).getMetadata(request)
         filterHDR = super(FsuFilters,self).getMetadata(request)
 
@@ -18,6 +18,8 @@ class T80Pol(SIBase, FsuPolarimeter):
         super(FsuPolarimeter, self).__start__()
         super(SIBase, self).__start__()
         super(SIBase, self).setHz(0.1)
+        # SIBase.__start__, which starts it, is not called here.
+        self.startTelemetry()
 
     @lock
     def open(self):
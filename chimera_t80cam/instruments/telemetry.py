@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+
+import numpy as N
+
+log = logging.getLogger(__name__)
+
+
+class TelemetryBuffer(object):
+    """
+    Last ``size`` samples of a fixed set of fields, with their timestamps.
+
+    Samples go into a preallocated float array, one row per sample, with the
+    time (seconds since the epoch) on the first column. Missing values are
+    stored as NaN.
+
+    There is a single writer, :meth:`add`, and readers take no lock: a
+    sample is counted only once its row is complete, and :meth:`snapshot`
+    drops the rows the writer may have been overwriting while it copied
+    them.
+    """
+
+    def __init__(self, fields, size=4096):
+        self.fields = list(fields)
+        self.size = int(size)
+        self._columns = dict((name, i + 1) for i, name in enumerate(self.fields))
+        self._data = N.empty((self.size, len(self.fields) + 1), dtype=N.float64)
+        self._data.fill(N.nan)
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    def add(self, values, timestamp=None):
+        """
+        Store a sample. ``values`` maps field names to numbers, unknown
+        fields are ignored.
+        """
+        row = self._data[self._count % self.size]
+        row.fill(N.nan)
+        for name, value in values.items():
+            column = self._columns.get(name)
+            if column is not None:
+                row[column] = value
+        row[0] = time.time() if timestamp is None else timestamp
+        self._count += 1
+
+    def snapshot(self):
+        """
+        Return a copy of the samples, oldest first, as an array with the
+        time on column 0 and the fields on the following ones.
+        """
+        before = self._count
+        data = self._data.copy()
+        after = self._count
+
+        # The row after the last sample may be being overwritten.
+        first = max(0, after + 1 - self.size)
+        if first >= before:
+            return data[:0]
+        rows = N.arange(first, before) % self.size
+        return data[rows]
+
+    def latest(self, name, default=None):
+        """
+        Return the last value stored for ``name``.
+        """
+        samples = self.snapshot()
+        if not len(samples):
+            return default
+        value = samples[-1, self._columns[name]]
+        return default if N.isnan(value) else float(value)
+
+    def at(self, name, timestamp, default=None):
+        """
+        Return the value of ``name`` at ``timestamp``, linearly interpolated
+        between the samples around it. Outside of the samples kept the
+        nearest one is used.
+        """
+        samples = self.snapshot()
+        samples = samples[~N.isnan(samples[:, self._columns[name]])]
+        if not len(samples):
+            return default
+        return float(N.interp(timestamp, samples[:, 0], samples[:, self._columns[name]]))
+
+
+class TelemetrySampler(object):
+    """
+    Calls ``sample()`` every ``interval`` seconds on a thread of its own and
+    stores what it returns on a TelemetryBuffer.
+
+    The buffer is created on the first sample, with the fields it returned.
+    """
+
+    def __init__(self, sample, interval=5., size=4096, name='telemetry'):
+        self.sample = sample
+        self.interval = interval
+        self.size = size
+        self.name = name
+        self.buffer = None
+
+        self._stop = threading.Event()
+        self._thread = None
+        # The buffer takes a single writer.
+        self._sampleLock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.isAlive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1.)
+            self._thread = None
+
+    def sampleNow(self):
+        """
+        Take a sample right away, on the calling thread.
+        """
+        with self._sampleLock:
+            timestamp = time.time()
+            values = self.sample()
+            if not values:
+                return
+            if self.buffer is None:
+                self.buffer = TelemetryBuffer(sorted(values.keys()), self.size)
+            self.buffer.add(values, timestamp)
+
+    def _run(self):
+        while not self._stop.isSet():
+            try:
+                self.sampleNow()
+            except Exception, e:
+                log.warning('Could not sample %s: %s' % (self.name, e))
+            self._stop.wait(self.interval)
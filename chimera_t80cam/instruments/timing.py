@@ -0,0 +1,226 @@
+import time
+import ctypes
+import ctypes.util
+import functools
+import threading
+
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+
+def _clock():
+    """
+    Return a monotonic clock function, falling back to time.time if the
+    platform does not provide one.
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    CLOCK_MONOTONIC = 1
+
+    def monotonic():
+        t = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+            return time.time()
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+    return monotonic
+
+monotonic = _clock()
+
+
+class RollingHistogram(object):
+    """
+    Keep the last ``size`` samples of a quantity and summarise them.
+    """
+
+    def __init__(self, size=500):
+        self._samples = deque(maxlen=size)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self._count += 1
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        return self._percentile(samples, p)
+
+    @staticmethod
+    def _percentile(samples, p):
+        if not samples:
+            return 0.
+        k = (len(samples) - 1) * p / 100.
+        lo = int(k)
+        hi = min(lo + 1, len(samples) - 1)
+        return samples[lo] + (samples[hi] - samples[lo]) * (k - lo)
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self._count
+            last = self._samples[-1] if self._samples else 0.
+        return {'count': count,
+                'p50': self._percentile(samples, 50),
+                'p95': self._percentile(samples, 95),
+                'max': samples[-1] if samples else 0.,
+                'last': last}
+
+
+class FrameTiming(object):
+    """
+    Durations of the phases of a single frame, in seconds.
+    """
+
+    def __init__(self, timer):
+        self._timer = timer
+        self.phases = OrderedDict()
+        self._lap = monotonic()
+
+    def lap(self, name):
+        """
+        Record the time since the previous lap (or since the frame started)
+        as phase ``name``.
+        """
+        now = monotonic()
+        self.add(name, now - self._lap)
+        self._lap = now
+
+    @contextmanager
+    def phase(self, name):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, monotonic() - start)
+
+    def add(self, name, elapsed):
+        self.phases[name] = self.phases.get(name, 0.) + elapsed
+        self._timer.add(name, elapsed)
+
+    def cards(self, prefix='HIERARCH T80S DET TIME'):
+        """
+        Header cards with the phases measured so far.
+        """
+        return [('%s %s' % (prefix, name.upper()), round(elapsed, 4), 'Time spent on %s (s)' % name)
+                for name, elapsed in self.phases.items()]
+
+
+class PhaseTimer(object):
+    """
+    Rolling histograms of exposure phase durations.
+    """
+
+    def __init__(self, size=500):
+        self.size = size
+        self._histograms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def frame(self):
+        """
+        Start timing a new frame.
+        """
+        return FrameTiming(self)
+
+    def add(self, name, elapsed):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = RollingHistogram(self.size)
+            histogram = self._histograms[name]
+        histogram.add(elapsed)
+
+    def summary(self):
+        with self._lock:
+            histograms = self._histograms.items()
+        return OrderedDict((name, histogram.summary()) for name, histogram in histograms)
+
+
+class TimedLock(object):
+    """
+    Reentrant lock that keeps rolling histograms of how long it was waited
+    for and held, in seconds. Nested acquisitions by the owner count once.
+    """
+
+    def __init__(self, name, size=500):
+        self.name = name
+        self._lock = threading.RLock()
+        self._owner = None
+        self._depth = 0
+        self._acquiredAt = 0.
+        self._acquired = 0
+        self._contended = 0
+        self._wait = RollingHistogram(size)
+        self._hold = RollingHistogram(size)
+
+    def acquire(self, blocking=True):
+        me = threading.currentThread()
+        if self._owner is me:
+            self._lock.acquire()
+            self._depth += 1
+            return True
+
+        start = monotonic()
+        if not self._lock.acquire(False):
+            if not blocking:
+                return False
+            self._lock.acquire()
+            self._contended += 1
+        now = monotonic()
+
+        self._owner = me
+        self._depth = 1
+        self._acquiredAt = now
+        self._acquired += 1
+        self._wait.add(now - start)
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._hold.add(monotonic() - self._acquiredAt)
+            self._owner = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def summary(self):
+        """
+        Return how many times the lock was taken, how many of them had to
+        wait for it, and wait and hold time statistics.
+        """
+        return {'acquired': self._acquired,
+                'contended': self._contended,
+                'wait': self._wait.summary(),
+                'hold': self._hold.summary()}
+
+
+def locked(name):
+    """
+    Method decorator that runs the method holding the TimedLock stored on
+    attribute ``name`` of the instance.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with getattr(self, name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
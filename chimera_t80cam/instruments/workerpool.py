@@ -0,0 +1,151 @@
+import time
+import Queue
+import logging
+import threading
+
+from chimera.core.exceptions import ChimeraException
+
+log = logging.getLogger(__name__)
+
+
+class WorkerPoolFull(ChimeraException):
+    pass
+
+
+class WorkerPool(object):
+    """
+    Fixed number of worker threads consuming a bounded job queue.
+
+    :meth:`submit` blocks while ``max_pending`` jobs are already waiting or
+    running, which gives natural backpressure to whoever is producing the
+    jobs. Queue depth, job latency (submit to completion) and failure counts
+    are available from :meth:`getStats`.
+    """
+
+    def __init__(self, workers=2, max_pending=4, name='worker'):
+        self.workers = int(workers)
+        self.max_pending = int(max_pending)
+        self.name = name
+
+        self._queue = Queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._threads = []
+        self._statsLock = threading.Lock()
+
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._running = 0
+        self._lastLatency = 0.
+        self._totalLatency = 0.
+        self._maxLatency = 0.
+        self._totalWait = 0.
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name='%s-%i' % (self.name, i))
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, wait=True):
+        """
+        Stop the workers once the jobs already queued are done.
+        """
+        for t in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+        self._threads = []
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue ``fn(*args, **kwargs)`` to run on a worker.
+
+        :param timeout: keyword only, seconds to wait for room in the queue.
+                        None waits forever.
+        """
+        timeout = kwargs.pop('timeout', None)
+
+        self.start()
+
+        start = time.time()
+        if not self._acquireSlot(timeout):
+            raise WorkerPoolFull("%i %s jobs still pending after %.1f s." % (self.max_pending,
+                                                                             self.name, timeout))
+        waited = time.time() - start
+
+        with self._statsLock:
+            self._submitted += 1
+            self._totalWait += waited
+
+        if waited > 0.1:
+            log.debug('Waited %.2f s for room in the %s queue' % (waited, self.name))
+
+        self._queue.put((fn, args, kwargs, time.time()))
+
+    def pending(self):
+        """
+        Number of jobs queued or running.
+        """
+        with self._statsLock:
+            return self._submitted - self._completed - self._failed
+
+    def getStats(self):
+        with self._statsLock:
+            done = self._completed + self._failed
+            return {'workers': self.workers,
+                    'max_pending': self.max_pending,
+                    'pending': self._submitted - done,
+                    'running': self._running,
+                    'submitted': self._submitted,
+                    'completed': self._completed,
+                    'failed': self._failed,
+                    'last_latency': self._lastLatency,
+                    'mean_latency': self._totalLatency / done if done else 0.,
+                    'max_latency': self._maxLatency,
+                    'total_submit_wait': self._totalWait}
+
+    def _acquireSlot(self, timeout):
+        if timeout is None:
+            self._slots.acquire()
+            return True
+
+        deadline = time.time() + timeout
+        while not self._slots.acquire(False):
+            if time.time() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            fn, args, kwargs, submitted = job
+            with self._statsLock:
+                self._running += 1
+
+            failed = False
+            try:
+                fn(*args, **kwargs)
+            except Exception, e:
+                failed = True
+                log.exception(e)
+            finally:
+                latency = time.time() - submitted
+                with self._statsLock:
+                    self._running -= 1
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+                    self._lastLatency = latency
+                    self._totalLatency += latency
+                    self._maxLatency = max(self._maxLatency, latency)
+                self._slots.release()
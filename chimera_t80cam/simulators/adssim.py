@@ -0,0 +1,577 @@
+"""
+Local stand-in for the Beckhoff PLC driving the FSU wheels.
+
+It answers ADS requests over AMS/TCP, exposes the symbols FSUFWheels
+registers and runs, on a PLC-like scan cycle, a model of the filter wheel,
+analyser wheel, wave plate and polarizer: command bits in
+``.wDWORD_READ[n]``, status bits in ``.wDWORD_WRITE[n]``, requested
+positions mirrored to ``.wPOSITIONING_REQUESTED_*`` and motions that take
+a time proportional to the distance travelled. Clients may subscribe to
+change notifications of any symbol; they are checked on every scan.
+"""
+
+import time
+import socket
+import struct
+import logging
+import threading
+import SocketServer
+
+from collections import defaultdict
+
+from chimera_t80cam.instruments.ebox import adsproto
+
+log = logging.getLogger(__name__)
+
+# Command bits (wDWORD_READ) and status bits (wDWORD_WRITE) used by the model.
+FW_START = 1
+FW_HOME_MODE = (1 << 2)
+FW_SET_HOME = (1 << 3)
+FW_STOP = (1 << 5)
+FW_FILTER_REACHED = (1 << 2)
+FW_ANALYSER_REACHED = (1 << 3)
+
+AXIS_ENABLE = 1
+AXIS_RESET = (1 << 1)
+AXIS_JOG_PLUS = (1 << 2)
+AXIS_JOG_MINUS = (1 << 3)
+AXIS_START = (1 << 4)
+AXIS_STOP = (1 << 5)
+AXIS_ENABLED = 1
+AXIS_REACHED = (1 << 2)
+AXIS_HOMED = (1 << 3)
+
+_FORMATS = {'i': struct.Struct('<i'), 'd': struct.Struct('<d'), '?': struct.Struct('<?')}
+
+
+class Wheel(object):
+    """
+    A wheel or linear stage moving between numbered positions.
+
+    :param slots: number of positions.
+    :param slot_time: seconds to travel from one position to the next.
+    :param settle_time: seconds added to every move.
+    :param cyclic: True if the wheel may go either way around.
+    """
+
+    def __init__(self, name, slots, slot_time, settle_time, cyclic=True):
+        self.name = name
+        self.slots = slots
+        self.slot_time = slot_time
+        self.settle_time = settle_time
+        self.cyclic = cyclic
+
+        self.position = 0
+        self.target = 0
+        self.moving = False
+        self._start = 0.
+        self._end = 0.
+
+    def distance(self, target):
+        steps = abs(target - self.position)
+        if self.cyclic:
+            steps = min(steps, self.slots - steps)
+        return steps
+
+    def start(self, target, now):
+        self.target = int(target) % self.slots if self.cyclic else max(0, min(int(target), self.slots - 1))
+        self.moving = True
+        self._start = now
+        self._end = now + self.settle_time + self.distance(self.target) * self.slot_time
+
+    def stop(self, now):
+        if not self.moving:
+            return
+        done = (now - self._start) / max(self._end - self._start, 1e-9)
+        self.target = self.position + int(round((self.target - self.position) * min(done, 1.)))
+        self.position = self.target
+        self.moving = False
+
+    def update(self, now):
+        """
+        Advance the motion, return True when the wheel just arrived.
+        """
+        if self.moving and now >= self._end:
+            self.position = self.target
+            self.moving = False
+            return True
+        return False
+
+    @property
+    def angle(self):
+        return self.position * 360. / self.slots
+
+
+class FSUPLCSimulator(object):
+    """
+    Symbol table and wheel state machines of the FSU PLC.
+
+    :param cycle: PLC scan cycle, in seconds.
+    :param latency: delay added before every ADS answer, in seconds.
+    :param notifications: False to refuse ADS notification requests.
+    """
+
+    def __init__(self, cycle=0.01, latency=0., slot_time=0.4, settle_time=0.5, notifications=True):
+        self.cycle = cycle
+        self.latency = latency
+        self.notifications = notifications
+
+        self.lock = threading.RLock()
+        self._symbols = {}
+        self._handles = {}
+        self._nextHandle = 1
+        # notification handle -> [symbol, size, callback, last value sent]
+        self._notifications = {}
+        self._nextNotification = 1
+
+        for i in range(24):
+            self._add('.wDWORD_READ[%i]' % i, 'i', 0)
+            self._add('.wDWORD_WRITE[%i]' % i, 'i', 0)
+        for i in range(6):
+            self._add('.rlREAL_READ[%i]' % i, 'd', 0.)
+        for name in ('T80_CAM_BOX', 'T80_POL_BOX_FILTER_WHEEL1', 'T80_POL_BOX_FILTER_WHEEL2',
+                     'T80_POL_BOX_WHEEL', 'T80_POL_BOX_FILTER'):
+            self._add('.wPOSITIONING_REQUESTED_%s' % name, 'i', 0)
+        self._add('.bFILTER_1_AND_2_HOME_MODE', '?', False)
+        self._add('.lrINITIAL_ANGLE_POS_M1', 'd', 0.)
+        self._add('.lrINITIAL_ANGLE_POS_M2', 'd', 0.)
+
+        self.wheels = {'filter': Wheel('filter', 12, slot_time, settle_time),
+                       'analyser': Wheel('analyser', 12, slot_time, settle_time),
+                       'wave_plate': Wheel('wave_plate', 16, slot_time / 2., settle_time),
+                       'polarizer': Wheel('polarizer', 18, slot_time / 2., settle_time, cyclic=False)}
+
+        # Which register last requested a filter wheel position, the CAM box
+        # one (wDWORD_READ[0]) or the POL box one (wDWORD_READ[2]).
+        self._filterRequest = '.wdword_read[0]'
+        self._previous = defaultdict(int)
+        self._moves = []
+
+        self.stats = defaultdict(int)
+        # Client connections accepted since start, kept by resetStats.
+        self.connections = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+        self._set('.wDWORD_WRITE[1]', FW_FILTER_REACHED | FW_ANALYSER_REACHED)
+        self._set('.wDWORD_WRITE[10]', AXIS_REACHED | AXIS_HOMED)
+        self._set('.wDWORD_WRITE[20]', AXIS_REACHED | AXIS_HOMED)
+
+    # Symbol table
+
+    def _add(self, name, fmt, value):
+        self._symbols[name.lower()] = [_FORMATS[fmt], value]
+
+    def _get(self, name):
+        return self._symbols[name.lower()][1]
+
+    def _set(self, name, value):
+        self._symbols[name.lower()][1] = value
+
+    def handle(self, name):
+        name = name.rstrip('\0').lower()
+        if name not in self._symbols:
+            return None
+        with self.lock:
+            handle = self._nextHandle
+            self._nextHandle += 1
+            self._handles[handle] = name
+        return handle
+
+    def release(self, handle):
+        with self.lock:
+            return self._handles.pop(handle, None) is not None
+
+    def read(self, name, size):
+        """
+        Return the raw value of a symbol, or None if it does not exist.
+        """
+        with self.lock:
+            if name not in self._symbols:
+                return None
+            fmt, value = self._symbols[name]
+            self.stats['read %s' % name] += 1
+            return fmt.pack(value)[:size]
+
+    def write(self, name, data):
+        with self.lock:
+            if name not in self._symbols:
+                return False
+            fmt = self._symbols[name][0]
+            self._symbols[name][1] = fmt.unpack(data[:fmt.size].ljust(fmt.size, '\0'))[0]
+            self.stats['write %s' % name] += 1
+            if name in ('.wdword_read[0]', '.wdword_read[2]'):
+                self._filterRequest = name
+            return True
+
+    def symbol(self, handle):
+        return self._handles.get(handle)
+
+    def subscribe(self, name, size, callback):
+        """
+        Call callback(handle, data) with the raw value of ``name`` now and
+        whenever it changes.
+
+        :return: the notification handle, or None if the symbol does not exist.
+        """
+        with self.lock:
+            if name not in self._symbols:
+                return None
+            handle = self._nextNotification
+            self._nextNotification += 1
+            self._notifications[handle] = [name, size, callback, None]
+            self.stats['notifications added'] += 1
+        self.notify()
+        return handle
+
+    def unsubscribe(self, handle):
+        with self.lock:
+            return self._notifications.pop(handle, None) is not None
+
+    def notify(self):
+        """
+        Send the notifications whose symbol changed since they were last sent.
+        """
+        pending = []
+        with self.lock:
+            for handle, notification in self._notifications.items():
+                name, size, callback, last = notification
+                fmt, value = self._symbols[name]
+                data = fmt.pack(value)[:size]
+                if data != last:
+                    notification[3] = data
+                    pending.append((callback, handle, data))
+            self.stats['notifications'] += len(pending)
+        for callback, handle, data in pending:
+            try:
+                callback(handle, data)
+            except Exception, e:
+                log.debug('Could not send notification %i: %s' % (handle, e))
+
+    # Scan cycle
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='plc-cycle')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.isSet():
+            self.scan(time.time())
+            self.notify()
+            self._stop.wait(self.cycle)
+
+    def _rising(self, name, bit):
+        """
+        True if ``bit`` of command word ``name`` went up since the last scan.
+        """
+        return (self._get(name) & bit) and not (self._previous[name] & bit)
+
+    def _startMove(self, wheel, target, now):
+        wheel.start(target, now)
+        self._moves.append({'wheel': wheel.name, 'from': wheel.position, 'to': wheel.target,
+                            'start': now, 'end': None})
+        self.stats['moves'] += 1
+
+    def scan(self, now):
+        """
+        One PLC cycle: mirror requests, act on command edges, move the wheels
+        and refresh the status words.
+        """
+        with self.lock:
+            # Requested positions are latched into the positioning registers.
+            self._set('.wPOSITIONING_REQUESTED_T80_CAM_BOX', self._get('.wDWORD_READ[0]'))
+            self._set('.wPOSITIONING_REQUESTED_T80_POL_BOX_FILTER_WHEEL1', self._get('.wDWORD_READ[2]'))
+            self._set('.wPOSITIONING_REQUESTED_T80_POL_BOX_FILTER_WHEEL2', self._get('.wDWORD_READ[3]'))
+            self._set('.wPOSITIONING_REQUESTED_T80_POL_BOX_WHEEL', self._get('.wDWORD_READ[12]'))
+            self._set('.wPOSITIONING_REQUESTED_T80_POL_BOX_FILTER', self._get('.wDWORD_READ[22]'))
+
+            self._scanFilterWheels(now)
+            self._scanAxis('.wDWORD_READ[10]', '.wDWORD_READ[12]', '.wDWORD_WRITE[10]',
+                           self.wheels['wave_plate'], now)
+            self._scanAxis('.wDWORD_READ[20]', '.wDWORD_READ[22]', '.wDWORD_WRITE[20]',
+                           self.wheels['polarizer'], now)
+
+            for name in ('.wDWORD_READ[1]', '.wDWORD_READ[10]', '.wDWORD_READ[20]'):
+                self._previous[name] = self._get(name)
+
+    def _scanFilterWheels(self, now):
+        command = '.wDWORD_READ[1]'
+        filter_wheel = self.wheels['filter']
+        analyser = self.wheels['analyser']
+
+        self._set('.bFILTER_1_AND_2_HOME_MODE', bool(self._get(command) & FW_HOME_MODE))
+        if self._get('.bFILTER_1_AND_2_HOME_MODE') and self._rising(command, FW_SET_HOME):
+            self._set('.lrINITIAL_ANGLE_POS_M1', self._get('.rlREAL_READ[2]'))
+            self._set('.lrINITIAL_ANGLE_POS_M2', self._get('.rlREAL_READ[3]'))
+
+        if self._rising(command, FW_STOP):
+            filter_wheel.stop(now)
+            analyser.stop(now)
+        elif self._rising(command, FW_START) and not (self._get(command) & FW_STOP):
+            self._startMove(filter_wheel, self._get(self._filterRequest), now)
+            self._startMove(analyser, self._get('.wDWORD_READ[3]'), now)
+
+        for wheel in (filter_wheel, analyser):
+            if wheel.update(now):
+                self._finishMove(wheel, now)
+
+        status = self._get('.wDWORD_WRITE[1]') & ~(FW_FILTER_REACHED | FW_ANALYSER_REACHED)
+        if not filter_wheel.moving:
+            status |= FW_FILTER_REACHED
+        if not analyser.moving:
+            status |= FW_ANALYSER_REACHED
+        self._set('.wDWORD_WRITE[1]', status)
+
+        self._set('.rlREAL_READ[0]', filter_wheel.angle)
+        self._set('.rlREAL_READ[1]', analyser.angle)
+        self._set('.rlREAL_READ[4]', 100. if filter_wheel.moving else 0.)
+        self._set('.rlREAL_READ[5]', 100. if analyser.moving else 0.)
+
+    def _scanAxis(self, command, request, status_word, wheel, now):
+        value = self._get(command)
+
+        if value & (AXIS_RESET | AXIS_JOG_PLUS | AXIS_JOG_MINUS):
+            # Reset and jog requests act once and are cleared by the PLC.
+            if value & AXIS_JOG_PLUS and not wheel.moving:
+                self._startMove(wheel, wheel.position + 1, now)
+            elif value & AXIS_JOG_MINUS and not wheel.moving:
+                self._startMove(wheel, wheel.position - 1, now)
+            self._set(command, value & ~(AXIS_RESET | AXIS_JOG_PLUS | AXIS_JOG_MINUS))
+
+        if self._rising(command, AXIS_STOP):
+            wheel.stop(now)
+        elif self._rising(command, AXIS_START) and not (value & AXIS_STOP):
+            self._startMove(wheel, self._get(request), now)
+
+        if wheel.update(now):
+            self._finishMove(wheel, now)
+
+        status = AXIS_HOMED
+        if value & AXIS_ENABLE:
+            status |= AXIS_ENABLED
+        if not wheel.moving:
+            status |= AXIS_REACHED
+        self._set(status_word, status)
+
+    def _finishMove(self, wheel, now):
+        for move in reversed(self._moves):
+            if move['wheel'] == wheel.name and move['end'] is None:
+                move['end'] = now
+                break
+
+    # Statistics
+
+    def getStats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['positions'] = dict((name, wheel.position) for name, wheel in self.wheels.items())
+            stats['move_times'] = [move['end'] - move['start'] for move in self._moves
+                                   if move['end'] is not None]
+            return stats
+
+    def resetStats(self):
+        with self.lock:
+            self.stats.clear()
+            self._moves = []
+
+
+class _ADSHandler(SocketServer.BaseRequestHandler):
+
+    def setup(self):
+        self.plc = self.server.plc
+        with self.plc.lock:
+            self.plc.connections += 1
+        # Notifications are sent from the PLC cycle thread.
+        self.sendLock = threading.Lock()
+        self.notifications = set()
+        self.client = None
+
+    def finish(self):
+        for handle in self.notifications:
+            self.plc.unsubscribe(handle)
+
+    def send(self, frame):
+        with self.sendLock:
+            self.request.sendall(frame)
+
+    def handle(self):
+        log.debug('Client connected from %s:%s' % self.client_address)
+        try:
+            while True:
+                header, data = adsproto.recv_frame(self.request)
+                target, target_port, source, source_port, command, flags, length, error, invoke_id = header
+                self.client = (source, source_port, target, target_port)
+
+                if self.plc.latency:
+                    time.sleep(self.plc.latency)
+
+                with self.plc.lock:
+                    self.plc.stats['roundtrips'] += 1
+                    self.plc.stats['command %i' % command] += 1
+
+                reply = self.dispatch(command, data)
+                self.send(adsproto.pack_frame(source, source_port, target, target_port,
+                                              command, adsproto.STATE_RESPONSE, reply,
+                                              invoke_id=invoke_id))
+        except (EOFError, socket.error):
+            log.debug('Client %s:%s disconnected' % self.client_address)
+
+    def notification(self, handle, value):
+        """
+        Send a DeviceNotification frame with one sample of ``handle``.
+        """
+        source, source_port, target, target_port = self.client
+        data = (adsproto.NOTIFICATION_STAMP.pack(adsproto.pack_filetime(time.time()), 1) +
+                adsproto.NOTIFICATION_SAMPLE.pack(handle, len(value)) + value)
+        data = adsproto.NOTIFICATION_HEADER.pack(len(data) + 4, 1) + data
+        self.send(adsproto.pack_frame(source, source_port, target, target_port,
+                                      adsproto.ADSCMD_DEVICE_NOTIFICATION, adsproto.STATE_REQUEST, data))
+
+    def dispatch(self, command, data):
+        if command == adsproto.ADSCMD_READ_DEVICE_INFO:
+            return adsproto.DEVICE_INFO_RESPONSE.pack(adsproto.ADSERR_NOERR, 2, 11, 1, 'FSU PLC simulator')
+        elif command == adsproto.ADSCMD_READ_STATE:
+            return adsproto.READ_STATE_RESPONSE.pack(adsproto.ADSERR_NOERR, adsproto.ADS_STATE_RUN, 0)
+        elif command == adsproto.ADSCMD_READ:
+            group, offset, size = adsproto.READ_REQUEST.unpack_from(data)
+            result, value = self.read(group, offset, size)
+            return adsproto.READ_RESPONSE.pack(result, len(value)) + value
+        elif command == adsproto.ADSCMD_WRITE:
+            group, offset, size = adsproto.WRITE_REQUEST.unpack_from(data)
+            payload = data[adsproto.WRITE_REQUEST.size:adsproto.WRITE_REQUEST.size + size]
+            return adsproto.WRITE_RESPONSE.pack(self.write(group, offset, payload))
+        elif command == adsproto.ADSCMD_READ_WRITE:
+            group, offset, read_size, write_size = adsproto.READ_WRITE_REQUEST.unpack_from(data)
+            payload = data[adsproto.READ_WRITE_REQUEST.size:adsproto.READ_WRITE_REQUEST.size + write_size]
+            result, value = self.read_write(group, offset, read_size, payload)
+            return adsproto.READ_RESPONSE.pack(result, len(value)) + value
+        elif command == adsproto.ADSCMD_ADD_DEVICE_NOTIFICATION and self.plc.notifications:
+            group, offset, size, mode, max_delay, cycle_time, reserved = \
+                adsproto.ADD_NOTIFICATION_REQUEST.unpack_from(data)
+            result, handle = self.add_notification(group, offset, size)
+            return adsproto.ADD_NOTIFICATION_RESPONSE.pack(result, handle)
+        elif command == adsproto.ADSCMD_DEL_DEVICE_NOTIFICATION:
+            handle = adsproto.DEL_NOTIFICATION_REQUEST.unpack_from(data)[0]
+            self.notifications.discard(handle)
+            if not self.plc.unsubscribe(handle):
+                return adsproto.WRITE_RESPONSE.pack(adsproto.ADSERR_DEVICE_NOTIFYHNDINVALID)
+            return adsproto.WRITE_RESPONSE.pack(adsproto.ADSERR_NOERR)
+        return adsproto.WRITE_RESPONSE.pack(adsproto.ADSERR_DEVICE_SRVNOTSUPP)
+
+    def add_notification(self, group, offset, size):
+        if group != adsproto.ADSIGRP_SYM_VALBYHND:
+            return adsproto.ADSERR_DEVICE_INVALIDGRP, 0
+        handle = self.plc.subscribe(self.plc.symbol(offset), size, self.notification)
+        if handle is None:
+            return adsproto.ADSERR_DEVICE_SYMBOLNOTFOUND, 0
+        self.notifications.add(handle)
+        return adsproto.ADSERR_NOERR, handle
+
+    def read(self, group, offset, size):
+        if group != adsproto.ADSIGRP_SYM_VALBYHND:
+            return adsproto.ADSERR_DEVICE_INVALIDGRP, ''
+        value = self.plc.read(self.plc.symbol(offset), size)
+        if value is None:
+            return adsproto.ADSERR_DEVICE_SYMBOLNOTFOUND, ''
+        return adsproto.ADSERR_NOERR, value
+
+    def write(self, group, offset, data):
+        if group == adsproto.ADSIGRP_SYM_RELEASEHND:
+            handle = struct.unpack('<I', data[:4])[0]
+            return adsproto.ADSERR_NOERR if self.plc.release(handle) else adsproto.ADSERR_DEVICE_SYMBOLNOTFOUND
+        if group != adsproto.ADSIGRP_SYM_VALBYHND:
+            return adsproto.ADSERR_DEVICE_INVALIDGRP
+        if not self.plc.write(self.plc.symbol(offset), data):
+            return adsproto.ADSERR_DEVICE_SYMBOLNOTFOUND
+        return adsproto.ADSERR_NOERR
+
+    def read_write(self, group, offset, read_size, data):
+        if group == adsproto.ADSIGRP_SYM_HNDBYNAME:
+            handle = self.plc.handle(data)
+            if handle is None:
+                return adsproto.ADSERR_DEVICE_SYMBOLNOTFOUND, ''
+            return adsproto.ADSERR_NOERR, struct.pack('<I', handle)
+        elif group == adsproto.ADSIGRP_SYM_VALBYNAME:
+            value = self.plc.read(data.rstrip('\0').lower(), read_size)
+            if value is None:
+                return adsproto.ADSERR_DEVICE_SYMBOLNOTFOUND, ''
+            return adsproto.ADSERR_NOERR, value
+        elif group == adsproto.ADSIGRP_SYM_RELEASEHND:
+            return self.write(group, offset, data), ''
+        elif group == adsproto.ADSIGRP_SUMUP_READ:
+            return adsproto.ADSERR_NOERR, self.sum_read(offset, data)
+        elif group == adsproto.ADSIGRP_SUMUP_WRITE:
+            return adsproto.ADSERR_NOERR, self.sum_write(offset, data)
+        elif group == adsproto.ADSIGRP_SUMUP_READWRITE:
+            return adsproto.ADSERR_NOERR, self.sum_read_write(offset, data)
+        return adsproto.ADSERR_DEVICE_INVALIDGRP, ''
+
+    # Sum commands carry ``count`` sub-request headers followed by their
+    # data; answers carry the sub-results followed by the read data.
+
+    def sum_read(self, count, data):
+        results, values = [], []
+        for i in range(count):
+            group, offset, size = adsproto.READ_REQUEST.unpack_from(data, i * adsproto.READ_REQUEST.size)
+            result, value = self.read(group, offset, size)
+            results.append(struct.pack('<I', result))
+            values.append(value.ljust(size, '\0'))
+        return ''.join(results) + ''.join(values)
+
+    def sum_write(self, count, data):
+        pos = count * adsproto.WRITE_REQUEST.size
+        results = []
+        for i in range(count):
+            group, offset, size = adsproto.WRITE_REQUEST.unpack_from(data, i * adsproto.WRITE_REQUEST.size)
+            results.append(struct.pack('<I', self.write(group, offset, data[pos:pos + size])))
+            pos += size
+        return ''.join(results)
+
+    def sum_read_write(self, count, data):
+        pos = count * adsproto.READ_WRITE_REQUEST.size
+        results, values = [], []
+        for i in range(count):
+            group, offset, read_size, write_size = adsproto.READ_WRITE_REQUEST.unpack_from(
+                data, i * adsproto.READ_WRITE_REQUEST.size)
+            result, value = self.read_write(group, offset, read_size, data[pos:pos + write_size])
+            pos += write_size
+            results.append(adsproto.READ_RESPONSE.pack(result, len(value)))
+            values.append(value)
+        return ''.join(results) + ''.join(values)
+
+
+class ADSServer(SocketServer.ThreadingTCPServer):
+    """
+    AMS/TCP server answering ADS requests from a FSUPLCSimulator.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=adsproto.AMS_TCP_PORT, plc=None):
+        self.plc = plc or FSUPLCSimulator()
+        SocketServer.ThreadingTCPServer.__init__(self, (host, port), _ADSHandler)
+
+    def start(self):
+        """
+        Run the PLC cycle and serve on background threads.
+        """
+        self.plc.start()
+        t = threading.Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        return t
+
+    def stop(self):
+        self.shutdown()
+        self.plc.stop()
@@ -0,0 +1,401 @@
+"""
+Local stand-in for the Spectral Instruments camera server.
+
+It speaks enough of the SI wire protocol for SIBase to run its whole
+acquisition pipeline, in remote and localhost modes, without hardware.
+Command function numbers and result packets come from the same si client
+package SIBase uses, so both sides always agree on the encoding.
+"""
+
+import os
+import re
+import time
+import struct
+import logging
+import threading
+import SocketServer
+
+from collections import defaultdict
+
+import numpy as N
+from astropy.io import fits as pyfits
+
+from si.commands.camera import (Acquire, GetCameraParameters, GetStatusFromCamera,
+                                InquireAcquisitionStatus, RetrieveImage, GetImageHeader,
+                                SaveImage, SetSaveToFolderPath, TerminateAcquisition,
+                                SetExposureTime, SetAcquisitionMode, SetAcquisitionType,
+                                SetNumberOfFrames, SetCCDFormatParameters,
+                                GetSIImageSGLIISettings, SetCooler, GetAcquisitionModes)
+
+from chimera_t80cam.instruments import siprotocol
+
+log = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r'[ -~]{2,}')
+
+# Bytes of pixels per image data packet.
+IMAGE_CHUNK = 1 << 20
+
+
+def _commands():
+    """
+    Map function numbers to (handler name, command prototype), reading the
+    numbers from the client's own command encoding.
+    """
+    prototypes = [('acquire', Acquire()),
+                  ('parameters', GetCameraParameters()),
+                  ('status', GetStatusFromCamera()),
+                  ('inquire', InquireAcquisitionStatus()),
+                  ('retrieve', RetrieveImage(0)),
+                  ('image_header', GetImageHeader(1)),
+                  ('save', SaveImage('tmp.fits', 'I16')),
+                  ('folder', SetSaveToFolderPath('/tmp')),
+                  ('terminate', TerminateAcquisition()),
+                  ('exptime', SetExposureTime(1.)),
+                  ('acq_mode', SetAcquisitionMode(0)),
+                  ('acq_type', SetAcquisitionType(0)),
+                  ('frames', SetNumberOfFrames(1)),
+                  ('format', SetCCDFormatParameters(0, 1, 1, 0, 1, 1)),
+                  ('sgl2', GetSIImageSGLIISettings()),
+                  ('cooler', SetCooler(1)),
+                  ('acq_modes', GetAcquisitionModes())]
+
+    table = {}
+    for name, cmd in prototypes:
+        func = siprotocol.COMMAND_HEADER.unpack_from(cmd.command().toStruct())[3]
+        table[func] = (name, cmd)
+    return table
+
+
+def encode_result(cmd, **fields):
+    """
+    Build the data packet answering ``cmd`` using the client's result class.
+    """
+    result = cmd.result()
+    result.id = siprotocol.PACKET_DATA
+    for key, value in fields.items():
+        setattr(result, key, value)
+    data = result.toStruct()
+    if getattr(result, 'length', len(data)) != len(data):
+        result.length = len(data)
+        data = result.toStruct()
+    return data
+
+
+class SICameraSimulator(object):
+    """
+    Camera state shared by all connections to the simulated server.
+
+    :param width: serial length of the frame.
+    :param height: parallel length of the frame.
+    :param readout_rate: pixels read out per second.
+    :param latency: delay added before every answer, in seconds.
+    """
+
+    def __init__(self, width=9216, height=9232, readout_rate=4e6, latency=0., seed=0):
+        self.width = width
+        self.height = height
+        self.readout_rate = float(readout_rate)
+        self.latency = latency
+
+        self.exptime = 0.
+        self.acq_type = 0
+        self.acq_mode = 0
+        self.frames = 1
+        self.folder = '/tmp'
+        self.ccd_temperature = -100.
+        self.pressure = 1e-3
+
+        self.acquisition_start = None
+        self.terminated = threading.Event()
+
+        self.stats = defaultdict(int)
+        self.lock = threading.Lock()
+
+        # Subframe and binning set with SetCCDFormatParameters, in unbinned
+        # pixels: serial origin, length and binning, parallel origin, length
+        # and binning.
+        self.format = (0, width, 1, 0, height, 1)
+
+        rnd = N.random.RandomState(seed)
+        self.frame = (1000 + rnd.normal(0, 5, width * height)).astype(siprotocol.FRAME_DTYPE)
+
+    def set_format(self, serial_origin, serial_length, serial_bin,
+                   parallel_origin, parallel_length, parallel_bin):
+        serial_bin, parallel_bin = max(1, serial_bin), max(1, parallel_bin)
+        serial_origin = min(serial_origin, self.width - serial_bin)
+        parallel_origin = min(parallel_origin, self.height - parallel_bin)
+        serial_length = min(serial_length, self.width - serial_origin) or self.width - serial_origin
+        parallel_length = min(parallel_length, self.height - parallel_origin) or self.height - parallel_origin
+        self.format = (serial_origin, serial_length, serial_bin,
+                       parallel_origin, parallel_length, parallel_bin)
+
+    @property
+    def image_size(self):
+        """
+        Serial and parallel length of the images read out with the current format.
+        """
+        serial_origin, serial_length, serial_bin, parallel_origin, parallel_length, parallel_bin = self.format
+        return serial_length // serial_bin, parallel_length // parallel_bin
+
+    def image(self):
+        """
+        Pixels read out with the current format, binned pixels are summed.
+        """
+        serial_origin, serial_length, serial_bin, parallel_origin, parallel_length, parallel_bin = self.format
+        width, height = self.image_size
+        if (width, height) == (self.width, self.height):
+            return self.frame
+
+        frame = self.frame.reshape(self.height, self.width)
+        window = frame[parallel_origin:parallel_origin + height * parallel_bin,
+                       serial_origin:serial_origin + width * serial_bin].astype(N.uint32)
+        binned = window.reshape(height, parallel_bin, width, serial_bin).sum(axis=3).sum(axis=1)
+        return N.clip(binned, 0, 65535).astype(siprotocol.FRAME_DTYPE).ravel()
+
+    @property
+    def readout_time(self):
+        # Binned pixels are summed on chip, so time goes with the pixels
+        # digitised plus the rows shifted.
+        width, height = self.image_size
+        return (width * height + self.height) / self.readout_rate
+
+    def progress(self):
+        """
+        Return exposure and readout completion percentages.
+        """
+        if self.acquisition_start is None or self.terminated.isSet():
+            return 100, 100
+        elapsed = time.time() - self.acquisition_start
+        exp_done = 100 if self.exptime <= 0 else min(100, int(100 * elapsed / self.exptime))
+        readout = elapsed - self.exptime
+        if readout <= 0:
+            return exp_done, 0
+        return exp_done, min(100, int(100 * readout / self.readout_time))
+
+    def parameter_list(self):
+        lines = ['Factory,Installed CCDs,1',
+                 'Factory,Serial Active Pix.,%i' % self.width,
+                 'Factory,Parallel Active Pix.,%i' % self.height,
+                 'Factory,Serial Pre-Masked,0',
+                 'Factory,Parallel Pre-Masked,0',
+                 'Factory,Image Area Size X,%.1f' % (self.width * 9e-3),
+                 'Factory,Image Area Size Y,%.1f' % (self.height * 9e-3),
+                 'Setup,Temperature Setpoint,%i' % int((self.ccd_temperature + 273.15) * 10)]
+        return '\n'.join(lines)
+
+    def status_list(self):
+        lines = ['CCD Temp.,%.1f,C' % self.ccd_temperature,
+                 'Chamber Pressure,%.2e,Torr' % self.pressure]
+        return '\n'.join(lines)
+
+    def header_cards(self):
+        return [('PG0_1', 0), ('PG0_10', 0), ('PG0_15', 0), ('PG0_54', 0),
+                ('PG0_55', 20.0, 'Instrument temperature'),
+                ('PG0_56', self.ccd_temperature, 'CCD temperature'),
+                ('PG1_1', 0), ('PG1_2', 0),
+                ('PG1_7', self.width), ('PG1_8', self.height),
+                ('PG2_0', self.exptime, 'Exposure time')]
+
+    def header_string(self):
+        header = pyfits.Header()
+        for card in self.header_cards():
+            header.set(*card)
+        return header.tostring(sep='', endcard=False, padding=False)
+
+    def save(self, filename):
+        width, height = self.image_size
+        hdu = pyfits.PrimaryHDU(data=self.image().reshape(height, width).astype(N.uint16))
+        for card in self.header_cards():
+            hdu.header.set(*card)
+        hdu.header['NAXIS3'] = 1
+        hdu.header['DATE-OBS'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        hdu.writeto(os.path.join(self.folder, filename), clobber=True)
+
+
+class _SIHandler(SocketServer.BaseRequestHandler):
+
+    def setup(self):
+        self.sim = self.server.simulator
+        self.commands = self.server.commands
+        self.send_lock = threading.Lock()
+        self.request.setsockopt(6, 1, 1)  # TCP_NODELAY
+
+    def send(self, data):
+        with self.send_lock:
+            self.request.sendall(data)
+        with self.sim.lock:
+            self.sim.stats['bytes_sent'] += len(data)
+
+    def recv(self, size):
+        data = ''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def ack(self, accept=1):
+        self.send(siprotocol.ACK_PACKET.pack(siprotocol.ACK_PACKET.size, siprotocol.PACKET_ACK, 0, accept))
+
+    def handle(self):
+        log.debug('Client connected from %s:%s' % self.client_address)
+        try:
+            while True:
+                header = self.recv(siprotocol.COMMAND_HEADER.size)
+                length, pkt_id, cam_id, func = siprotocol.COMMAND_HEADER.unpack(header)
+                payload = self.recv(length - len(header))
+
+                if self.sim.latency:
+                    time.sleep(self.sim.latency)
+
+                if func not in self.commands:
+                    log.warning('Unknown function %i' % func)
+                    self.ack(0)
+                    continue
+
+                name, proto = self.commands[func]
+                with self.sim.lock:
+                    self.sim.stats[name] += 1
+                getattr(self, 'do_' + name)(proto, payload)
+        except EOFError:
+            log.debug('Client %s:%s disconnected' % self.client_address)
+
+    def reply(self, proto, **fields):
+        self.ack()
+        if proto.result() is not None:
+            self.send(encode_result(proto, **fields))
+
+    # Acquisition
+
+    def do_acquire(self, proto, payload):
+        self.ack()
+        self.sim.terminated.clear()
+        self.sim.acquisition_start = time.time()
+
+        # Multi-frame acquisitions send one data packet per frame.
+        frames = self.sim.frames if self.sim.acq_mode != 0 else 1
+
+        def finish():
+            for i in range(max(1, frames)):
+                if self.sim.terminated.wait(self.sim.exptime + self.sim.readout_time):
+                    break
+                self.send(encode_result(proto))
+
+        t = threading.Thread(target=finish)
+        t.setDaemon(True)
+        t.start()
+
+    def do_terminate(self, proto, payload):
+        # Sent without acknowledge, the pending acquisition answers with its data packet.
+        if not self.sim.terminated.isSet():
+            self.sim.terminated.set()
+            self.send(encode_result(Acquire()))
+
+    def do_inquire(self, proto, payload):
+        exp_done, readout_done = self.sim.progress()
+        self.reply(proto, exp_done_percent=exp_done, readout_done_percent=readout_done)
+
+    def do_retrieve(self, proto, payload):
+        self.ack()
+        width, height = self.sim.image_size
+        pixels = self.sim.image().view(N.uint8)
+        total = len(pixels)
+        npackets = (total + IMAGE_CHUNK - 1) // IMAGE_CHUNK
+        for n, offset in enumerate(range(0, total, IMAGE_CHUNK)):
+            chunk = pixels[offset:offset + IMAGE_CHUNK]
+            header = siprotocol.IMAGE_HEADER.pack(0, siprotocol.DATA_TYPE_IMAGE, 0, 0,
+                                                  width, height,
+                                                  npackets, n, offset, len(chunk))
+            length = siprotocol.PACKET_HEADER.size + len(header) + len(chunk)
+            self.send(siprotocol.PACKET_HEADER.pack(length, siprotocol.PACKET_DATA, 0) + header)
+            self.send(chunk.tostring())
+
+    def do_image_header(self, proto, payload):
+        self.reply(proto, header=self.sim.header_string())
+
+    def do_save(self, proto, payload):
+        strings = _STRING_RE.findall(payload)
+        filename = strings[0] if strings else 'tmp.fits'
+        self.sim.save(filename)
+        self.reply(proto)
+
+    def do_folder(self, proto, payload):
+        strings = _STRING_RE.findall(payload)
+        if strings:
+            self.sim.folder = strings[0]
+        self.reply(proto)
+
+    # Settings
+
+    def do_exptime(self, proto, payload):
+        if len(payload) >= 8:
+            self.sim.exptime = struct.unpack('>d', payload[-8:])[0]
+        elif len(payload) >= 4:
+            self.sim.exptime = struct.unpack('>f', payload[-4:])[0]
+        self.reply(proto)
+
+    def do_acq_mode(self, proto, payload):
+        self.sim.acq_mode = struct.unpack('>H', payload[-2:])[0] if len(payload) >= 2 else 0
+        self.reply(proto)
+
+    def do_acq_type(self, proto, payload):
+        self.sim.acq_type = struct.unpack('>H', payload[-2:])[0] if len(payload) >= 2 else 0
+        self.reply(proto)
+
+    def do_frames(self, proto, payload):
+        self.sim.frames = struct.unpack('>H', payload[-2:])[0] if len(payload) >= 2 else 1
+        self.reply(proto)
+
+    def do_format(self, proto, payload):
+        # Six integers, of whatever width the client encodes them with.
+        size = len(payload) // 6
+        if size in (2, 4):
+            fmt = '>6H' if size == 2 else '>6I'
+            self.sim.set_format(*struct.unpack(fmt, payload[-6 * size:]))
+        self.reply(proto)
+
+    def do_cooler(self, proto, payload):
+        self.reply(proto)
+
+    # Information
+
+    def do_parameters(self, proto, payload):
+        self.reply(proto, parameterlist=self.sim.parameter_list())
+
+    def do_status(self, proto, payload):
+        self.reply(proto, statuslist=self.sim.status_list())
+
+    def do_sgl2(self, proto, payload):
+        self.reply(proto)
+
+    def do_acq_modes(self, proto, payload):
+        self.reply(proto, menuinfolist='0,Single Frame\n1,Multiple Frames')
+
+
+class SIServer(SocketServer.ThreadingTCPServer):
+    """
+    TCP server answering SI camera server commands from a SICameraSimulator.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=2055, simulator=None):
+        self.simulator = simulator or SICameraSimulator()
+        self.commands = _commands()
+        SocketServer.ThreadingTCPServer.__init__(self, (host, port), _SIHandler)
+
+    def start(self):
+        """
+        Serve on a background thread.
+        """
+        t = threading.Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        return t
+
+    def getStats(self):
+        with self.simulator.lock:
+            return dict(self.simulator.stats)
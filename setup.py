@@ -6,9 +6,10 @@ setup(
     packages=['chimera_t80cam', 'chimera_t80cam.instruments',
               'chimera_t80cam.instruments.ebox',
               'chimera_t80cam.instruments.ebox.fsufilters',
-              'chimera_t80cam.instruments.ebox.fsupolarimeter'],
+              'chimera_t80cam.instruments.ebox.fsupolarimeter',
+              'chimera_t80cam.simulators'],
     requires=['chimera','git+https://github.com/astroufsc/python-si-tcpclient.git','adshli'],
-    scripts=[],
+    scripts=['scripts/chimera-codecbench', 'scripts/chimera-sisim', 'scripts/chimera-adssim'],
     url='http://github.com/astroufsc/chimera_t80cam',
     license='GPL v2',
     author='Tiago Ribeiro',
@@ -0,0 +1,105 @@
+import random
+import unittest
+import itertools
+
+from chimera_t80cam.instruments import filterplan
+from chimera_t80cam.instruments.filterplan import MoveTimeMatrix, plan_exposures, _groups
+
+
+POSITIONS = dict(('F%i' % i, i) for i in range(12))
+
+
+def _moves():
+    return MoveTimeMatrix(12, overhead=1., per_slot=1.)
+
+
+def _plan(requests, start=0, readout=0., exact=True):
+    old = filterplan.MAX_EXACT
+    if not exact:
+        filterplan.MAX_EXACT = 0
+    try:
+        return plan_exposures(requests, POSITIONS, _moves(), start=start, readout=readout)
+    finally:
+        filterplan.MAX_EXACT = old
+
+
+def _order(plan):
+    return [step.index for step in plan]
+
+
+class TestGroups(unittest.TestCase):
+
+    def test_free_requests_grouped_by_filter(self):
+        requests = [{'filter': 'F1'}, {'filter': 'F2'}, {'filter': 'F1'}, {'filter': 'F2'}]
+        groups = _groups(requests, POSITIONS)
+        self.assertEqual([(g.filter, g.members) for g in groups], [('F1', [0, 2]), ('F2', [1, 3])])
+
+    def test_dependent_requests_kept_apart(self):
+        requests = [{'filter': 'F1'}, {'filter': 'F1'}, {'filter': 'F1', 'after': [1]}]
+        groups = _groups(requests, POSITIONS)
+        self.assertEqual([g.members for g in groups], [[0], [1], [2]])
+        self.assertEqual([g.after for g in groups], [set(), set(), set([1])])
+
+    def test_unknown_filter(self):
+        self.assertRaises(ValueError, _groups, [{'filter': 'X'}], POSITIONS)
+
+    def test_invalid_dependency(self):
+        self.assertRaises(ValueError, _groups, [{'filter': 'F1', 'after': [0]}], POSITIONS)
+        self.assertRaises(ValueError, _groups, [{'filter': 'F1', 'after': [3]}], POSITIONS)
+
+
+class TestPlanExposures(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(len(_plan([])), 0)
+
+    def test_same_filter_back_to_back(self):
+        requests = [{'filter': 'F1'}, {'filter': 'F6'}, {'filter': 'F1'}, {'filter': 'F6'}]
+        for exact in (True, False):
+            plan = _plan(requests, exact=exact)
+            self.assertEqual(_order(plan), [0, 2, 1, 3])
+            self.assertEqual([step.move for step in plan], [2., 0., 6., 0.])
+            self.assertTrue(plan.saved > 0)
+
+    def test_after_kept(self):
+        # F11 is on the way, but has to wait for the exposure on F6.
+        requests = [{'filter': 'F6'}, {'filter': 'F11', 'after': [0]}, {'filter': 'F1'}]
+        for exact in (True, False):
+            order = _order(_plan(requests, exact=exact))
+            self.assertTrue(order.index(0) < order.index(1), order)
+
+    def test_readout_hides_moves(self):
+        requests = [{'filter': 'F1'}, {'filter': 'F3'}]
+        plan = _plan(requests, readout=2.5)
+        # The first move has no readout before it.
+        self.assertEqual([step.dead for step in plan], [2., 0.5])
+
+    def test_circular_dependencies(self):
+        requests = [{'filter': 'F1', 'after': [1]}, {'filter': 'F2', 'after': [0]}]
+        for exact in (True, False):
+            self.assertRaises(ValueError, _plan, requests, exact=exact)
+
+    def test_exact_beats_greedy(self):
+        # Nearest first goes F1, F11, F8 and then has the longest move left.
+        requests = [{'filter': 'F1'}, {'filter': 'F11'}, {'filter': 'F8'}, {'filter': 'F3'}]
+        exact = _plan(requests)
+        greedy = _plan(requests, exact=False)
+        self.assertEqual(_order(greedy), [0, 1, 2, 3])
+        self.assertEqual(greedy.dead, 15.)
+        self.assertEqual(exact.dead, 14.)
+
+    def test_exact_is_optimal(self):
+        rnd = random.Random(0)
+        moves = _moves()
+        for trial in range(20):
+            filters = rnd.sample(sorted(POSITIONS), 5)
+            requests = [{'filter': flt} for flt in filters]
+            best = min(sum(moves.estimate(a, b) for a, b in zip((0,) + order, order))
+                       for order in itertools.permutations([POSITIONS[flt] for flt in filters]))
+            plan = _plan(requests)
+            self.assertEqual(plan.dead, best)
+            self.assertTrue(plan.dead <= _plan(requests, exact=False).dead)
+
+
+if __name__ == '__main__':
+    unittest.main()
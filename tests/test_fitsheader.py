@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as N
+from astropy.io import fits
+
+from chimera_t80cam.instruments.fitsheader import FitsHeaderEditor, find_header_end, BLOCK_SIZE, CARD_SIZE
+
+
+class TestFitsHeaderEditor(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, 'src.fits')
+        self.data = N.arange(60 * 50, dtype=N.int16).reshape(50, 60)
+        fits.PrimaryHDU(self.data).writeto(self.src)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _check(self, path):
+        with fits.open(path) as hdu:
+            self.assertTrue(N.all(hdu[0].data == self.data))
+            return hdu[0].header.copy()
+
+    def test_in_place(self):
+        size = os.path.getsize(self.src)
+        dest = os.path.join(self.dir, 'dest.fits')
+        editor = FitsHeaderEditor(self.src)
+        self.assertEqual(editor.header_size, BLOCK_SIZE)
+        editor.header.set('OBSERVER', 'me')
+        self.assertTrue(editor.fits_in_place())
+        self.assertEqual(editor.save(dest), dest)
+
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(os.path.getsize(dest), size)
+        self.assertEqual(self._check(dest)['OBSERVER'], 'me')
+
+    def test_rewrite(self):
+        editor = FitsHeaderEditor(self.src)
+        for i in range(40):
+            editor.header.set('KEY%i' % i, i)
+        self.assertFalse(editor.fits_in_place())
+        editor.save(reserve_cards=36)
+
+        self.assertEqual(editor.header_size, 3 * BLOCK_SIZE)
+        self.assertFalse(os.path.exists(self.src + '.part'))
+        header = self._check(self.src)
+        self.assertEqual(header['KEY39'], 39)
+
+        # Room was reserved, the next edit is done in place.
+        with FitsHeaderEditor(self.src) as editor:
+            self.assertEqual(editor.header_size, 3 * BLOCK_SIZE)
+            editor.header.set('OBSERVER', 'me')
+            self.assertTrue(editor.fits_in_place())
+            editor.save()
+        self.assertEqual(self._check(self.src)['OBSERVER'], 'me')
+
+    def test_missing_end_card(self):
+        cards = [fits.Card('SIMPLE', True), fits.Card('BITPIX', 8),
+                 fits.Card('NAXIS', 1), fits.Card('NAXIS1', BLOCK_SIZE)]
+        header = ''.join(str(card) for card in cards).ljust(BLOCK_SIZE)
+        data = ''.join(chr(i % 256) for i in range(BLOCK_SIZE))
+        with open(self.src, 'wb') as fp:
+            fp.write(header + data)
+
+        self.assertEqual(find_header_end(header + data), BLOCK_SIZE)
+        editor = FitsHeaderEditor(self.src)
+        self.assertEqual(editor.header_size, BLOCK_SIZE)
+        editor.header.set('OBSERVER', 'me')
+        self.assertTrue(editor.fits_in_place())
+        editor.save()
+
+        with open(self.src, 'rb') as fp:
+            text = fp.read()
+        self.assertEqual(len(text), 2 * BLOCK_SIZE)
+        self.assertEqual(text[4 * CARD_SIZE:4 * CARD_SIZE + 8], 'OBSERVER')
+        self.assertEqual(text[BLOCK_SIZE - CARD_SIZE:BLOCK_SIZE], 'END'.ljust(CARD_SIZE))
+        self.assertEqual(text[BLOCK_SIZE:], data)
+
+    def test_header_end(self):
+        end = 'END'.ljust(CARD_SIZE)
+        self.assertEqual(find_header_end(end), BLOCK_SIZE)
+        self.assertEqual(find_header_end(' ' * BLOCK_SIZE + end + '\0' * 10), 2 * BLOCK_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import time
+import threading
+import unittest
+
+from chimera_t80cam.instruments.framepool import FramePool, FramePoolExhausted
+
+
+class TestFramePool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FramePool(2, 4, 3)
+
+    def test_allocated_lazily_and_recycled(self):
+        frame = self.pool.acquire()
+        self.assertEqual(len(frame), 12)
+        self.assertEqual(len(self.pool), 1)
+        self.pool.release(frame)
+        self.assertEqual(self.pool.in_use, 0)
+
+        again = self.pool.acquire(2, 3)
+        self.assertEqual(len(again), 6)
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(self.pool.in_use, 1)
+
+    def test_larger_than_pool_frame(self):
+        self.assertRaises(FramePoolExhausted, self.pool.acquire, 5, 3)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_exhausted_timeout(self):
+        self.pool.acquire()
+        self.pool.acquire()
+        start = time.time()
+        self.assertRaises(FramePoolExhausted, self.pool.acquire, timeout=0.1)
+        self.assertTrue(time.time() - start >= 0.1)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_exhausted_waits_for_release(self):
+        first = self.pool.acquire()
+        self.pool.acquire()
+        timer = threading.Timer(0.05, self.pool.release, [first])
+        timer.start()
+        try:
+            frame = self.pool.acquire(timeout=5.)
+        finally:
+            timer.join()
+        self.assertEqual(len(frame), 12)
+        self.assertEqual(len(self.pool), 2)
+        self.assertEqual(self.pool.in_use, 2)
+
+    def test_release_foreign_frame(self):
+        frame = self.pool.acquire()
+        self.pool.release(frame.copy())
+        self.assertEqual(self.pool.in_use, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import threading
+import unittest
+
+from chimera_t80cam.instruments.ebox.fsumove import WheelMove
+from chimera_t80cam.instruments.ebox.fsuexceptions import FilterPositionFailure
+
+
+class _Wheel(object):
+    """
+    Drives a WheelMove the way the drivers do: begin(), then wait for the
+    wheel, here ``arrive``, or for the move to be cancelled.
+    """
+
+    def __init__(self):
+        self.arrive = threading.Event()
+        self.started = threading.Event()
+        self.stops = 0
+
+    def run(self, move):
+        if not move.begin():
+            return
+        self.started.set()
+        while not self.arrive.isSet() and not move.cancelling.isSet():
+            self.arrive.wait(0.01)
+
+    def stop(self):
+        self.stops += 1
+
+    def start(self, name='wheel'):
+        return WheelMove.start(name, self.run, self.stop)
+
+
+class TestWheelMove(unittest.TestCase):
+
+    def test_done(self):
+        wheel = _Wheel()
+        move = wheel.start()
+        self.assertTrue(wheel.started.wait(5.))
+        self.assertFalse(move.done())
+        self.assertFalse(move.wait(0.01))
+        wheel.arrive.set()
+        self.assertTrue(move.result(5.))
+        self.assertTrue(move.succeeded())
+        self.assertFalse(move.cancelled())
+        self.assertFalse(move.cancel())
+        self.assertEqual(wheel.stops, 0)
+
+    def test_cancel_running(self):
+        wheel = _Wheel()
+        move = wheel.start()
+        self.assertTrue(wheel.started.wait(5.))
+        self.assertTrue(move.cancel())
+        self.assertFalse(move.result(5.))
+        self.assertTrue(move.cancelled())
+        self.assertFalse(move.succeeded())
+        self.assertEqual(wheel.stops, 1)
+
+    def test_cancel_before_begin(self):
+        wheel = _Wheel()
+        started = threading.Event()
+        cancelled = threading.Event()
+
+        def run(move):
+            started.set()
+            cancelled.wait(5.)
+            wheel.run(move)
+
+        move = WheelMove.start('wheel', run, wheel.stop)
+        self.assertTrue(started.wait(5.))
+        move.cancel()
+        cancelled.set()
+        self.assertFalse(move.result(5.))
+        # The wheel was never commanded, so there is nothing to stop.
+        self.assertFalse(wheel.started.isSet())
+        self.assertEqual(wheel.stops, 0)
+
+    def test_error(self):
+        def run(move):
+            move.begin()
+            raise FilterPositionFailure('stuck')
+
+        move = WheelMove.start('wheel', run)
+        self.assertRaises(FilterPositionFailure, move.result, 5.)
+        self.assertFalse(move.succeeded())
+        self.assertFalse(move.cancelled())
+
+    def test_timeout(self):
+        wheel = _Wheel()
+        move = wheel.start()
+        self.assertRaises(FilterPositionFailure, move.result, 0.01)
+        wheel.arrive.set()
+        move.wait(5.)
+
+    def test_callbacks(self):
+        wheel = _Wheel()
+        move = wheel.start()
+        seen = []
+
+        def callback(m):
+            # Run before waiters are woken up.
+            seen.append((m, m.done()))
+
+        def failing(m):
+            raise ValueError('callback error')
+
+        move.add_done_callback(failing)
+        move.add_done_callback(callback)
+        wheel.arrive.set()
+        self.assertTrue(move.wait(5.))
+        self.assertEqual(seen, [(move, False)])
+        self.assertTrue(move.succeeded())
+
+        # Added once the move ended, called right away.
+        move.add_done_callback(callback)
+        self.assertEqual(seen[1], (move, True))
+
+    def test_finished(self):
+        move = WheelMove.finished('wheel')
+        self.assertTrue(move.done())
+        self.assertTrue(move.result(0))
+        self.assertFalse(move.cancel())
+
+
+class TestGather(unittest.TestCase):
+
+    def test_all_done(self):
+        wheels = [_Wheel(), _Wheel()]
+        group = WheelMove.gather('wheels', [wheel.start() for wheel in wheels])
+        wheels[0].arrive.set()
+        self.assertFalse(group.wait(0.05))
+        wheels[1].arrive.set()
+        self.assertTrue(group.result(5.))
+
+    def test_cancel(self):
+        wheels = [_Wheel(), _Wheel()]
+        moves = [wheel.start() for wheel in wheels]
+        for wheel in wheels:
+            self.assertTrue(wheel.started.wait(5.))
+        group = WheelMove.gather('wheels', moves)
+        self.assertTrue(group.cancel())
+        self.assertFalse(group.result(5.))
+        self.assertTrue(all(move.cancelled() for move in moves))
+        self.assertEqual([wheel.stops for wheel in wheels], [1, 1])
+
+    def test_error(self):
+        wheel = _Wheel()
+
+        def run(move):
+            move.begin()
+            raise FilterPositionFailure('stuck')
+
+        group = WheelMove.gather('wheels', [wheel.start(), WheelMove.start('broken', run)])
+        wheel.arrive.set()
+        self.assertRaises(FilterPositionFailure, group.result, 5.)
+
+    def test_empty(self):
+        self.assertTrue(WheelMove.gather('wheels', []).result(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from chimera_t80cam.instruments.ebox.fsuregisters import RegisterSnapshot
+
+
+class _Registers(object):
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, changes):
+        self.writes.append(changes)
+
+
+VREAD0, VREAD1, REAL = 'vread0', 'vread1', 'real'
+
+
+class TestRegisterEdit(unittest.TestCase):
+
+    def setUp(self):
+        self.registers = _Registers()
+        self.regs = RegisterSnapshot(self.registers, {VREAD0: 3, VREAD1: 0b100101})
+
+    def test_bit(self):
+        self.assertTrue(self.regs.bit(VREAD1, 0))
+        self.assertFalse(self.regs.bit(VREAD1, 1))
+        self.assertTrue(self.regs.bit(VREAD1, 5))
+
+    def test_bit_edits(self):
+        edit = self.regs.edit().clear_bits(VREAD1, 1 | (1 << 5)).set_bits(VREAD1, 1 << 1)
+        self.assertEqual(edit[VREAD1], 0b000110)
+        edit.toggle_bits(VREAD1, 1 << 2 | 1 << 3)
+        self.assertEqual(edit[VREAD1], 0b001010)
+        # Not changed until flushed.
+        self.assertEqual(self.regs[VREAD1], 0b100101)
+
+    def test_flush_writes_changes_once(self):
+        regs = self.regs.edit().set(VREAD0, 7).clear_bits(VREAD1, 1).set_bits(VREAD1, 1 << 3).flush()
+        self.assertEqual(self.registers.writes, [[(VREAD0, 7), (VREAD1, 0b101100)]])
+        self.assertEqual(regs[VREAD0], 7)
+        self.assertEqual(regs[VREAD1], 0b101100)
+
+    def test_unchanged_not_written(self):
+        regs = self.regs.edit().set(VREAD0, 3).set_bits(VREAD1, 1).flush()
+        self.assertEqual(self.registers.writes, [])
+        self.assertEqual(regs[VREAD1], 0b100101)
+
+        # Toggling twice gives the value read back.
+        self.regs.edit().toggle_bits(VREAD1, 1 << 2).toggle_bits(VREAD1, 1 << 2).flush()
+        self.assertEqual(self.registers.writes, [])
+
+    def test_variable_not_read(self):
+        regs = self.regs.edit().set(REAL, 1.5).flush()
+        self.assertEqual(self.registers.writes, [[(REAL, 1.5)]])
+        self.assertEqual(regs[REAL], 1.5)
+        self.assertFalse(REAL in self.regs)
+        self.assertRaises(KeyError, self.regs.edit().set_bits, REAL, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+import numpy as N
+
+try:
+    from si.client import SIClient
+    from si.commands.camera import (Acquire, GetStatusFromCamera, InquireAcquisitionStatus, RetrieveImage,
+                                    SetAcquisitionMode, SetExposureTime, SetNumberOfFrames,
+                                    TerminateAcquisition)
+except ImportError:
+    raise unittest.SkipTest('si client package not installed')
+
+from chimera_t80cam.instruments import siprotocol
+from chimera_t80cam.instruments.sichannel import SIChannel
+from chimera_t80cam.simulators.sisim import SIServer, SICameraSimulator
+
+
+class TestSIChannel(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SICameraSimulator(width=64, height=32, readout_rate=1e6)
+        self.server = SIServer(port=0, simulator=self.sim)
+        self.server.start()
+
+        host, port = self.server.server_address
+        self.client = SIClient(host, port)
+        self.client.connect()
+        self.channel = SIChannel(self.client, timeout=5., poll_interval=0.05)
+        self.channel.start()
+
+    def tearDown(self):
+        # Ends acquisitions still running on the simulator without answering them.
+        self.sim.terminated.set()
+        self.channel.close()
+        self.client.disconnect()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _acquire(self, exptime, packets=1):
+        self.channel.executeCommand(SetExposureTime(exptime))
+        acquisition = self.channel.submit(Acquire(), deferred=True, packets=packets)
+        self.assertTrue(acquisition.wait_ack(5.))
+        return acquisition
+
+    def test_command(self):
+        status = self.channel.executeCommand(GetStatusFromCamera())
+        self.assertTrue('CCD Temp.' in status.statuslist)
+        self.assertEqual(self.channel.getStats()['sent'], {'GetStatusFromCamera': 1})
+
+    def test_polls_during_acquisition(self):
+        acquisition = self._acquire(0.5)
+        # Answers to the polls are not taken for the acquisition data.
+        status = self.channel.executeCommand(InquireAcquisitionStatus())
+        self.assertTrue(status.exp_done_percent < 100)
+        self.channel.executeCommand(GetStatusFromCamera())
+        self.assertEqual(acquisition.results, [])
+
+        self.assertTrue(acquisition.wait_results(1, 5.))
+        self.assertEqual(siprotocol.answer_data_type(acquisition.cmd), acquisition.data_type)
+        self.assertTrue(acquisition.done)
+        self.assertEqual(self.channel.getStats()['unexpected_packets'], 0)
+        self.assertEqual(self.channel.getStats()['pending'], 0)
+
+    def test_frames(self):
+        self.channel.executeCommand(SetAcquisitionMode(1))
+        self.channel.executeCommand(SetNumberOfFrames(3))
+        acquisition = self._acquire(0.05, packets=3)
+        self.assertTrue(acquisition.wait_results(3, 5.))
+        self.assertEqual(len(acquisition.results), 3)
+        self.assertTrue(acquisition.done)
+
+    def test_terminate(self):
+        acquisition = self._acquire(30.)
+        self.channel.executeCommand(TerminateAcquisition(), noAck=True)
+        self.assertTrue(acquisition.wait_results(1, 5.))
+        self.assertFalse(self.channel.broken)
+
+    def test_retrieve_image(self):
+        acquisition = self._acquire(0.)
+        self.assertTrue(acquisition.wait_results(1, 5.))
+
+        frame = N.zeros(64 * 32, dtype=siprotocol.FRAME_DTYPE)
+        self.assertEqual(self.channel.retrieve_image(RetrieveImage(0), frame), (64, 32))
+        self.assertTrue(N.all(frame == self.sim.image()))
+
+    def test_discard(self):
+        acquisition = self._acquire(30.)
+        self.channel.discard(acquisition)
+        self.assertRaises(siprotocol.SIProtocolException, acquisition.result, 1.)
+        self.assertEqual(self.channel.getStats()['pending'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
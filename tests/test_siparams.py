@@ -0,0 +1,64 @@
+import unittest
+
+from chimera_t80cam.instruments.siparams import ParameterTable, parse_value
+
+
+STATUS = """CCD Temp. (C),-99.8,C
+Chamber Pressure (mTorr),0,4,mTorr
+CCD Temp. (C),-100.1,C
+Base Temp.,-35,C
+"""
+
+PARAMETERS = """Factory,Installed CCDs,2
+Operator,Temperature Setpoint,-1000
+Factory,Serial Active Pix.,9216
+"""
+
+
+class TestParseValue(unittest.TestCase):
+
+    def test_numbers(self):
+        self.assertEqual(parse_value(' 12 '), 12)
+        self.assertEqual(parse_value('-0,5'), -0.5)
+        self.assertEqual(parse_value(' idle '), 'idle')
+
+
+class TestParameterTable(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = ParameterTable.from_status(STATUS)
+        self.pars = ParameterTable.from_parameters(PARAMETERS)
+
+    def test_exact(self):
+        self.assertEqual(self.pars.get("Installed CCDs"), 2)
+        self.assertEqual(self.pars.get("Temperature Setpoint", group="Operator"), -1000)
+        self.assertEqual(self.stats.get("Base Temp."), -35)
+
+    def test_comma_in_value(self):
+        self.assertEqual(self.stats.get("Chamber Pressure (mTorr)"), 0.4)
+
+    def test_substring(self):
+        self.assertEqual(self.stats.match("CCD Temp."), "CCD Temp. (C)")
+        self.assertEqual(self.stats.get("CCD Temp."), -99.8)
+        self.assertEqual(self.stats.get("CCD Temp.", index=1), -100.1)
+        self.assertEqual(self.stats.values("CCD Temp."), [-99.8, -100.1])
+        self.assertEqual(self.stats.entry("Chamber Pressure").unit, "mTorr")
+        self.assertTrue("Chamber Pressure" in self.stats)
+        self.assertEqual(self.pars.get("Setpoint"), -1000)
+        self.assertTrue(("Operator", "Setpoint") in self.pars)
+        self.assertFalse(("Factory", "Setpoint") in self.pars)
+
+    def test_exact_before_substring(self):
+        stats = ParameterTable.from_status("CCD Temp. Max,-20,C\nCCD Temp.,-100,C\n")
+        self.assertEqual(stats.get("CCD Temp."), -100)
+
+    def test_missing(self):
+        self.assertEqual(self.stats.get("Cooler Power", -999.), -999.)
+        self.assertEqual(self.stats.entry("CCD Temp.", index=2), None)
+        self.assertEqual(self.stats.values("Cooler Power"), [])
+        self.assertFalse("Cooler Power" in self.stats)
+        self.assertEqual(ParameterTable().match("CCD Temp."), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from chimera_t80cam.instruments.telemetry import TelemetryBuffer, TelemetrySampler
+
+
+class TestTelemetryBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.buf = TelemetryBuffer(['temp', 'pres'], size=4)
+
+    def test_empty(self):
+        self.assertEqual(len(self.buf), 0)
+        self.assertEqual(len(self.buf.snapshot()), 0)
+        self.assertEqual(self.buf.latest('temp', -999.), -999.)
+        self.assertEqual(self.buf.at('temp', 10., -999.), -999.)
+
+    def test_snapshot(self):
+        self.buf.add({'temp': -100., 'pres': 1., 'other': 5.}, 10.)
+        self.buf.add({'temp': -101.}, 20.)
+        samples = self.buf.snapshot()
+        self.assertEqual(samples.shape, (2, 3))
+        self.assertEqual(list(samples[:, 0]), [10., 20.])
+        self.assertEqual(list(samples[:, 1]), [-100., -101.])
+        self.assertEqual(self.buf.latest('temp'), -101.)
+        self.assertEqual(self.buf.latest('pres', -999.), -999.)
+
+    def test_wraparound(self):
+        for i in range(10):
+            self.buf.add({'temp': i}, 100. + i)
+        self.assertEqual(len(self.buf), 4)
+        # Oldest first. The slot after the last sample is left out, the
+        # writer would be overwriting it next.
+        self.assertEqual(list(self.buf.snapshot()[:, 0]), [107., 108., 109.])
+        self.assertEqual(self.buf.latest('temp'), 9.)
+
+    def test_at(self):
+        self.buf.add({'temp': -100., 'pres': 2.}, 10.)
+        self.buf.add({'temp': -90.}, 20.)
+        self.buf.add({'temp': -80., 'pres': 4.}, 30.)
+        self.assertEqual(self.buf.at('temp', 15.), -95.)
+        self.assertEqual(self.buf.at('temp', 30.), -80.)
+        # Samples without the field are skipped.
+        self.assertEqual(self.buf.at('pres', 20.), 3.)
+        # Nearest sample outside of the range kept.
+        self.assertEqual(self.buf.at('temp', 0.), -100.)
+        self.assertEqual(self.buf.at('temp', 40.), -80.)
+
+    def test_at_after_wraparound(self):
+        for i in range(10):
+            self.buf.add({'temp': 2. * i}, 100. + i)
+        self.assertEqual(self.buf.at('temp', 108.5), 17.)
+        self.assertEqual(self.buf.at('temp', 101.), 14.)
+
+
+class TestTelemetrySampler(unittest.TestCase):
+
+    def test_sample_now(self):
+        values = [{}, {'temp': -100.}, {'temp': -99., 'pres': 1.}]
+        sampler = TelemetrySampler(lambda: values.pop(0), size=8)
+        sampler.sampleNow()
+        self.assertEqual(sampler.buffer, None)
+        sampler.sampleNow()
+        sampler.sampleNow()
+        self.assertEqual(sampler.buffer.fields, ['temp'])
+        self.assertEqual(len(sampler.buffer), 2)
+        self.assertEqual(sampler.buffer.latest('temp'), -99.)
+        self.assertFalse(sampler.running)
+
+
+if __name__ == '__main__':
+    unittest.main()